@@ -0,0 +1,52 @@
+"""Micro-benchmark of finding the language of a file by its name.
+Compares the regex-based extension extraction followed by a dictionary
+lookup with ExtLangMapper.classify.
+
+Run from the repository root: python benchmark/ext_lookup_benchmark.py"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'frege_extractor'))
+# config.py requires these variables, the benchmark does not connect anywhere
+for variable in ('RMQ_HOST', 'RMQ_PORT', 'RMQ_REJECTED_PUBLISH_DELAY', 'DB_HOST', 'DB_PORT',
+                 'DB_DATABASE', 'DB_USERNAME', 'DB_PASSWORD'):
+    os.environ.setdefault(variable, '0')
+
+from ext_lang_mapper import ExtLangMapper
+
+LANGUAGES = [(1, 'C'), (2, 'C++'), (3, 'C#'), (4, 'CSS'), (5, 'Java'),
+             (6, 'JS'), (7, 'PHP'), (8, 'Python'), (9, 'Ruby')]
+
+# Mix of file names typical for a repository, source files and others
+FILENAMES = [
+    'main.c', 'util.h', 'parser.cpp', 'parser.hpp', 'Program.cs', 'style.css', 'Main.java',
+    'index.js', 'index.php', '__init__.py', 'setup.py', 'app.rb', 'README.md', 'LICENSE',
+    'Makefile', '.gitignore', 'logo.png', 'data.json', 'package-lock.json', 'archive.tar.gz',
+    'CMakeLists.txt', 'test_parser.py', 'Gemfile', 'module.min.js', 'notes.txt',
+] * 40
+
+
+def main():
+    mapper = ExtLangMapper(LANGUAGES)
+    ext_pattern = re.compile(r'\.([0-9a-zA-Z]*)$')
+
+    def regex_lookup():
+        for filename in FILENAMES:
+            ext_search = ext_pattern.search(filename)
+            mapper.get_language_id(ext_search.group(1) if ext_search else None)
+
+    def classify_lookup():
+        classify = mapper.classify
+        for filename in FILENAMES:
+            classify(filename)
+
+    number = 200
+    for name, function in (('regex + dict', regex_lookup), ('classify', classify_lookup)):
+        best = min(timeit.repeat(function, number=number, repeat=5))
+        print(f"{name:>14}: {best / (number * len(FILENAMES)) * 1e9:7.1f} ns per file")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,393 @@
+"""Benchmark of repository scans on synthetic repositories.
+Generates a repository of configurable shape, then measures the walk alone
+(RepoScanner.iter_repo_files_langs) and the whole scan with the database write
+(RepoScanner.run_scanner), with the database replaced by an in-memory SQLite
+stand-in of DbManager. Reports files per second, peak RSS, the numbers of
+directory listings (os.scandir, each a loop of getdents syscalls) and stat calls
+(os.stat, os.lstat and DirEntry.stat) counted in an extra run of every stage
+with the os functions wrapped, and the numbers of read/write syscalls
+(from /proc/self/io, Linux only).
+
+With --baseline, results are compared with a JSON report of an earlier run
+(written with --json) and the benchmark fails if throughput dropped by more
+than --max-regression.
+
+Run from the repository root: python benchmark/scan_benchmark.py --files 100000"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import resource
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'frege_extractor'))
+# config.py requires these variables, the benchmark does not connect anywhere
+for variable in ('RMQ_HOST', 'RMQ_PORT', 'RMQ_REJECTED_PUBLISH_DELAY', 'DB_HOST', 'DB_PORT',
+                 'DB_DATABASE', 'DB_USERNAME', 'DB_PASSWORD'):
+    os.environ.setdefault(variable, '0')
+
+import repo_scanner
+from repo_scanner import RepoScanner
+from db_manager import RepositoryNotFoundError
+
+LANGUAGES = [(1, 'C'), (2, 'C++'), (3, 'C#'), (4, 'CSS'), (5, 'Java'),
+             (6, 'JS'), (7, 'PHP'), (8, 'Python'), (9, 'Ruby')]
+
+# Extensions of generated files by language, None for files that are not source files
+EXTENSIONS = {
+    'C': ['c', 'h'], 'C++': ['cpp', 'hpp', 'cc'], 'C#': ['cs'], 'CSS': ['css'], 'Java': ['java'],
+    'JS': ['js'], 'PHP': ['php'], 'Python': ['py'], 'Ruby': ['rb'],
+    None: ['md', 'txt', 'json', 'png', 'yml', 'xml'],
+}
+DEFAULT_LANGUAGE_MIX = 'Python=3,JS=3,Java=2,C=1,C++=1,C#=1,CSS=1,PHP=1,Ruby=1,other=4'
+VENDORED_DIRS = ['node_modules', 'vendor', 'third_party']
+
+SCHEMA = """
+CREATE TABLE repositories (repo_id TEXT PRIMARY KEY);
+CREATE TABLE repository_language (id INTEGER PRIMARY KEY, repository_id TEXT, language_id INTEGER,
+                                  present BOOLEAN, analyzed BOOLEAN);
+CREATE TABLE repository_language_file (repository_language_id INTEGER, file_path TEXT);
+"""
+
+
+class SqliteDbManager:
+    """In-memory SQLite stand-in of the DbManager methods used by RepoScanner"""
+    connection = None
+
+    @staticmethod
+    def reset(repo_ids):
+        SqliteDbManager.connection = sqlite3.connect(':memory:')
+        SqliteDbManager.connection.executescript(SCHEMA)
+        SqliteDbManager.connection.executemany("INSERT INTO repositories VALUES (?)", [(r,) for r in repo_ids])
+
+    @staticmethod
+    def select_languages():
+        return LANGUAGES
+
+    @staticmethod
+    def save_repository_scan(repo_id, present_lang_ids, files_langs, incremental=False, check_repository=True,
+                             file_stats=False):
+        """Same semantics as DbManager.save_repository_scan, in a single transaction.
+        Sizes and line counts of the files are measured, but not stored"""
+        connection = SqliteDbManager.connection
+        streaming = present_lang_ids is None
+        present_lang_ids = set() if streaming else set(present_lang_ids)
+
+        def repo_lang_files():
+            for file, lang, *_ in files_langs:
+                if streaming:
+                    present_lang_ids.add(lang)
+                yield repo_lang_ids[lang], file
+
+        def set_present():
+            connection.executemany("UPDATE repository_language SET present = 1 "
+                                   "WHERE repository_id = ? AND language_id = ?",
+                                   [(repo_id, lang_id) for lang_id in present_lang_ids])
+
+        with connection:
+            if check_repository and connection.execute(
+                    "SELECT 1 FROM repositories WHERE repo_id = ? LIMIT 1", (repo_id,)).fetchone() is None:
+                raise RepositoryNotFoundError(repo_id)
+            rows = connection.execute("SELECT language_id, id FROM repository_language WHERE repository_id = ?",
+                                      (repo_id,)).fetchall()
+            # Like UPSERT_REPOSITORY_LANGUAGES_QUERY: entries of all languages are inserted if there
+            # are none, and the given present languages are marked
+            if not rows:
+                connection.executemany(
+                    "INSERT INTO repository_language (repository_id, language_id, present, analyzed) "
+                    "VALUES (?, ?, ?, 0)",
+                    [(repo_id, lang_id, lang_id in present_lang_ids) for lang_id, _ in LANGUAGES])
+                rows = connection.execute("SELECT language_id, id FROM repository_language "
+                                          "WHERE repository_id = ?", (repo_id,)).fetchall()
+            else:
+                set_present()
+            repo_lang_ids = dict(rows)
+            if incremental:
+                connection.execute("CREATE TEMPORARY TABLE scanned_file (repository_language_id, file_path)")
+                connection.executemany("INSERT INTO scanned_file VALUES (?, ?)", repo_lang_files())
+                connection.execute(
+                    "DELETE FROM repository_language_file WHERE repository_language_id IN "
+                    "(SELECT id FROM repository_language WHERE repository_id = ?) AND NOT EXISTS "
+                    "(SELECT 1 FROM scanned_file s WHERE s.repository_language_id = "
+                    "repository_language_file.repository_language_id AND s.file_path = "
+                    "repository_language_file.file_path)", (repo_id,))
+                connection.execute(
+                    "INSERT INTO repository_language_file SELECT DISTINCT * FROM scanned_file s WHERE NOT EXISTS "
+                    "(SELECT 1 FROM repository_language_file f WHERE f.repository_language_id = "
+                    "s.repository_language_id AND f.file_path = s.file_path)")
+                connection.execute("DROP TABLE scanned_file")
+                # Only incremental saves reset 'present' of languages that are no longer found
+                connection.execute("UPDATE repository_language SET present = 0 WHERE repository_id = ?",
+                                   (repo_id,))
+                set_present()
+            else:
+                connection.executemany("INSERT INTO repository_language_file VALUES (?, ?)", repo_lang_files())
+                if streaming:
+                    set_present()
+        return repo_lang_ids, present_lang_ids
+
+
+def parse_language_mix(mix):
+    """:returns list of (language name or None for other files, weight) tuples"""
+    weights = []
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        weights.append((None if name == 'other' else name, float(weight or 1)))
+    return weights
+
+
+def generate_repository(path, files, depth, fanout, language_mix, vendored, seed):
+    """Creates a repository of empty files in a directory tree of given depth and fan-out.
+    A fraction of the files goes to vendored directories, which are pruned by the scanner
+    :returns number of created source files outside vendored directories"""
+    rng = random.Random(seed)
+    languages, weights = zip(*language_mix)
+    directories = ['']
+    level = ['']
+    for _ in range(depth):
+        level = [os.path.join(parent, 'd{}'.format(i)) for parent in level for i in range(fanout)]
+        directories.extend(level)
+    vendored_directories = [os.path.join(directory, rng.choice(VENDORED_DIRS), 'pkg')
+                            for directory in directories[:max(1, len(directories) // 10)]]
+    for directory in directories + vendored_directories:
+        os.makedirs(os.path.join(path, directory), exist_ok=True)
+
+    source_files = 0
+    for i in range(files):
+        in_vendored = rng.random() < vendored
+        directory = rng.choice(vendored_directories if in_vendored else directories)
+        language = rng.choices(languages, weights)[0]
+        extension = rng.choice(EXTENSIONS[language])
+        fd = os.open(os.path.join(path, directory, 'f{}.{}'.format(i, extension)), os.O_CREAT | os.O_WRONLY, 0o644)
+        os.close(fd)
+        if language is not None and not in_vendored:
+            source_files += 1
+    return source_files
+
+
+def read_io_counters():
+    """:returns dictionary of I/O counters of the process, empty if not available"""
+    try:
+        with open('/proc/self/io') as file:
+            return dict((key, int(value)) for key, value in (line.split(': ') for line in file))
+    except OSError:
+        return {}
+
+
+class _CountedEntry:
+    """DirEntry counting its stat calls"""
+    __slots__ = ('_entry', '_counter')
+
+    def __init__(self, entry, counter):
+        self._entry = entry
+        self._counter = counter
+
+    def __getattr__(self, name):
+        return getattr(self._entry, name)
+
+    def __fspath__(self):
+        return self._entry.__fspath__()
+
+    def stat(self, *, follow_symlinks=True):
+        self._counter.add('stat_calls')
+        return self._entry.stat(follow_symlinks=follow_symlinks)
+
+
+class _CountedScandir:
+    """Iterator of os.scandir yielding entries counting their stat calls"""
+
+    def __init__(self, iterator, counter):
+        self._iterator = iterator
+        self._counter = counter
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._iterator.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return _CountedEntry(next(self._iterator), self._counter)
+
+    def close(self):
+        self._iterator.close()
+
+
+class CallCounter:
+    """Context manager counting directory listings (os.scandir) and stat calls (os.stat,
+    os.lstat and DirEntry.stat) made by any thread, by wrapping the os functions.
+    Checks of DirEntry.is_dir() served from the directory listing are not syscalls, and are not counted"""
+
+    def __init__(self):
+        self.counts = {'scandir_calls': 0, 'stat_calls': 0}
+        self._lock = threading.Lock()
+        self._originals = None
+
+    def add(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def __enter__(self):
+        scandir, stat, lstat = self._originals = os.scandir, os.stat, os.lstat
+
+        def counted_scandir(*args, **kwargs):
+            self.add('scandir_calls')
+            return _CountedScandir(scandir(*args, **kwargs), self)
+
+        def counted_stat(*args, **kwargs):
+            self.add('stat_calls')
+            return stat(*args, **kwargs)
+
+        def counted_lstat(*args, **kwargs):
+            self.add('stat_calls')
+            return lstat(*args, **kwargs)
+
+        os.scandir, os.stat, os.lstat = counted_scandir, counted_stat, counted_lstat
+        return self
+
+    def __exit__(self, *exc_info):
+        os.scandir, os.stat, os.lstat = self._originals
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(name, function):
+    """Runs the function once
+    :returns dictionary of the result: stage name, seconds, files, files per second,
+    peak RSS, and numbers of read and write syscalls. Directory listings and
+    stat calls are counted apart, by count_calls"""
+    io_before = read_io_counters()
+    start = time.perf_counter()
+    files = function()
+    seconds = time.perf_counter() - start
+    io_after = read_io_counters()
+    return {
+        'stage': name,
+        'seconds': round(seconds, 4),
+        'files': files,
+        'files_per_second': round(files / seconds) if seconds else 0,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'read_syscalls': io_after.get('syscr', 0) - io_before.get('syscr', 0),
+        'write_syscalls': io_after.get('syscw', 0) - io_before.get('syscw', 0),
+    }
+
+
+def count_calls(function):
+    """Runs the function once with the os functions wrapped, so the timed runs are not slowed down
+    :returns dictionary of numbers of directory listings and stat calls"""
+    with CallCounter() as counter:
+        function()
+    return counter.counts
+
+
+def run(args):
+    directory = args.dir or tempfile.mkdtemp(prefix='scan-benchmark-')
+    repo_id = 'synthetic-repo'
+    repo_path = os.path.join(directory, repo_id)
+    try:
+        if not os.path.isdir(repo_path):
+            print(f"Generating {args.files} files in {repo_path}...")
+            generate_repository(repo_path, args.files, args.depth, args.fanout,
+                                parse_language_mix(args.language_mix), args.vendored, args.seed)
+
+        repo_scanner.DbManager = SqliteDbManager
+        SqliteDbManager.reset([repo_id])
+        scanner = RepoScanner(directory, languages=LANGUAGES, streaming=args.streaming,
+                              incremental=args.incremental, walk_threads=args.walk_threads,
+                              cache_dir='', log_files=False, line_counts=args.line_counts)
+
+        def walk():
+            return sum(1 for _ in scanner.iter_repo_files_langs(repo_id))
+
+        def scan():
+            scanner.run_scanner(repo_id)
+            return SqliteDbManager.connection.execute("SELECT count(*) FROM repository_language_file").fetchone()[0]
+
+        results = []
+        for _ in range(args.repeat):
+            results.append(measure('walk', walk))
+            SqliteDbManager.reset([repo_id])
+            results.append(measure('scan', scan))
+        counts = {'walk': count_calls(walk)}
+        SqliteDbManager.reset([repo_id])
+        counts['scan'] = count_calls(scan)
+        for result in results:
+            result.update(counts[result['stage']])
+        return results
+    finally:
+        if not args.dir:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def best_results(results):
+    """:returns the fastest result of every stage"""
+    best = {}
+    for result in results:
+        if result['stage'] not in best or result['seconds'] < best[result['stage']]['seconds']:
+            best[result['stage']] = result
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--files', type=int, default=20000, help="number of generated files")
+    parser.add_argument('--depth', type=int, default=3, help="depth of the directory tree")
+    parser.add_argument('--fanout', type=int, default=6, help="number of subdirectories of every directory")
+    parser.add_argument('--language-mix', default=DEFAULT_LANGUAGE_MIX,
+                        help="comma-separated language=weight pairs, 'other' for non-source files")
+    parser.add_argument('--vendored', type=float, default=0.1, help="fraction of files in vendored directories")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dir', help="directory of the generated repository, kept and reused if given")
+    parser.add_argument('--streaming', action='store_true', help="stream files to the database during the walk")
+    parser.add_argument('--incremental', action='store_true', help="write only the difference of the files")
+    parser.add_argument('--walk-threads', type=int, default=0)
+    parser.add_argument('--line-counts', action='store_true', help="measure sizes and line counts of the files")
+    parser.add_argument('--repeat', type=int, default=3, help="number of runs, the best one is reported")
+    parser.add_argument('--json', help="file the report is written to")
+    parser.add_argument('--baseline', help="report of an earlier run to compare with")
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help="maximum allowed drop of files per second against the baseline")
+    args = parser.parse_args()
+
+    best = best_results(run(args))
+    print(f"{'stage':>6} {'seconds':>9} {'files':>9} {'files/s':>10} {'RSS MB':>8} {'scandir':>8} {'stat':>8} "
+          f"{'reads':>8} {'writes':>8}")
+    for result in best.values():
+        print(f"{result['stage']:>6} {result['seconds']:>9.3f} {result['files']:>9} "
+              f"{result['files_per_second']:>10} {result['peak_rss_mb']:>8.1f} "
+              f"{result['scandir_calls']:>8} {result['stat_calls']:>8} "
+              f"{result['read_syscalls']:>8} {result['write_syscalls']:>8}")
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'args': vars(args), 'results': best}, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)['results']
+        failed = False
+        for stage, result in best.items():
+            if stage not in baseline or not baseline[stage]['files_per_second']:
+                continue
+            change = result['files_per_second'] / baseline[stage]['files_per_second'] - 1
+            print(f"{stage}: {change:+.1%} files/s against the baseline")
+            if change < -args.max_regression:
+                failed = True
+        if failed:
+            print("Throughput regression above {:.0%}".format(args.max_regression))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import asyncpg
+import logging
+from db_manager import CREATE_SCANNED_FILE_QUERY, SYNC_REPOSITORY_LANGUAGE_FILES_QUERY, REPOSITORY_LOCK_CLASS, \
+    RepositoryNotFoundError
+from config import DB_HOST, DB_PORT, DB_DATABASE, DB_USERNAME, DB_PASSWORD, DB_POOL_SIZE, DB_POOL_MAX_IDLE, \
+    DB_REPOSITORY_LOCK
+
+# Same statement as db_manager.UPSERT_REPOSITORY_LANGUAGES_QUERY, with asyncpg parameters
+UPSERT_REPOSITORY_LANGUAGES_QUERY = """
+WITH existing AS (
+    SELECT language_id, id FROM repository_language WHERE repository_id = $1
+), inserted AS (
+    INSERT INTO repository_language (repository_id, language_id, present, analyzed)
+    SELECT $1, languages.id, languages.id = ANY($2::int[]), 'False' FROM languages
+    WHERE NOT EXISTS (SELECT 1 FROM existing)
+    RETURNING language_id, id
+), updated AS (
+    UPDATE repository_language SET present = 'True'
+    WHERE repository_id = $1 AND language_id = ANY($2::int[])
+)
+SELECT language_id, id FROM existing
+UNION ALL
+SELECT language_id, id FROM inserted
+"""
+
+
+# Same statement as db_manager.SYNC_REPOSITORY_LANGUAGE_FILES_QUERY, with asyncpg parameters
+SYNC_REPOSITORY_LANGUAGE_FILES_QUERY = SYNC_REPOSITORY_LANGUAGE_FILES_QUERY.replace('%(repo_id)s', '$1')
+
+
+class AsyncDbManager:
+    """Database access for the asyncio service, on a pool of asyncpg connections"""
+
+    def __init__(self):
+        self._pool = None
+
+    async def connect(self):
+        logging.info(f"Creating database connection pool (size: {DB_POOL_SIZE}, "
+                     f"max idle: {DB_POOL_MAX_IDLE} s)")
+        self._pool = await asyncpg.create_pool(
+            host=DB_HOST,
+            port=DB_PORT,
+            database=DB_DATABASE,
+            user=DB_USERNAME,
+            password=DB_PASSWORD,
+            min_size=1,
+            max_size=DB_POOL_SIZE,
+            max_inactive_connection_lifetime=DB_POOL_MAX_IDLE)
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+
+    async def select_languages(self):
+        """:returns list of (id, name) tuples of languages"""
+        rows = await self._pool.fetch("SELECT * FROM languages")
+        return [tuple(row) for row in rows]
+
+    async def select_repository_by_id(self, repo_id):
+        return await self._pool.fetch("SELECT * FROM repositories WHERE repo_id = $1", repo_id)
+
+    async def save_repository_scan(self, repo_id, files_langs, incremental=False, check_repository=True):
+        """Upserts repository_language entries of given repo and streams its
+        repository_language_file entries with COPY, in a single transaction.
+        In incremental mode, only the difference against the stored files is written,
+        like in DbManager.save_repository_scan. If check_repository is set, the transaction
+        first checks that the repository exists. Saves of the same repository are
+        serialized with an advisory lock if DB_REPOSITORY_LOCK is set.
+        :param files_langs: asynchronous iterable of (file_path, language_id) tuples
+        :returns set of present language ids
+        :raises KeyError if an entry for a language of some file is missing
+        :raises RepositoryNotFoundError if the repository does not exist"""
+        present_lang_ids = set()
+
+        async def repo_lang_files():
+            async for file, lang in files_langs:
+                present_lang_ids.add(lang)
+                yield repo_lang_ids[lang], file
+
+        async with self._pool.acquire() as connection:
+            async with connection.transaction():
+                if check_repository and await connection.fetchval(
+                        "SELECT 1 FROM repositories WHERE repo_id = $1 LIMIT 1", repo_id) is None:
+                    raise RepositoryNotFoundError(repo_id)
+                if DB_REPOSITORY_LOCK:
+                    await connection.execute("SELECT pg_advisory_xact_lock($1, hashtext($2))",
+                                             REPOSITORY_LOCK_CLASS, repo_id)
+                repo_lang_ids = dict(
+                    (row['language_id'], row['id'])
+                    for row in await connection.fetch(UPSERT_REPOSITORY_LANGUAGES_QUERY, repo_id, []))
+                if incremental:
+                    await connection.execute(CREATE_SCANNED_FILE_QUERY)
+                    await connection.copy_records_to_table(
+                        'scanned_file', records=repo_lang_files(),
+                        columns=['repository_language_id', 'file_path'])
+                    await connection.execute("ANALYZE scanned_file")
+                    removed, added = await connection.fetchrow(SYNC_REPOSITORY_LANGUAGE_FILES_QUERY, repo_id)
+                    logging.info(f"Incremental scan of '{repo_id}': {added} new files, {removed} removed files")
+                    await connection.execute(
+                        "UPDATE repository_language SET present = (language_id = ANY($2::int[])) "
+                        "WHERE repository_id = $1",
+                        repo_id, list(present_lang_ids))
+                else:
+                    await connection.copy_records_to_table(
+                        'repository_language_file', records=repo_lang_files(),
+                        columns=['repository_language_id', 'file_path'])
+                    if present_lang_ids:
+                        await connection.execute(
+                            "UPDATE repository_language SET present = 'True' "
+                            "WHERE repository_id = $1 AND language_id = ANY($2::int[])",
+                            repo_id, list(present_lang_ids))
+        return present_lang_ids
@@ -0,0 +1,22 @@
+# Configure logging
+import logging
+logging.basicConfig(
+    handlers=[logging.StreamHandler()],
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s: %(message)s',
+    datefmt='%H:%M:%S')
+
+
+import asyncio
+from async_messenger import AsyncMessenger
+from metrics import start_exporter
+from config import RABBITMQ_HOST, RABBITMQ_PORT
+
+
+if __name__ == '__main__':
+    logging.info("Starting frege-extractor app (asyncio)")
+    start_exporter()
+    try:
+        asyncio.run(AsyncMessenger().app(RABBITMQ_HOST, RABBITMQ_PORT))
+    except KeyboardInterrupt:
+        logging.info(" Exiting...")
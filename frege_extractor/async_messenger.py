@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import aio_pika
+from concurrent.futures import ThreadPoolExecutor
+from async_db_manager import AsyncDbManager
+from db_manager import RepositoryNotFoundError
+from repo_scanner import RepoScanner
+from metrics import TimedIterator, observe_scan, MESSAGES, PUBLISH_CONFIRM_SECONDS, QUEUE_WAIT_SECONDS
+from config import INPUT_QUEUE, OUTPUT_QUEUES, REPOSITORIES_DIRECTORY, RMQ_REJECTED_PUBLISH_DELAY, \
+    RMQ_MAX_PUBLISH_DELAY, EXTRACTOR_MAX_IN_FLIGHT, SCAN_BATCH_SIZE, SCAN_INCREMENTAL
+
+
+def _take(iterator, size):
+    """:returns list of at most size next items of the iterator"""
+    batch = []
+    for item in iterator:
+        batch.append(item)
+        if len(batch) == size:
+            break
+    return batch
+
+
+class AsyncMessenger:
+    """Asyncio counterpart of Messenger. Every input message is handled in its own
+    task: the repository walk runs in a thread pool, found files are streamed
+    to the database and output messages are published with confirms, while
+    up to max_in_flight messages are processed at the same time."""
+
+    def __init__(self, max_in_flight=EXTRACTOR_MAX_IN_FLIGHT):
+        self._max_in_flight = max_in_flight
+        self._db = AsyncDbManager()
+        self._channel = None
+        # Walks are blocking, they run in threads of this pool
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.repo_scanner = None
+
+    async def app(self, rabbitmq_host, rabbitmq_port):
+        """Main coroutine of the app. Connects to the database and RabbitMQ,
+        consumes input messages until cancelled"""
+        await self._db.connect()
+        languages = await self._db.select_languages()
+        # Given the languages, RepoScanner does not query the database
+        self.repo_scanner = RepoScanner(REPOSITORIES_DIRECTORY, languages=languages)
+
+        logging.info(f"Connecting to RabbitMQ ({rabbitmq_host}:{rabbitmq_port})...")
+        connection = await aio_pika.connect_robust(host=rabbitmq_host, port=int(rabbitmq_port))
+        try:
+            self._channel = await connection.channel(publisher_confirms=True)
+            await self._channel.set_qos(prefetch_count=self._max_in_flight)
+            queue = await self._channel.declare_queue(INPUT_QUEUE, durable=True)
+            for q_name in OUTPUT_QUEUES.values():
+                await self._channel.declare_queue(q_name, durable=True)
+            logging.info("Connected.")
+
+            in_flight = asyncio.Semaphore(self._max_in_flight)
+            tasks = set()
+            logging.info(' [*] Waiting for messages about extracting new repos...')
+            async with queue.iterator() as messages:
+                async for message in messages:
+                    received = time.perf_counter()
+                    await in_flight.acquire()
+                    task = asyncio.create_task(self._input_callback(message, received))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    task.add_done_callback(lambda _: in_flight.release())
+        finally:
+            await connection.close()
+            await self._db.close()
+            self._executor.shutdown(wait=False)
+
+    async def _input_callback(self, message, received):
+        """Handles input message: scans the repository, persists found files
+        and sends output messages. The message is acknowledged afterwards"""
+        QUEUE_WAIT_SECONDS.observe(time.perf_counter() - received)
+        body_dec = message.body.decode('utf-8')
+        logging.info("Received a new message: {}".format(body_dec))
+        try:
+            content = json.loads(body_dec)
+            lang_names = await self._validate_scan_repo(content)
+            published = time.perf_counter()
+            await self._send_message(content, [OUTPUT_QUEUES[lang_name] for lang_name in lang_names])
+            PUBLISH_CONFIRM_SECONDS.observe(time.perf_counter() - published)
+        except json.decoder.JSONDecodeError as err:
+            logging.error("Exception: the message doesn't have a correct JSON format. {}".format(err))
+            MESSAGES.inc(1, 'error')
+        except Exception as e:
+            logging.error("Exception while handling input message or scanning repo. "
+                          "Aborting any further process for this message.\n Cause: {}".format(e))
+            MESSAGES.inc(1, 'error')
+        else:
+            MESSAGES.inc(1, 'ok')
+            logging.info("Finished extractor task.\n")
+        await message.ack()
+
+    async def _validate_scan_repo(self, message):
+        """Validates input message, scans the repository and saves found files
+        :returns language names found in the repository"""
+        if 'repo_id' not in message:
+            raise Exception("Did not found \"repo_id\" entry in the JSON message")
+        repo_id = str(message['repo_id'])
+        if not os.path.isdir(os.path.join(REPOSITORIES_DIRECTORY, repo_id)):
+            raise Exception('\'{}\' was not found in the download directory of repositories'.format(repo_id))
+        logging.info("Running repo scanner for \'{}\'".format(repo_id))
+        start = time.perf_counter()
+        iterator = await asyncio.get_running_loop().run_in_executor(
+            self._executor, self.repo_scanner.scan_repo_files_langs, repo_id)
+        # Measures the walk apart from the database write
+        timed_files = TimedIterator(iterator)
+        try:
+            present_langs = await self._db.save_repository_scan(
+                repo_id, self._iter_batches(timed_files), SCAN_INCREMENTAL)
+        except RepositoryNotFoundError:
+            raise Exception(f'Did not found repository \'{repo_id}\' in the repositories table.')
+        except KeyError as e:
+            raise Exception(
+                f"A repository_language entry for language ID={e} and repo \'{repo_id}\'"
+                f" is missing, but other entries for this repo were found.")
+        observe_scan(self.repo_scanner.get_language_name, timed_files, time.perf_counter() - start)
+        if not present_langs:
+            logging.warning("No known source files found in the repo")
+        logging.info("Repository scan complete")
+        return self.repo_scanner.get_language_names(present_langs)
+
+    async def _iter_batches(self, iterator):
+        """Asynchronous iterator of source files of the repo. The walk advances
+        in batches in the thread pool, so the event loop is never blocked"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await loop.run_in_executor(self._executor, _take, iterator, SCAN_BATCH_SIZE)
+            if not batch:
+                return
+            for file_lang in batch:
+                yield file_lang
+
+    async def _send_message(self, message, queues):
+        """Sends output message to all queues at once and waits for
+        the confirms, retrying rejected ones with exponential backoff"""
+        body = bytes(json.dumps(message), encoding='utf8')
+        await asyncio.gather(*(self._publish(queue, body) for queue in queues))
+
+    async def _publish(self, queue, body):
+        delay = RMQ_REJECTED_PUBLISH_DELAY
+        while True:
+            try:
+                logging.info(f"Sending message to {queue}...")
+                await self._channel.default_exchange.publish(
+                    aio_pika.Message(body=body, delivery_mode=aio_pika.DeliveryMode.PERSISTENT),
+                    routing_key=queue)
+                logging.info(f"Output message to {queue} received by RabbitMQ")
+                return
+            except aio_pika.exceptions.DeliveryError:
+                logging.info(f"Output message to {queue} NACK from RabbitMQ (queue full)."
+                             f" Retrying in {delay} s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RMQ_MAX_PUBLISH_DELAY)
@@ -0,0 +1,212 @@
+# Configure logging
+import logging
+logging.basicConfig(
+    handlers=[logging.StreamHandler()],
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s: %(message)s',
+    datefmt='%H:%M:%S')
+
+
+import os
+import json
+import time
+import argparse
+import pika
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from db_manager import DbManager
+from repo_scanner import RepoScanner, FileList
+from publisher import Publisher
+from config import REPOSITORIES_DIRECTORY, OUTPUT_QUEUES, RABBITMQ_HOST, RABBITMQ_PORT, SCAN_INCREMENTAL
+
+# Suffix of the file with repo ids whose output messages were published, next to the checkpoint file
+PUBLISHED_SUFFIX = '.published'
+
+# RepoScanner of a worker process
+_scanner = None
+
+
+def _init_worker(repos_directory, languages):
+    global _scanner
+    logging.getLogger().setLevel(logging.WARNING)
+    _scanner = RepoScanner(repos_directory, languages=languages, streaming=False, log_files=False)
+
+
+def _scan(repo_id):
+    """Runs in a worker process
+    :returns tuple of repo id and FileList of its source files, or repo id and the error message"""
+    try:
+        files = FileList()
+        files.add_all(_scanner.scan_repo_dir_files_langs(repo_id))
+        return repo_id, files
+    except Exception as e:
+        return repo_id, str(e)
+
+
+def read_checkpoint(path):
+    """:returns dictionary mapping repo ids saved in earlier runs to their present language names"""
+    done = {}
+    try:
+        with open(path) as file:
+            for line in file:
+                repo_id, _, lang_names = line.rstrip('\n').partition('\t')
+                done[repo_id] = lang_names.split(',') if lang_names else []
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def append_checkpoint(path, saved):
+    """Records saved repositories, after their transaction has committed
+    :param saved: dictionary mapping repo ids to present language names"""
+    with open(path, 'a') as file:
+        for repo_id, lang_names in saved.items():
+            file.write('{}\t{}\n'.format(repo_id, ','.join(lang_names)))
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def list_repositories(repos_directory):
+    """:returns sorted ids of the repositories: names of folders in the repositories directory"""
+    with os.scandir(repos_directory) as entries:
+        return sorted(entry.name for entry in entries if entry.is_dir(follow_symlinks=False))
+
+
+class Backfill:
+    """Scans all repositories of the repositories directory in a process pool and saves
+    them in multi-repository transactions, without RabbitMQ. Saved repositories are
+    recorded in a checkpoint file, so an interrupted backfill continues where it stopped"""
+
+    def __init__(self, repos_directory, checkpoint, processes, batch_size, incremental):
+        self.repos_directory = repos_directory
+        self.checkpoint = checkpoint
+        self.processes = processes
+        self.batch_size = batch_size
+        self.incremental = incremental
+        self._language_id_name = None
+
+    def run(self):
+        languages = DbManager.select_languages()
+        self._language_id_name = dict(languages)
+        # Worker processes do not use the database, its connections are not shared with them
+        DbManager.close_pool()
+
+        done = read_checkpoint(self.checkpoint)
+        repo_ids = [repo_id for repo_id in list_repositories(self.repos_directory) if repo_id not in done]
+        logging.info(f"{len(done)} repositories saved in earlier runs, {len(repo_ids)} to scan")
+        start = time.perf_counter()
+        saved_count = failed_count = 0
+        batch = []
+        # Scans waiting in the pool are bounded, so finished scans do not pile up in memory
+        max_pending = self.processes * 2
+        pending = set()
+        repo_iter = iter(repo_ids)
+        with ProcessPoolExecutor(self.processes, initializer=_init_worker,
+                                 initargs=(self.repos_directory, languages)) as executor:
+            while True:
+                for repo_id in repo_iter:
+                    pending.add(executor.submit(_scan, repo_id))
+                    if len(pending) >= max_pending:
+                        break
+                if not pending:
+                    break
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    repo_id, result = future.result()
+                    if isinstance(result, str):
+                        logging.error(f"Could not scan '{repo_id}': {result}")
+                        failed_count += 1
+                        continue
+                    batch.append((repo_id, result))
+                    if len(batch) >= self.batch_size:
+                        saved, failed = self._save(batch)
+                        saved_count, failed_count = saved_count + saved, failed_count + failed
+                        batch = []
+                        elapsed = time.perf_counter() - start
+                        logging.info(f"Saved {saved_count} repositories ({saved_count / elapsed:.1f}/s), "
+                                     f"{failed_count} failed")
+            if batch:
+                saved, failed = self._save(batch)
+                saved_count, failed_count = saved_count + saved, failed_count + failed
+        logging.info(f"Backfill complete: {saved_count} repositories saved, {failed_count} failed "
+                     f"in {time.perf_counter() - start:.0f} s")
+
+    def _save(self, batch):
+        """Saves scans of a batch of repositories in one transaction. If the transaction
+        fails, the repositories are saved one by one, so one bad repository does not fail all
+        :returns numbers of saved and failed repositories"""
+        try:
+            present = DbManager.save_repository_scans(batch, self.incremental)
+            for repo_id, _ in batch:
+                if repo_id not in present:
+                    logging.error(f"Did not found repository '{repo_id}' in the repositories table.")
+        except Exception as e:
+            logging.warning(f"Saving a batch of {len(batch)} repositories failed, saving them one by one. "
+                            f"Cause: {e}")
+            present = {}
+            for repo_id, files in batch:
+                try:
+                    _, present[repo_id] = DbManager.save_repository_scan(
+                        repo_id, files.present_lang_ids(), files, self.incremental)
+                except Exception as e:
+                    logging.error(f"Could not save '{repo_id}': {e}")
+        append_checkpoint(self.checkpoint, dict(
+            (repo_id, sorted(self._language_id_name[lang_id] for lang_id in lang_ids))
+            for repo_id, lang_ids in present.items()))
+        return len(present), len(batch) - len(present)
+
+    def publish(self, rabbitmq_host, rabbitmq_port, batch_size):
+        """Sends output messages of all checkpointed repositories to the queues of their languages.
+        Published repositories are recorded, so an interrupted publish is resumed too"""
+        published_path = self.checkpoint + PUBLISHED_SUFFIX
+        published = read_checkpoint(published_path)
+        to_publish = [(repo_id, lang_names) for repo_id, lang_names in read_checkpoint(self.checkpoint).items()
+                      if repo_id not in published]
+        logging.info(f"Publishing output messages of {len(to_publish)} repositories")
+
+        # Output queues are declared like by Messenger
+        connection = pika.BlockingConnection(pika.ConnectionParameters(host=rabbitmq_host, port=rabbitmq_port))
+        channel = connection.channel()
+        for q_name in OUTPUT_QUEUES.values():
+            channel.queue_declare(queue=q_name, durable=True)
+        connection.close()
+
+        publisher = Publisher(rabbitmq_host, rabbitmq_port)
+        publisher.start()
+        try:
+            for i in range(0, len(to_publish), batch_size):
+                chunk = to_publish[i:i + batch_size]
+                messages = [(OUTPUT_QUEUES[lang_name], bytes(json.dumps({'repo_id': repo_id}), encoding='utf8'))
+                            for repo_id, lang_names in chunk for lang_name in lang_names]
+                # Wait for the confirms of the chunk before recording it
+                publisher.publish(messages).result()
+                append_checkpoint(published_path, dict(chunk))
+                logging.info(f"Published output messages of {i + len(chunk)} repositories")
+        finally:
+            publisher.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Scans all repositories of the repositories directory and saves them in the database")
+    parser.add_argument('--repos-directory', default=REPOSITORIES_DIRECTORY)
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help="number of scanning processes")
+    parser.add_argument('--batch-size', type=int, default=200,
+                        help="number of repositories saved in one transaction, and published at once")
+    parser.add_argument('--checkpoint', default='backfill.checkpoint',
+                        help="file recording saved repositories, to resume an interrupted backfill")
+    parser.add_argument('--incremental', action='store_true', default=SCAN_INCREMENTAL,
+                        help="write only the difference against files stored for the repositories")
+    parser.add_argument('--publish', action='store_true',
+                        help="send output messages of the saved repositories to the analyzer queues at the end")
+    args = parser.parse_args()
+
+    DbManager.init_logger()
+    backfill = Backfill(args.repos_directory, args.checkpoint, args.processes, args.batch_size, args.incremental)
+    backfill.run()
+    if args.publish:
+        backfill.publish(RABBITMQ_HOST, RABBITMQ_PORT, args.batch_size)
+    DbManager.close_pool()
+
+
+if __name__ == '__main__':
+    main()
@@ -35,3 +35,110 @@ except KeyError as ke:
     logging.error('Environmental variable {} not set!'.format(ke))
     sys.exit(1)
 
+# Maximum number of seconds between retries of a rejected output message
+RMQ_MAX_PUBLISH_DELAY = int(os.environ.get('RMQ_MAX_PUBLISH_DELAY', 60))
+
+# Set to 1 to send to every analyzer queue the id of the repository_language entry and the found
+# files of its language, so analyzers do not query them from the database
+OUTPUT_MANIFESTS = os.environ.get('OUTPUT_MANIFESTS', '0') == '1'
+# Maximum number of files of a language listed in the output message, more are written to a manifest file
+OUTPUT_INLINE_MAX_FILES = int(os.environ.get('OUTPUT_INLINE_MAX_FILES', 1000))
+
+# Database connection pool: maximum number of open connections
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 4))
+# Number of seconds after which an idle pooled connection is closed
+DB_POOL_MAX_IDLE = int(os.environ.get('DB_POOL_MAX_IDLE', 300))
+# Number of seconds of idleness after which a pooled connection is checked before reuse
+DB_POOL_HEALTH_CHECK = int(os.environ.get('DB_POOL_HEALTH_CHECK', 30))
+# Set to 0 to insert files with INSERT statements instead of COPY
+DB_USE_COPY = os.environ.get('DB_USE_COPY', '1') == '1'
+# Number of rows per INSERT statement when COPY is not used
+DB_INSERT_PAGE_SIZE = int(os.environ.get('DB_INSERT_PAGE_SIZE', 1000))
+# Set to 0 to not take an advisory lock of the repository in the transaction saving its scan.
+# The lock serializes saves of the same repository by different workers and nodes
+DB_REPOSITORY_LOCK = os.environ.get('DB_REPOSITORY_LOCK', '1') == '1'
+# Number of seconds after which the cached languages table is reloaded, 0 to never reload
+DB_LANGUAGES_TTL = int(os.environ.get('DB_LANGUAGES_TTL', 3600))
+# Database channel on which a NOTIFY makes the cached languages table reload. Not listened to if empty
+DB_LANGUAGES_NOTIFY_CHANNEL = os.environ.get('DB_LANGUAGES_NOTIFY_CHANNEL', '')
+
+# Set to 1 to insert found files into the database while the repository is walked,
+# instead of collecting the full list of files first
+SCAN_STREAMING = os.environ.get('SCAN_STREAMING', '0') == '1'
+# Set to 1 to write only the difference between found files and files already stored for
+# the repository, so that rescanning a repository does not duplicate its files
+SCAN_INCREMENTAL = os.environ.get('SCAN_INCREMENTAL', '0') == '1'
+# Directory of the scan result cache of unchanged repositories. Cache is disabled if empty
+SCAN_CACHE_DIR = os.environ.get('SCAN_CACHE_DIR', '')
+# Maximum size of the scan result cache in bytes
+SCAN_CACHE_MAX_SIZE = int(os.environ.get('SCAN_CACHE_MAX_SIZE', 1024 * 1024 * 1024))
+# Set to 0 to always walk the repository folder, instead of listing
+# files of git repositories from their .git/index
+SCAN_USE_GIT_INDEX = os.environ.get('SCAN_USE_GIT_INDEX', '1') == '1'
+# Set to 1 to detect languages of extensionless files and files with ambiguous extensions (.h)
+# by their shebang line and content
+SCAN_CONTENT_DETECTION = os.environ.get('SCAN_CONTENT_DETECTION', '0') == '1'
+# Maximum number of bytes read from the beginning of a file for content detection
+SCAN_DETECT_READ_SIZE = int(os.environ.get('SCAN_DETECT_READ_SIZE', 4096))
+# Number of files whose content is read at once, and number of threads reading them
+SCAN_DETECT_BATCH_SIZE = int(os.environ.get('SCAN_DETECT_BATCH_SIZE', 256))
+SCAN_DETECT_THREADS = int(os.environ.get('SCAN_DETECT_THREADS', 4))
+# Set to 1 to save sizes of the found files and their totals per repository language
+SCAN_FILE_SIZES = os.environ.get('SCAN_FILE_SIZES', '0') == '1'
+# Set to 1 to also count lines of the found files, which reads every file
+SCAN_LINE_COUNTS = os.environ.get('SCAN_LINE_COUNTS', '0') == '1'
+# Number of files measured at once, and number of threads measuring them
+SCAN_STATS_BATCH_SIZE = int(os.environ.get('SCAN_STATS_BATCH_SIZE', 256))
+SCAN_STATS_THREADS = int(os.environ.get('SCAN_STATS_THREADS', 4))
+# Set to 0 to not log every found source file, which slows down scans of large repositories
+SCAN_LOG_FILES = os.environ.get('SCAN_LOG_FILES', '1') == '1'
+# Comma-separated names or glob patterns of directories that are not scanned
+# (version control metadata, vendored dependencies, generated output)
+SCAN_PRUNED_DIRS = [pattern.strip() for pattern in os.environ.get(
+    'SCAN_PRUNED_DIRS',
+    '.git,.hg,.svn,node_modules,bower_components,vendor,third_party,'
+    'build,dist,target,__pycache__,.tox,.venv,venv'
+).split(',') if pattern.strip()]
+
+# Number of input messages scanned at the same time (broker prefetch count).
+# With 1, messages are handled one by one in the consumer thread
+EXTRACTOR_WORKERS = int(os.environ.get('EXTRACTOR_WORKERS', 1))
+# Estimated number of files (git index entries, or entries of the top two directory levels)
+# from which a repository is moved to the large queue (extract.large) and scanned in the large lane.
+# Lanes are disabled with 0
+EXTRACTOR_LARGE_REPO_FILES = int(os.environ.get('EXTRACTOR_LARGE_REPO_FILES', 0))
+# Number of large repositories scanned at the same time, besides EXTRACTOR_WORKERS small ones
+EXTRACTOR_LARGE_WORKERS = int(os.environ.get('EXTRACTOR_LARGE_WORKERS', 1))
+# Number of shard queues (extract.<shard>) the input messages are partitioned into by repo_id.
+# Sharding is disabled with 0
+EXTRACTOR_SHARDS = int(os.environ.get('EXTRACTOR_SHARDS', 0))
+# Comma-separated numbers of the shards consumed by this node, all shards if empty
+EXTRACTOR_SHARD_IDS = [int(shard) for shard in os.environ.get('EXTRACTOR_SHARD_IDS', '').split(',') if shard.strip()]
+# Set to 1 to run as a router, moving messages of the input queue to the shard queues instead of scanning
+EXTRACTOR_ROUTER = os.environ.get('EXTRACTOR_ROUTER', '0') == '1'
+# Maximum number of input messages processed at the same time by the asyncio service
+EXTRACTOR_MAX_IN_FLIGHT = int(os.environ.get('EXTRACTOR_MAX_IN_FLIGHT', 16))
+# Number of files taken from the walk at once by the asyncio service
+SCAN_BATCH_SIZE = int(os.environ.get('SCAN_BATCH_SIZE', 1000))
+# Number of threads walking one repository. With 0 or 1, repositories are walked serially
+SCAN_WALK_THREADS = int(os.environ.get('SCAN_WALK_THREADS', 0))
+# Minimum number of top-level directories of a repository for its walk to be parallel
+SCAN_PARALLEL_MIN_DIRS = int(os.environ.get('SCAN_PARALLEL_MIN_DIRS', 8))
+
+# Port of the HTTP endpoint serving metrics at /metrics. Not served if 0
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
+# File the metrics are periodically written to, for the node_exporter textfile collector. Not written if empty
+METRICS_TEXTFILE = os.environ.get('METRICS_TEXTFILE', '')
+# Number of seconds between writes of the metrics file
+METRICS_TEXTFILE_INTERVAL = int(os.environ.get('METRICS_TEXTFILE_INTERVAL', 15))
+
+# Fraction of input messages profiled with cProfile (0 to 1). Not profiled if 0
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+# Comma-separated ids of repositories whose messages are always profiled
+PROFILE_REPO_IDS = frozenset(repo_id.strip() for repo_id in os.environ.get('PROFILE_REPO_IDS', '').split(',')
+                             if repo_id.strip())
+# Number of seconds from which a message is slow: its stage times are logged and its profile is saved.
+# Slow messages are not reported if 0
+PROFILE_SLOW_SECONDS = float(os.environ.get('PROFILE_SLOW_SECONDS', 60))
+# Directory the profiles of slow messages are saved in
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
@@ -0,0 +1,84 @@
+import re
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from config import SCAN_DETECT_READ_SIZE, SCAN_DETECT_THREADS
+
+# Extensions mapped to a language by ExtLangMapper, but used by more than one language
+# ('h' is mapped to C, but is also used by C++ headers)
+AMBIGUOUS_EXTENSIONS = {'h'}
+
+# Interpreters in shebang lines mapped to language names
+SHEBANG_INTERPRETERS = {
+    'python': 'Python',
+    'ruby': 'Ruby',
+    'node': 'JS',
+    'nodejs': 'JS',
+    'php': 'PHP',
+}
+# Interpreter name without version suffix, like python3.8
+_interpreter_pattern = re.compile(r'([a-z]+)')
+
+# Tokens of C++ that are not valid in C, to tell C++ headers from C headers
+_cpp_tokens_pattern = re.compile(
+    rb'\b(?:class\s+\w+\s*[:{]|namespace\s+\w*\s*\{|template\s*<|using\s+namespace\b|std::|'
+    rb'public:|private:|protected:|virtual\s|#include\s*<(?:iostream|string|vector|map|memory)>)')
+
+
+class ContentDetector:
+    """Detects language of files, whose name has no extension or an extension
+    used by more than one language, by their beginning: the shebang line
+    and lightweight token heuristics. Reads at most read_size bytes per file."""
+
+    def __init__(self, ext_lang_mapper, read_size=SCAN_DETECT_READ_SIZE, threads=SCAN_DETECT_THREADS):
+        self._ext_lang_mapper = ext_lang_mapper
+        self._read_size = read_size
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+
+    def set_ext_lang_mapper(self, ext_lang_mapper):
+        """Replaces the mapper of language names, keeping the thread pool"""
+        self._ext_lang_mapper = ext_lang_mapper
+
+    @staticmethod
+    def needs_detection(filename, lang):
+        """:param lang: language found by ExtLangMapper.classify for the file name, or None
+        :returns whether the file content should be checked"""
+        _, dot, ext = filename.rpartition('.')
+        if lang is None:
+            return not dot
+        return ext in AMBIGUOUS_EXTENSIONS
+
+    def detect_batch(self, files):
+        """Detects languages of files in the thread pool
+        :param files: list of (absolute path, file name, language from the file name or None)
+        :returns list of (language id, language name) tuples or None, in the order of files"""
+        return list(self._executor.map(lambda file: self.detect(*file), files))
+
+    def detect(self, path, filename, lang):
+        """:returns (language id, language name) of the file, or None if not a source file"""
+        try:
+            with open(path, 'rb') as file:
+                head = file.read(self._read_size)
+        except OSError as error:
+            logging.warning("Could not read file {}: {}".format(path, error))
+            return lang
+        if lang is None:
+            return self._detect_shebang(head)
+        # Ambiguous extension: C header or C++ header
+        if lang[1] == 'C' and _cpp_tokens_pattern.search(head):
+            return self._ext_lang_mapper.get_language_by_name('C++')
+        return lang
+
+    def _detect_shebang(self, head):
+        if not head.startswith(b'#!'):
+            return None
+        words = head[2:].split(b'\n', 1)[0].decode('utf-8', 'replace').split()
+        if not words:
+            return None
+        interpreter = os.path.basename(words[0])
+        if interpreter == 'env':
+            # '#!/usr/bin/env [-S] python3' - the first argument that is not an option
+            interpreter = next((word for word in words[1:] if not word.startswith('-')), '')
+        match = _interpreter_pattern.match(interpreter)
+        lang_name = SHEBANG_INTERPRETERS.get(match.group(1)) if match else None
+        return self._ext_lang_mapper.get_language_by_name(lang_name) if lang_name else None
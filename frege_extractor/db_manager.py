@@ -1,7 +1,13 @@
 import psycopg2
 import psycopg2.extras
+import psycopg2.extensions
+import psycopg2.errors
 import logging
-from config import DB_HOST, DB_PORT, DB_DATABASE, DB_USERNAME, DB_PASSWORD
+import threading
+import time
+from contextlib import contextmanager
+from config import DB_HOST, DB_PORT, DB_DATABASE, DB_USERNAME, DB_PASSWORD, \
+    DB_POOL_SIZE, DB_POOL_MAX_IDLE, DB_POOL_HEALTH_CHECK, DB_USE_COPY, DB_INSERT_PAGE_SIZE, DB_REPOSITORY_LOCK
 
 
 def connect():
@@ -15,9 +21,251 @@ def connect():
     return engine
 
 
+# Inserts repository_language entries for all languages if the repository has none,
+# otherwise marks the present ones, and returns (language_id, id) of all the entries.
+# Rows inserted by a data-modifying CTE are not visible to the sibling UPDATE,
+# so new entries get their 'present' value computed on insert.
+UPSERT_REPOSITORY_LANGUAGES_QUERY = """
+WITH existing AS (
+    SELECT language_id, id FROM repository_language WHERE repository_id = %(repo_id)s
+), inserted AS (
+    INSERT INTO repository_language (repository_id, language_id, present, analyzed)
+    SELECT %(repo_id)s, languages.id, languages.id = ANY(%(present)s::int[]), 'False' FROM languages
+    WHERE NOT EXISTS (SELECT 1 FROM existing)
+    RETURNING language_id, id
+), updated AS (
+    UPDATE repository_language SET present = 'True'
+    WHERE repository_id = %(repo_id)s AND language_id = ANY(%(present)s::int[])
+)
+SELECT language_id, id FROM existing
+UNION ALL
+SELECT language_id, id FROM inserted
+"""
+
+
+# Narrow existence check of a repository, run in the write transaction
+REPOSITORY_EXISTS_QUERY = "SELECT 1 FROM repositories WHERE repo_id = %s LIMIT 1"
+
+
+# First key of advisory locks of repositories, the second one is a hash of repo_id
+REPOSITORY_LOCK_CLASS = 0x46524547
+
+# Transaction-level advisory lock of a repository, released on commit or rollback
+LOCK_REPOSITORY_QUERY = "SELECT pg_advisory_xact_lock(%s, hashtext(%s))"
+
+
+class RepositoryNotFoundError(Exception):
+    """Raised when a scanned repository is missing in the repositories table"""
+
+
+# Temporary table receiving the files of a repository scan in incremental mode
+CREATE_SCANNED_FILE_QUERY = """
+CREATE TEMPORARY TABLE scanned_file (repository_language_id integer, file_path text) ON COMMIT DROP
+"""
+
+# Deletes repository_language_file entries of the repository that are not in scanned_file,
+# and inserts those of scanned_file that are not stored yet.
+# Returns the numbers of deleted and inserted entries.
+SYNC_REPOSITORY_LANGUAGE_FILES_QUERY = """
+WITH removed AS (
+    DELETE FROM repository_language_file f
+    USING repository_language rl
+    WHERE f.repository_language_id = rl.id AND rl.repository_id = %(repo_id)s
+    AND NOT EXISTS (SELECT 1 FROM scanned_file s
+                    WHERE s.repository_language_id = f.repository_language_id AND s.file_path = f.file_path)
+    RETURNING 1
+), added AS (
+    INSERT INTO repository_language_file (repository_language_id, file_path)
+    SELECT DISTINCT s.repository_language_id, s.file_path FROM scanned_file s
+    WHERE NOT EXISTS (SELECT 1 FROM repository_language_file f
+                      WHERE f.repository_language_id = s.repository_language_id AND f.file_path = s.file_path)
+    RETURNING 1
+)
+SELECT (SELECT count(*) FROM removed), (SELECT count(*) FROM added)
+"""
+
+# Columns of repository_language_file entries, and of scanned_file, with file sizes and line counts
+FILE_COLUMNS = ('repository_language_id', 'file_path')
+FILE_STATS_COLUMNS = FILE_COLUMNS + ('size', 'line_count')
+
+# Adds file size and line count columns to scanned_file
+ALTER_SCANNED_FILE_STATS_QUERY = "ALTER TABLE scanned_file ADD COLUMN size bigint, ADD COLUMN line_count integer"
+
+# Sets sizes and line counts of the repository's stored files that were new or changed in scanned_file
+UPDATE_FILE_STATS_QUERY = """
+UPDATE repository_language_file f SET size = s.size, line_count = s.line_count
+FROM scanned_file s
+WHERE f.repository_language_id = s.repository_language_id AND f.file_path = s.file_path
+AND (f.size IS DISTINCT FROM s.size OR f.line_count IS DISTINCT FROM s.line_count)
+"""
+
+# Sets numbers of files and totals of their sizes and line counts of repository_language entries
+UPDATE_REPOSITORY_LANGUAGE_STATS_QUERY = """
+UPDATE repository_language rl SET file_count = v.file_count, total_size = v.total_size, line_count = v.line_count
+FROM (VALUES %s) AS v (id, file_count, total_size, line_count)
+WHERE rl.id = v.id
+"""
+UPDATE_REPOSITORY_LANGUAGE_STATS_TEMPLATE = "(%s, %s::integer, %s::bigint, %s::bigint)"
+
+
+def _copy_value(value):
+    """:returns value formatted as a column of COPY text format"""
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class _CopyReader:
+    """File-like object that feeds rows taken from an iterator to
+    COPY ... FROM STDIN, without building the whole data set in memory"""
+
+    def __init__(self, rows):
+        self._rows = rows
+        self._buffer = ''
+        # Whether any row was taken from the iterator
+        self.consumed = False
+        # Exception raised by the iterator. psycopg2 replaces it with QueryCanceled,
+        # so it is kept to be raised again after COPY fails
+        self.error = None
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            try:
+                row = next(self._rows, None)
+            except Exception as error:
+                self.error = error
+                raise
+            if row is None:
+                break
+            self.consumed = True
+            line = '\t'.join(_copy_value(value) for value in row) + '\n'
+            chunks.append(line)
+            length += len(line)
+        data = ''.join(chunks)
+        if size < 0:
+            self._buffer = ''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+class ConnectionPool:
+    """Thread-safe pool of long-lived database connections.
+    Connections idle for longer than max_idle seconds are closed, connections
+    idle for longer than health_check seconds are checked before reuse
+    and replaced with a new connection if broken."""
+
+    def __init__(self, factory, size, max_idle, health_check):
+        self._factory = factory
+        self._size = size
+        self._max_idle = max_idle
+        self._health_check = health_check
+        # Idle connections with the time they were returned, most recently used last
+        self._idle = []
+        self._in_use = 0
+        self._condition = threading.Condition()
+        self._stats = {'created': 0, 'reused': 0, 'reconnected': 0, 'expired': 0, 'discarded': 0}
+
+    def get(self):
+        """:returns a connection from the pool, opening a new one if there is
+        no usable idle connection. Blocks while all connections are in use"""
+        with self._condition:
+            self._expire_idle()
+            while not self._idle and self._in_use >= self._size:
+                self._condition.wait()
+            self._in_use += 1
+            idle = self._idle.pop() if self._idle else None
+        try:
+            if idle is not None:
+                connection, released = idle
+                if self._is_usable(connection, released):
+                    self._count('reused')
+                    return connection
+                self._close(connection)
+                self._count('reconnected')
+            connection = self._factory()
+            self._count('created')
+            return connection
+        except Exception:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+
+    def put(self, connection):
+        """Returns a connection to the pool. Broken connections are discarded,
+        unfinished transactions are rolled back"""
+        broken = connection.closed != 0
+        if not broken and connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                broken = True
+        if broken:
+            self._close(connection)
+            self._count('discarded')
+        with self._condition:
+            self._in_use -= 1
+            if not broken:
+                self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    def close_all(self):
+        """Closes all idle connections"""
+        with self._condition:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._close(connection)
+
+    def stats(self):
+        """:returns dictionary with connection counters and current pool usage"""
+        with self._condition:
+            return dict(self._stats, in_use=self._in_use, idle=len(self._idle), size=self._size)
+
+    def _expire_idle(self):
+        """Closes connections that were idle for longer than max_idle.
+        Must be called with the pool condition held"""
+        now = time.monotonic()
+        # Least recently used connections are at the beginning of the list
+        while self._idle and now - self._idle[0][1] > self._max_idle:
+            connection, _ = self._idle.pop(0)
+            self._close(connection)
+            self._stats['expired'] += 1
+
+    def _is_usable(self, connection, released):
+        if connection.closed:
+            return False
+        if time.monotonic() - released < self._health_check:
+            return True
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _count(self, name):
+        with self._condition:
+            self._stats[name] += 1
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+
 class DbManager:
 
     logger = None
+    # Whether COPY can be used for bulk inserts, disabled after the server refuses it
+    _copy_permitted = DB_USE_COPY
+    _pool = None
+    _pool_lock = threading.Lock()
     
     @staticmethod
     def init_logger():
@@ -29,11 +277,64 @@ class DbManager:
         DbManager.logger.setLevel(logging.WARNING)
         DbManager.logger.propagate = False
 
+    @staticmethod
+    def _get_pool():
+        if DbManager._pool is None:
+            with DbManager._pool_lock:
+                if DbManager._pool is None:
+                    logging.info(f"Creating database connection pool (size: {DB_POOL_SIZE}, "
+                                 f"max idle: {DB_POOL_MAX_IDLE} s)")
+                    DbManager._pool = ConnectionPool(
+                        connect, DB_POOL_SIZE, DB_POOL_MAX_IDLE, DB_POOL_HEALTH_CHECK)
+        return DbManager._pool
+
+    @staticmethod
+    def _get_connection():
+        """:returns a connection borrowed from the connection pool"""
+        return DbManager._get_pool().get()
+
+    @staticmethod
+    def _release_connection(connection):
+        """Returns a borrowed connection to the connection pool"""
+        DbManager.logger.info("Returning connection to the pool")
+        DbManager._get_pool().put(connection)
+
+    @staticmethod
+    def pool_stats():
+        """:returns statistics of the connection pool"""
+        return DbManager._get_pool().stats()
+
+    @staticmethod
+    def close_pool():
+        """Closes all idle pooled connections"""
+        if DbManager._pool is not None:
+            DbManager._pool.close_all()
+
+    @staticmethod
+    @contextmanager
+    def transaction():
+        """Context manager running statements on one pooled connection in a single
+        transaction. Yields a cursor, commits on success and rolls back on error"""
+        connection = DbManager._get_connection()
+        try:
+            cursor = connection.cursor()
+            DbManager.logger.info("Success calling database")
+            yield cursor
+        except (Exception, psycopg2.DatabaseError) as error:
+            DbManager.logger.error("Error in transaction: {}".format(error))
+            connection.rollback()
+            raise
+        else:
+            connection.commit()
+            DbManager.logger.info("Transaction completed successfully")
+        finally:
+            DbManager._release_connection(connection)
+
     @staticmethod
     def _run_query(query, params):
         """Generic query execution method for all queries that do NOT
         return a result set (insert, update, delete)"""
-        connection = connect()
+        connection = DbManager._get_connection()
         try:
             cursor = connection.cursor()
             DbManager.logger.info("Success calling database")
@@ -46,15 +347,13 @@ class DbManager:
             connection.commit()
             DbManager.logger.info("Transaction completed successfully")
         finally:
-            if connection is not None:
-                DbManager.logger.info("Closing connection to database")
-                connection.close()
+            DbManager._release_connection(connection)
 
     @staticmethod
     def _run_select_query(query, params):
         """Generic query execution method for all queries that
         return a result set (select)"""
-        connection = connect()
+        connection = DbManager._get_connection()
         try:
             cursor = connection.cursor()
             DbManager.logger.info("Success calling database")
@@ -67,9 +366,7 @@ class DbManager:
             DbManager.logger.info("Transaction completed successfully")
             return rs
         finally:
-            if connection is not None:
-                DbManager.logger.info("Closing connection to database")
-                connection.close()
+            DbManager._release_connection(connection)
 
     @staticmethod
     def select_languages():
@@ -89,6 +386,17 @@ class DbManager:
             [repo_id]
         )
 
+    @staticmethod
+    def repository_exists(cursor, repo_id):
+        """:returns whether the repository is present in the repositories table"""
+        cursor.execute(REPOSITORY_EXISTS_QUERY, (repo_id,))
+        return cursor.fetchone() is not None
+
+    @staticmethod
+    def lock_repository(cursor, repo_id):
+        """Waits for the advisory lock of the repository, held until the end of the transaction"""
+        cursor.execute(LOCK_REPOSITORY_QUERY, (REPOSITORY_LOCK_CLASS, repo_id))
+
     @staticmethod
     def update_present_repository_languages(repo_id, present_lang_ids):
         DbManager._run_query(
@@ -102,7 +410,7 @@ class DbManager:
         """Inserts repository_language entries for given repo id and ALL languages.
         :return result set of entries: (id, language_id) - id of the inserted entry,
         and id of its language"""
-        connection = connect()
+        connection = DbManager._get_connection()
         try:
             cursor = connection.cursor()
             DbManager.logger.info("Success calling database")
@@ -119,16 +427,14 @@ class DbManager:
             DbManager.logger.info("Transaction completed successfully")
             return rs
         finally:
-            if connection is not None:
-                DbManager.logger.info("Closing connection to database")
-                connection.close()
+            DbManager._release_connection(connection)
 
     @staticmethod
     def insert_repository_languages_set_present(repo_id, present_lang_ids):
         """Insert repository languages of given repo ID, sets 'present' column to True for
         given present language IDs.
         :returns result set containing IDs of inserted entries and their language IDs"""
-        connection = connect()
+        connection = DbManager._get_connection()
         try:
             cursor = connection.cursor()
             DbManager.logger.info("Success calling database")
@@ -150,30 +456,201 @@ class DbManager:
             DbManager.logger.info("Transaction completed successfully")
             return rs
         finally:
-            if connection is not None:
-                DbManager.logger.info("Closing connection to database")
-                connection.close()
+            DbManager._release_connection(connection)
 
     @staticmethod
     def insert_repository_language_files(entries):
-        """Inserts repository_language_file entries"""
-        connection = connect()
-        try:
-            cursor = connection.cursor()
-            DbManager.logger.info("Success calling database")
-            query = "INSERT INTO repository_language_file (repository_language_id, file_path) VALUES %s"
-            psycopg2.extras.execute_values(cursor, query, entries)
-        except (Exception, psycopg2.DatabaseError) as error:
-            DbManager.logger.error("Error in transaction: {}".format(error))
-            connection.rollback()
-            raise
+        """Inserts repository_language_file entries
+        :param entries: iterable of (repository_language_id, file_path) tuples"""
+        with DbManager.transaction() as cursor:
+            DbManager.bulk_insert(cursor, 'repository_language_file',
+                                  ('repository_language_id', 'file_path'), entries)
+
+    @staticmethod
+    def upsert_repository_languages(cursor, repo_id, present_lang_ids):
+        """Inserts repository_language entries for given repo id and ALL languages if
+        there are none, and sets 'present' for given present language IDs, in one statement.
+        :return result set of entries: (language_id, id) - id of the language and
+        id of its repository_language entry"""
+        cursor.execute(UPSERT_REPOSITORY_LANGUAGES_QUERY,
+                       {'repo_id': repo_id, 'present': list(present_lang_ids)})
+        return cursor.fetchall()
+
+    @staticmethod
+    def update_repository_language_stats(cursor, stats):
+        """Sets numbers of files, total sizes and total line counts of repository_language entries
+        :param stats: iterable of (repository_language_id, file count, total size, total line count)"""
+        psycopg2.extras.execute_values(cursor, UPDATE_REPOSITORY_LANGUAGE_STATS_QUERY, stats,
+                                       template=UPDATE_REPOSITORY_LANGUAGE_STATS_TEMPLATE,
+                                       page_size=DB_INSERT_PAGE_SIZE)
+
+    @staticmethod
+    def save_repository_scan(repo_id, present_lang_ids, files_langs, incremental=False, check_repository=True,
+                             file_stats=False):
+        """Upserts repository_language entries of given repo and inserts its
+        repository_language_file entries in a single transaction.
+        If check_repository is set, the transaction first checks that the repository
+        exists, instead of a separate query.
+        If DB_REPOSITORY_LOCK is set, saves of the same repository are serialized
+        with an advisory lock, so concurrent saves do not race inserting entries.
+        If present_lang_ids is None, present languages are collected while
+        files_langs is streamed to the database and marked after the insert.
+        In incremental mode, only files that are not stored yet are inserted, stored
+        files that were not found are deleted, and 'present' is reset for languages
+        that are no longer found.
+        If file_stats is set, files_langs also has sizes and line counts of the files, which
+        are written with the files, and their totals are set in the repository_language entries
+        :param files_langs: iterable of (file_path, language_id) tuples, or of
+        (file_path, language_id, size, line_count) tuples if file_stats is set
+        :returns tuple of dictionary mapping language ids to repository_language
+        entry ids, and set of present language ids
+        :raises KeyError if an entry for a language of some file is missing,
+        and any exception raised by files_langs
+        :raises RepositoryNotFoundError if the repository does not exist"""
+        with DbManager.transaction() as cursor:
+            return DbManager._save_repository_scan(
+                cursor, repo_id, present_lang_ids, files_langs, incremental, check_repository, file_stats)
+
+    @staticmethod
+    def _save_repository_scan(cursor, repo_id, present_lang_ids, files_langs, incremental, check_repository,
+                              file_stats=False):
+        """Body of save_repository_scan, run in the transaction of given cursor"""
+        streaming = present_lang_ids is None
+        present_lang_ids = set() if streaming else set(present_lang_ids)
+        # Number of files, total size and total line count by language id. Files that could
+        # not be read count with zero size and lines, line totals are null if lines were not counted
+        totals = {}
+        lines_counted = False
+
+        def repo_lang_files():
+            for file, lang in files_langs:
+                if streaming:
+                    present_lang_ids.add(lang)
+                yield repo_lang_ids[lang], file
+
+        def repo_lang_files_stats():
+            nonlocal lines_counted
+            for file, lang, size, lines in files_langs:
+                if streaming:
+                    present_lang_ids.add(lang)
+                total = totals.get(lang)
+                if total is None:
+                    total = totals[lang] = [0, 0, 0]
+                total[0] += 1
+                if size is not None:
+                    total[1] += size
+                if lines is not None:
+                    total[2] += lines
+                    lines_counted = True
+                yield repo_lang_ids[lang], file, size, lines
+
+        columns, rows = (FILE_STATS_COLUMNS, repo_lang_files_stats()) if file_stats \
+            else (FILE_COLUMNS, repo_lang_files())
+
+        if check_repository and not DbManager.repository_exists(cursor, repo_id):
+            raise RepositoryNotFoundError(repo_id)
+        if DB_REPOSITORY_LOCK:
+            DbManager.lock_repository(cursor, repo_id)
+        repo_lang_ids = dict(DbManager.upsert_repository_languages(cursor, repo_id, present_lang_ids))
+        if incremental:
+            cursor.execute(CREATE_SCANNED_FILE_QUERY)
+            if file_stats:
+                cursor.execute(ALTER_SCANNED_FILE_STATS_QUERY)
+            DbManager.bulk_insert(cursor, 'scanned_file', columns, rows)
+            cursor.execute("ANALYZE scanned_file")
+            cursor.execute(SYNC_REPOSITORY_LANGUAGE_FILES_QUERY, {'repo_id': repo_id})
+            removed, added = cursor.fetchone()
+            if file_stats:
+                cursor.execute(UPDATE_FILE_STATS_QUERY)
+            # Dropped now, so that more repositories can be saved in the same transaction
+            cursor.execute("DROP TABLE scanned_file")
+            logging.info(f"Incremental scan of '{repo_id}': {added} new files, {removed} removed files")
+            cursor.execute("UPDATE repository_language SET present = (language_id = ANY(%s::int[])) "
+                           "WHERE repository_id = %s",
+                           (list(present_lang_ids), repo_id))
         else:
-            connection.commit()
-            DbManager.logger.info("Transaction completed successfully")
-        finally:
-            if connection is not None:
-                DbManager.logger.info("Closing connection to database")
-                connection.close()
+            DbManager.bulk_insert(cursor, 'repository_language_file', columns, rows)
+            if streaming and present_lang_ids:
+                cursor.execute("UPDATE repository_language SET present = 'True' "
+                               "WHERE repository_id = %s AND language_id = ANY(%s::int[])",
+                               (repo_id, list(present_lang_ids)))
+        if file_stats:
+            stats = []
+            for lang_id, repo_lang_id in repo_lang_ids.items():
+                # Languages without files get zero totals
+                count, size, lines = totals.get(lang_id, (0, 0, 0))
+                stats.append((repo_lang_id, count, size, lines if lines_counted else None))
+            DbManager.update_repository_language_stats(cursor, stats)
+        return repo_lang_ids, present_lang_ids
+
+    @staticmethod
+    def save_repository_scans(scans, incremental=False):
+        """Saves scans of many repositories in a single transaction, like
+        save_repository_scan. Files of all the repositories are inserted with one COPY,
+        unless in incremental mode. Repositories missing in the repositories table are skipped.
+        :param scans: list of (repo_id, files) tuples, files are FileList objects
+        :returns dictionary mapping repo ids of the saved repositories to sets of
+        present language ids
+        :raises KeyError if an entry for a language of some file is missing"""
+        with DbManager.transaction() as cursor:
+            cursor.execute("SELECT repo_id FROM repositories WHERE repo_id = ANY(%s)",
+                           ([repo_id for repo_id, _ in scans],))
+            existing = set(row[0] for row in cursor.fetchall())
+            # Locks are taken in the same order by all writers, so that they cannot deadlock
+            scans = sorted((scan for scan in scans if scan[0] in existing), key=lambda scan: scan[0])
+            present = {}
+            if incremental:
+                for repo_id, files in scans:
+                    _, present[repo_id] = DbManager._save_repository_scan(
+                        cursor, repo_id, files.present_lang_ids(), files, True, False)
+                return present
+
+            repo_lang_ids = {}
+            for repo_id, files in scans:
+                if DB_REPOSITORY_LOCK:
+                    DbManager.lock_repository(cursor, repo_id)
+                present[repo_id] = files.present_lang_ids()
+                repo_lang_ids[repo_id] = dict(DbManager.upsert_repository_languages(cursor, repo_id, present[repo_id]))
+
+            def repo_lang_files():
+                for repo_id, files in scans:
+                    lang_ids = repo_lang_ids[repo_id]
+                    for file, lang in files:
+                        yield lang_ids[lang], file
+
+            DbManager.bulk_insert(cursor, 'repository_language_file',
+                                  ('repository_language_id', 'file_path'), repo_lang_files())
+        return present
+
+    @staticmethod
+    def bulk_insert(cursor, table, columns, rows):
+        """Streams rows from an iterable into given table with COPY ... FROM STDIN.
+        If the server does not permit COPY, falls back to multi-row INSERT
+        statements of DB_INSERT_PAGE_SIZE rows"""
+        rows = iter(rows)
+        if DbManager._copy_permitted:
+            reader = _CopyReader(rows)
+            cursor.execute("SAVEPOINT bulk_insert")
+            try:
+                cursor.copy_expert("COPY {} ({}) FROM STDIN".format(table, ', '.join(columns)), reader)
+            except (psycopg2.errors.InsufficientPrivilege, psycopg2.errors.FeatureNotSupported) as error:
+                # COPY is refused before any data is sent, so no rows are lost
+                if reader.consumed:
+                    raise
+                cursor.execute("ROLLBACK TO SAVEPOINT bulk_insert")
+                DbManager.logger.warning("COPY is not permitted, falling back to INSERT statements. "
+                                         "Cause: {}".format(error))
+                DbManager._copy_permitted = False
+            except psycopg2.Error:
+                # Error of the iterator of the rows, e.g. a KeyError of a missing language entry
+                if reader.error is not None:
+                    raise reader.error
+                raise
+            else:
+                cursor.execute("RELEASE SAVEPOINT bulk_insert")
+                return
+        query = "INSERT INTO {} ({}) VALUES %s".format(table, ', '.join(columns))
+        psycopg2.extras.execute_values(cursor, query, rows, page_size=DB_INSERT_PAGE_SIZE)
 
     @staticmethod
     def update_repository_language_present(repo_id, lang_id, present=True):
@@ -1,13 +1,15 @@
 import logging
 import sys
-from db_manager import DbManager
+from language_cache import shared_language_cache
 
 
 class ExtLangMapper:
     """Class that maps source file extension to the
     id of the language from the database"""
 
-    def __init__(self):
+    def __init__(self, languages=None):
+        """:param languages: result set of (id, name) of languages,
+        taken from the shared language cache if not given"""
         # Dictionary that defines valid source file extensions for each language name
         # Put here extensions that should recognized by RepoScanner
         self._lang_extensions = {
@@ -21,25 +23,70 @@ class ExtLangMapper:
             'Python': ['py'],
             'Ruby': ['rb'],
         }
+        # Dictionary that defines exact names of source files without a known extension
+        self._lang_filenames = {
+            'Python': ['SConstruct', 'SConscript'],
+            'Ruby': ['Rakefile', 'Gemfile'],
+        }
         self._extension_lang_id = dict()
         self._extension_lang_name = dict()
+        # Dictionaries that map suffixes (extensions, possibly with dots, like 'd.ts')
+        # and exact file names to tuples of (language id, language name)
+        self._suffix_lang = dict()
+        self._filename_lang = dict()
+        self._lang_name_id = dict()
         logging.info("Initializing extension-language-id mapper")
         try:
-            lang_name_id = dict((name, id) for id, name in DbManager.select_languages())
+            if languages is None:
+                languages = shared_language_cache().languages()
+            lang_name_id = dict((name, id) for id, name in languages)
+            self._lang_name_id = lang_name_id
             # Make extension_lang_id a dictionary that maps extensions from
             # __extension_lang to language ids from language result set
             for name, extensions in self._lang_extensions.items():
                 for ext in extensions:
                     self._extension_lang_id[ext] = lang_name_id[name]
                     self._extension_lang_name[ext] = name
+                    self._suffix_lang[ext] = (lang_name_id[name], name)
+            for name, filenames in self._lang_filenames.items():
+                for filename in filenames:
+                    self._filename_lang[filename] = (lang_name_id[name], name)
         except KeyError as ke:
             logging.error(f"Exception while initializing extension-language mapper. "
                           f"Did not found {ke} language in the database, which "
                           f"is defined in the mapper.")
             sys.exit(1)
+        # Largest number of dot-separated parts of a known suffix
+        self._max_suffix_parts = max((ext.count('.') + 1 for ext in self._suffix_lang), default=1)
 
     def get_language_id(self, extension):
         return self._extension_lang_id.get(extension)
 
     def get_language_name(self, extension):
         return self._extension_lang_name.get(extension)
+
+    def get_language_by_name(self, name):
+        """:returns tuple of (language id, language name), or None if there is no such language"""
+        lang_id = self._lang_name_id.get(name)
+        return (lang_id, name) if lang_id is not None else None
+
+    def classify(self, filename):
+        """Finds language of a file by its name. Exact file names are matched first,
+        then the longest known suffix.
+        :returns tuple of (language id, language name), or None if not a source file"""
+        lang = self._filename_lang.get(filename)
+        if lang is not None:
+            return lang
+        if self._max_suffix_parts == 1:
+            _, dot, ext = filename.rpartition('.')
+            return self._suffix_lang.get(ext) if dot else None
+        parts = filename.split('.')
+        for n in range(min(self._max_suffix_parts, len(parts) - 1), 0, -1):
+            lang = self._suffix_lang.get('.'.join(parts[-n:]))
+            if lang is not None:
+                return lang
+        return None
+
+    def signature(self):
+        """:returns text describing the mapping, which changes whenever the mapping does"""
+        return repr((sorted(self._suffix_lang.items()), sorted(self._filename_lang.items())))
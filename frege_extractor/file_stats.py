@@ -0,0 +1,71 @@
+import os
+import mmap
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from config import SCAN_STATS_BATCH_SIZE, SCAN_STATS_THREADS
+
+# Files up to this size are read at once, larger ones are memory-mapped
+MMAP_MIN_SIZE = 1 << 20
+# Number of bytes of a memory-mapped file counted at once
+MMAP_CHUNK_SIZE = 1 << 22
+
+
+def count_lines(file, size):
+    """Counts lines of an open binary file by its newline bytes. The last line
+    is counted also when it does not end with a newline
+    :param size: size of the file in bytes"""
+    if size == 0:
+        return 0
+    if size < MMAP_MIN_SIZE:
+        data = file.read()
+        return data.count(b'\n') + (not data.endswith(b'\n'))
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        newlines = 0
+        for start in range(0, len(mapped), MMAP_CHUNK_SIZE):
+            newlines += mapped[start:start + MMAP_CHUNK_SIZE].count(b'\n')
+        return newlines + (mapped[-1] != ord('\n'))
+
+
+class FileStats:
+    """Measures sizes, and optionally line counts, of the found files in a pool
+    of threads, while the files of a repository are streamed to the database"""
+
+    def __init__(self, repos_directory, line_counts=False, batch_size=SCAN_STATS_BATCH_SIZE,
+                 threads=SCAN_STATS_THREADS):
+        self.repos_directory = repos_directory
+        self.line_counts = line_counts
+        self._batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+
+    def measure(self, path):
+        """:param path: path of a file relative to the repositories directory
+        :returns tuple of size in bytes and number of lines (None if lines are not counted),
+        or (None, None) if the file could not be read"""
+        full_path = os.path.join(self.repos_directory, path)
+        try:
+            if not self.line_counts:
+                return os.stat(full_path).st_size, None
+            with open(full_path, 'rb') as file:
+                size = os.fstat(file.fileno()).st_size
+                return size, count_lines(file, size)
+        except (OSError, ValueError) as error:
+            logging.warning("Could not measure file {}: {}".format(full_path, error))
+            return None, None
+
+    def measure_files(self, files_langs):
+        """Measures files in batches, keeping their order
+        :param files_langs: iterable of (file path, language ID) tuples
+        :returns iterator of (file path, language ID, size, line count) tuples"""
+        batch = []
+        for file_lang in files_langs:
+            batch.append(file_lang)
+            if len(batch) >= self._batch_size:
+                yield from self._measure_batch(batch)
+                batch = []
+        if batch:
+            yield from self._measure_batch(batch)
+
+    def _measure_batch(self, batch):
+        stats = self._executor.map(lambda file_lang: self.measure(file_lang[0]), batch)
+        for (path, lang_id), (size, lines) in zip(batch, stats):
+            yield path, lang_id, size, lines
@@ -0,0 +1,138 @@
+import os
+import struct
+import hashlib
+
+INDEX_SIGNATURE = b'DIRC'
+SUPPORTED_VERSIONS = (2, 3, 4)
+
+# Object types held in the upper bits of an entry's mode
+MODE_TYPE_MASK = 0o170000
+MODE_REGULAR_FILE = 0o100000
+MODE_DIRECTORY = 0o040000
+
+# Size of the stat data fields preceding the object hash in an entry
+STAT_DATA_SIZE = 40
+FLAG_EXTENDED = 0x4000
+FLAG_NAME_MASK = 0x0fff
+FLAG_STAGE_MASK = 0x3000
+EXTENDED_FLAG_SKIP_WORKTREE = 0x4000
+EXTENDED_FLAG_INTENT_TO_ADD = 0x2000
+
+
+class GitIndexError(Exception):
+    """Raised when a git index file is invalid or uses unsupported features"""
+
+
+def _read_varint(data, pos):
+    """Reads a variable-length offset of the index format version 4
+    :returns tuple of the value and the position after it"""
+    c = data[pos]
+    pos += 1
+    value = c & 0x7f
+    while c & 0x80:
+        c = data[pos]
+        pos += 1
+        value = ((value + 1) << 7) | (c & 0x7f)
+    return value, pos
+
+
+def _hash_size(data):
+    """:returns size of the object hash used by the index, detected by its trailing checksum"""
+    for size, algorithm in ((20, hashlib.sha1), (32, hashlib.sha256)):
+        if len(data) >= 12 + size and algorithm(data[:-size]).digest() == data[-size:]:
+            return size
+    raise GitIndexError("Checksum mismatch")
+
+
+def parse_index(data):
+    """Parses contents of a git index file (DIRC format, versions 2 to 4)
+    :returns list of paths (str, '/'-separated, relative to the repository root)
+    of regular files checked out in the working tree
+    :raises GitIndexError if the data is not a valid index"""
+    if len(data) < 12 or data[:4] != INDEX_SIGNATURE:
+        raise GitIndexError("Not a git index file")
+    version, count = struct.unpack('>II', data[4:12])
+    if version not in SUPPORTED_VERSIONS:
+        raise GitIndexError("Unsupported index version {}".format(version))
+    hash_size = _hash_size(data)
+    end = len(data) - hash_size
+    flags_offset = STAT_DATA_SIZE + hash_size
+
+    paths = []
+    pos = 12
+    previous = b''
+    last_path = None
+    try:
+        for _ in range(count):
+            start = pos
+            mode = struct.unpack_from('>I', data, pos + 24)[0]
+            flags = struct.unpack_from('>H', data, pos + flags_offset)[0]
+            pos += flags_offset + 2
+            extended_flags = 0
+            if flags & FLAG_EXTENDED:
+                if version < 3:
+                    raise GitIndexError("Extended flags in index version 2")
+                extended_flags = struct.unpack_from('>H', data, pos)[0]
+                pos += 2
+            if version == 4:
+                # Path is the previous path without its last strip_length bytes, followed by the suffix
+                strip_length, pos = _read_varint(data, pos)
+                name_end = data.index(b'\0', pos)
+                path = previous[:len(previous) - strip_length] + data[pos:name_end]
+                pos = name_end + 1
+            else:
+                name_length = flags & FLAG_NAME_MASK
+                if name_length == FLAG_NAME_MASK:
+                    name_end = data.index(b'\0', pos)
+                else:
+                    name_end = pos + name_length
+                path = data[pos:name_end]
+                # Entries are padded with 1 to 8 NUL bytes to a multiple of 8 bytes
+                pos = start + ((name_end - start + 8) & ~7)
+            previous = path
+            if pos > end:
+                raise GitIndexError("Entry exceeds the index data")
+
+            if mode & MODE_TYPE_MASK == MODE_DIRECTORY:
+                raise GitIndexError("Sparse directory entries are not supported")
+            # Skip symbolic links, submodules, and files not in the working tree
+            if mode & MODE_TYPE_MASK != MODE_REGULAR_FILE:
+                continue
+            if extended_flags & (EXTENDED_FLAG_SKIP_WORKTREE | EXTENDED_FLAG_INTENT_TO_ADD):
+                continue
+            # An unmerged path has an entry for each stage, it is taken once
+            if flags & FLAG_STAGE_MASK and path == last_path:
+                continue
+            last_path = path
+            paths.append(os.fsdecode(path))
+    except (struct.error, ValueError, IndexError) as error:
+        raise GitIndexError("Malformed index entry: {}".format(error))
+    return paths
+
+
+def read_index_entry_count(repo_path):
+    """Reads only the header of the git index of a repository
+    :returns number of entries in the index, or None if the repository has no readable index"""
+    try:
+        with open(os.path.join(repo_path, '.git', 'index'), 'rb') as file:
+            header = file.read(12)
+    except OSError:
+        return None
+    if len(header) < 12 or header[:4] != INDEX_SIGNATURE:
+        return None
+    return struct.unpack('>I', header[8:12])[0]
+
+
+def read_index_paths(repo_path):
+    """Reads paths of files tracked in the git index of a repository
+    :returns list of '/'-separated paths relative to repo_path, or None if the
+    repository has no valid index"""
+    try:
+        with open(os.path.join(repo_path, '.git', 'index'), 'rb') as file:
+            data = file.read()
+    except OSError:
+        return None
+    try:
+        return parse_index(data)
+    except GitIndexError:
+        return None
@@ -0,0 +1,119 @@
+import time
+import select
+import logging
+import threading
+import psycopg2
+import psycopg2.extensions
+from db_manager import DbManager, connect
+from config import DB_LANGUAGES_TTL, DB_LANGUAGES_NOTIFY_CHANNEL
+
+
+class LanguageCache:
+    """In-process cache of the languages table, which changes rarely.
+    Languages are loaded on first use and reloaded after ttl seconds (never if ttl is 0),
+    or after invalidate() is called, e.g. on a NOTIFY on the database channel.
+    Every load gets a new version number, so users can rebuild structures derived
+    from the languages only when they change."""
+
+    def __init__(self, ttl=DB_LANGUAGES_TTL, loader=None):
+        """:param loader: function returning result set of (id, name) of languages,
+        DbManager.select_languages if not given"""
+        self._ttl = ttl
+        self._loader = loader
+        self._languages = None
+        self._version = 0
+        self._loaded = 0.0
+        self._lock = threading.Lock()
+        self._listener = None
+        self._stopped = threading.Event()
+
+    def get(self):
+        """:returns tuple of version number and list of (id, name) tuples of languages"""
+        with self._lock:
+            if self._languages is None or self._is_expired():
+                self._load()
+            return self._version, self._languages
+
+    def languages(self):
+        """:returns list of (id, name) tuples of languages"""
+        return self.get()[1]
+
+    def invalidate(self):
+        """Makes the next get() reload the languages"""
+        with self._lock:
+            self._loaded = None
+
+    def _is_expired(self):
+        if self._loaded is None:
+            return True
+        return self._ttl > 0 and time.monotonic() - self._loaded > self._ttl
+
+    def _load(self):
+        """Loads the languages. Must be called with the lock held. If the reload
+        fails, the previously loaded languages are kept until the next expiry"""
+        loader = self._loader or DbManager.select_languages
+        try:
+            languages = [tuple(row) for row in loader()]
+        except Exception as e:
+            if self._languages is None:
+                raise
+            logging.warning("Could not reload languages, using the cached ones. Cause: {}".format(e))
+            self._loaded = time.monotonic()
+            return
+        self._loaded = time.monotonic()
+        if languages != self._languages:
+            self._languages = languages
+            self._version += 1
+            logging.info("Loaded {} languages (version {})".format(len(languages), self._version))
+
+    def listen(self, channel=DB_LANGUAGES_NOTIFY_CHANNEL):
+        """Starts a daemon thread invalidating the cache on every NOTIFY on the channel.
+        The thread has its own database connection and reconnects when it is lost"""
+        if not channel or self._listener is not None:
+            return
+        self._listener = threading.Thread(target=self._listen, args=(channel,),
+                                          name='language-cache-listener', daemon=True)
+        self._listener.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _listen(self, channel):
+        while not self._stopped.is_set():
+            connection = None
+            try:
+                connection = connect()
+                connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                connection.cursor().execute("LISTEN {}".format(psycopg2.extensions.quote_ident(channel, connection)))
+                logging.info("Listening for changes of languages on channel '{}'".format(channel))
+                # Changes made while not listening are missed, reload once
+                self.invalidate()
+                while not self._stopped.is_set():
+                    if select.select([connection], [], [], 5) == ([], [], []):
+                        continue
+                    connection.poll()
+                    if connection.notifies:
+                        connection.notifies.clear()
+                        logging.info("Languages changed, invalidating the language cache")
+                        self.invalidate()
+            except (psycopg2.Error, OSError) as e:
+                logging.warning("Language cache listener error, reconnecting. Cause: {}".format(e))
+                self._stopped.wait(5)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def shared_language_cache():
+    """:returns the language cache shared by all users in the process,
+    listening for NOTIFY if DB_LANGUAGES_NOTIFY_CHANNEL is set"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = LanguageCache()
+            _shared_cache.listen()
+        return _shared_cache
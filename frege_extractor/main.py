@@ -9,6 +9,7 @@ logging.basicConfig(
 
 from messenger import Messenger
 from db_manager import DbManager
+from metrics import start_exporter
 from config import RABBITMQ_HOST, RABBITMQ_PORT
 
 # Add package directory to system path (not necessary)
@@ -20,5 +21,6 @@ from config import RABBITMQ_HOST, RABBITMQ_PORT
 if __name__ == '__main__':
     logging.info("Starting frege-extractor app")
     DbManager.init_logger()
+    start_exporter()
     Messenger().app(RABBITMQ_HOST, RABBITMQ_PORT)
 
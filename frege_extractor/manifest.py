@@ -0,0 +1,67 @@
+import os
+import json
+import tempfile
+from config import OUTPUT_QUEUES, OUTPUT_INLINE_MAX_FILES
+
+MANIFEST_SUFFIX = '.manifest'
+
+
+def manifest_name(repo_id, queue):
+    """:returns file name of the manifest of a repository for an analyzer queue,
+    located in the repositories directory next to the repository folder"""
+    return '{}.{}{}'.format(repo_id, queue, MANIFEST_SUFFIX)
+
+
+def write_manifest(repos_directory, repo_id, queue, paths):
+    """Atomically writes a manifest: paths of files relative to the repositories
+    directory, encoded in UTF-8 (surrogateescape), each terminated by a NUL byte
+    :returns file name of the manifest"""
+    name = manifest_name(repo_id, queue)
+    fd, temp_path = tempfile.mkstemp(dir=repos_directory, prefix='.' + name, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            for path in paths:
+                file.write(path.encode('utf-8', 'surrogateescape') + b'\0')
+        os.replace(temp_path, os.path.join(repos_directory, name))
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return name
+
+
+def remove_manifests(repos_directory, repo_id, queues):
+    """Removes manifests of a repository for given queues, left by an earlier scan"""
+    for queue in queues:
+        try:
+            os.remove(os.path.join(repos_directory, manifest_name(repo_id, queue)))
+        except FileNotFoundError:
+            pass
+
+
+def language_messages(message, scan, repos_directory, inline_max_files=OUTPUT_INLINE_MAX_FILES):
+    """Builds output messages with the found files of every language: the input message
+    extended with the id of the repository_language entry, the number of files and
+    either the file paths ('files'), or if there are more than inline_max_files,
+    the name of a manifest file in the repositories directory ('manifest')
+    :param scan: ScanResult with the collected files
+    :returns list of (queue name, body bytes) tuples"""
+    repo_id = str(message['repo_id'])
+    messages = []
+    manifest_queues = set()
+    for lang_name in scan.lang_names:
+        queue = OUTPUT_QUEUES[lang_name]
+        lang_id = scan.lang_ids[lang_name]
+        count = scan.files.language_count(lang_id)
+        content = dict(message, repository_language_id=scan.repo_lang_ids[lang_name], file_count=count)
+        if count <= inline_max_files:
+            content['files'] = list(scan.files.language_paths(lang_id))
+        else:
+            content['manifest'] = write_manifest(repos_directory, repo_id, queue, scan.files.language_paths(lang_id))
+            manifest_queues.add(queue)
+        messages.append((queue, bytes(json.dumps(content), encoding='utf8')))
+    # Manifests of languages that are no longer found, or now fit in the message
+    remove_manifests(repos_directory, repo_id, set(OUTPUT_QUEUES.values()) - manifest_queues)
+    return messages
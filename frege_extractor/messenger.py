@@ -1,39 +1,114 @@
 import json
+import time
 import logging
+import os
+import hashlib
+import functools
 import pika
-import time
+from concurrent.futures import ThreadPoolExecutor
 from db_manager import DbManager
-from repo_scanner import RepoScanner
-from config import INPUT_QUEUE, OUTPUT_QUEUES, RMQ_REJECTED_PUBLISH_DELAY, REPOSITORIES_DIRECTORY
+from repo_scanner import RepoScanner, estimate_repo_size
+from publisher import Publisher
+from manifest import language_messages
+from profiling import Tracer
+from metrics import MESSAGES, PUBLISH_CONFIRM_SECONDS, QUEUE_WAIT_SECONDS
+from config import INPUT_QUEUE, OUTPUT_QUEUES, REPOSITORIES_DIRECTORY, EXTRACTOR_WORKERS, SCAN_INCREMENTAL, \
+    EXTRACTOR_SHARDS, EXTRACTOR_SHARD_IDS, EXTRACTOR_ROUTER, EXTRACTOR_MAX_IN_FLIGHT, \
+    EXTRACTOR_LARGE_REPO_FILES, EXTRACTOR_LARGE_WORKERS, OUTPUT_MANIFESTS
+
+
+def shard_queue(shard):
+    """:returns name of the input queue of a shard"""
+    return '{}.{}'.format(INPUT_QUEUE, shard)
+
+
+def shard_of(repo_id, shards):
+    """:returns number of the shard of a repository, from 0 to shards - 1. The shard depends
+    only on repo_id (not on the process, like hash() of a string), and when shards grows
+    by one, only about 1/shards of the repositories move, all to the new shard
+    (jump consistent hash of Lamping and Veach)"""
+    key = int.from_bytes(hashlib.sha1(repo_id.encode('utf-8')).digest()[:8], 'big')
+    shard, jump = -1, 0
+    while jump < shards:
+        shard = jump
+        key = (key * 2862933555777941757 + 1) & 0xffffffffffffffff
+        jump = int((shard + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return shard
+
+
+# Queue of the messages of large repositories, consumed by the large lanes of all nodes
+LARGE_QUEUE = '{}.large'.format(INPUT_QUEUE)
 
 
 class Messenger:
     """Handles input and output messages in RabbitMQ message-broker.
     Calls other classes' methods for extracting repository."""
 
-    def __init__(self):
+    def __init__(self, workers=EXTRACTOR_WORKERS, shards=EXTRACTOR_SHARDS, shard_ids=EXTRACTOR_SHARD_IDS,
+                 router=EXTRACTOR_ROUTER, large_repo_files=EXTRACTOR_LARGE_REPO_FILES,
+                 large_workers=EXTRACTOR_LARGE_WORKERS):
+        """:param shards: number of shard queues input messages are partitioned into
+        by repo_id, 0 if the input queue is consumed directly
+        :param shard_ids: numbers of the shards consumed by this node, all if empty
+        :param router: whether messages of the input queue are routed to the shard
+        queues instead of being scanned
+        :param large_repo_files: estimated number of files from which a repository is
+        scanned in the large lane, with its own large_workers, 0 if there are no lanes"""
+        self._connection = None
         # Input channel
         self._input_channel = None
-        # Output channel
-        self._output_channel = None
-        self.repo_scanner = RepoScanner(REPOSITORIES_DIRECTORY)
+        # Channel consuming the large queue, with its own prefetch count
+        self._large_channel = None
+        # Publisher of output messages, with its own connection
+        self._publisher = None
+        self._shards = shards
+        self._router = router and shards > 0
+        self._input_queues = [INPUT_QUEUE]
+        if shards > 0 and not self._router:
+            self._input_queues = [shard_queue(shard) for shard in (shard_ids or range(shards))]
+        # A repository may be delivered to two nodes (redelivery after a node failure),
+        # with sharding its files are always written as a difference, so they are not duplicated
+        self.repo_scanner = None if self._router else RepoScanner(
+            REPOSITORIES_DIRECTORY, incremental=SCAN_INCREMENTAL or shards > 0)
+        # Number of messages handled at the same time. With more than one worker,
+        # messages are scanned in a thread pool and acknowledged when finished
+        self._workers = workers
+        self._large_repo_files = large_repo_files
+        self._executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 or large_repo_files > 0 else None
+        # Large lane: big repositories are moved to the large queue and scanned by their own workers,
+        # so they do not hold up small ones
+        self._large_workers = large_workers
+        self._large_executor = ThreadPoolExecutor(max_workers=large_workers) if large_repo_files > 0 else None
+        # Traces stages of messages, profiles sampled and allow-listed ones and reports slow ones
+        self._tracer = Tracer()
 
     def app(self, rabbitmq_host, rabbitmq_port):
         """Main method of the app. Makes connection to RabbitMQ, initializes channels,
         performs loop for handling input messages"""
+        self._publisher = Publisher(rabbitmq_host, rabbitmq_port)
+        self._publisher.start()
         while True:
             try:
                 # Make connection to RabbitMQ
                 logging.info(f"Connecting to RabbitMQ ({rabbitmq_host}:{rabbitmq_port})...")
                 connection = pika.BlockingConnection(pika.ConnectionParameters(host=rabbitmq_host, port=rabbitmq_port))
+                self._connection = connection
                 self._create_channels(connection)
                 logging.info("Connected.")
+                if self._router:
+                    callback = self._input_callback_router
+                elif self._executor is None:
+                    callback = self._input_callback
+                else:
+                    callback = self._input_callback_concurrent
+                if self._large_channel is not None:
+                    self._large_channel.basic_consume(queue=LARGE_QUEUE, auto_ack=False,
+                                                      on_message_callback=self._large_callback)
                 while True:
-                    self._input_channel.basic_consume(
-                        queue=INPUT_QUEUE,
-                        auto_ack=False,
-                        on_message_callback=self._input_callback)
-                    logging.info(' [*] Waiting for a message about extracting a new repo...')
+                    for queue in self._input_queues:
+                        self._input_channel.basic_consume(queue=queue, auto_ack=False, on_message_callback=callback)
+                    logging.info(' [*] Waiting for a message about extracting a new repo on {}...'.format(
+                        ', '.join(self._input_queues)))
                     self._input_channel.start_consuming()
 
             except pika.exceptions.AMQPConnectionError as exception:
@@ -44,30 +119,149 @@ class Messenger:
                     connection.close()
                 except NameError:
                     pass
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                if self._large_executor is not None:
+                    self._large_executor.shutdown(wait=False)
+                self._publisher.stop()
+                DbManager.close_pool()
                 return
 
     def _create_channels(self, connection):
-        """Creates input and output channels"""
-        logging.info("Initializing input & output channels...")
+        """Creates input channel and declares input and output queues"""
+        logging.info("Initializing input channel...")
         # Create input channel
         self._input_channel = connection.channel()
+        self._large_channel = None
         self._input_channel.queue_declare(queue=INPUT_QUEUE, durable=True)
+        if self._shards > 0:
+            self._declare_shards()
+        if self._router:
+            # Messages are acknowledged when routed, let the broker deliver many at once
+            self._input_channel.basic_qos(prefetch_count=EXTRACTOR_MAX_IN_FLIGHT)
+        elif self._executor is not None:
+            # Let the broker deliver as many messages as there are workers
+            self._input_channel.basic_qos(prefetch_count=self._workers)
+            if self._large_executor is not None:
+                # The large queue is consumed on its own channel, so large repositories
+                # never take deliveries of the small lane
+                self._large_channel = connection.channel()
+                self._large_channel.queue_declare(queue=LARGE_QUEUE, durable=True)
+                self._large_channel.basic_qos(prefetch_count=self._large_workers)
 
-        # Create output channel
-        self._output_channel = connection.channel()
-        self._output_channel.confirm_delivery()
+        # Declare output queues, messages are sent to them by the publisher
         for q_name in OUTPUT_QUEUES.values():
-            self._output_channel.queue_declare(queue=q_name, durable=True)
+            self._input_channel.queue_declare(queue=q_name, durable=True)
+
+    def _declare_shards(self):
+        """Declares the shard queues. Messages are routed to them by shard_of their
+        repo_id, so every repository always goes to the same shard"""
+        for shard in range(self._shards):
+            self._input_channel.queue_declare(queue=shard_queue(shard), durable=True)
+
+    def _input_callback_router(self, ch, method, properties, body):
+        """Routes input message to its shard by repo_id. The message is acknowledged
+        when the broker has confirmed the routed message"""
+        delivery_tag = method.delivery_tag
+        try:
+            repo_id = str(json.loads(body.decode('utf-8'))['repo_id'])
+        except (ValueError, KeyError, TypeError) as e:
+            logging.error("Exception: the message doesn't have a correct JSON format or repo_id, "
+                          "dropping it. Cause: {}".format(e))
+            ch.basic_ack(delivery_tag=delivery_tag)
+            return
+        queue = shard_queue(shard_of(repo_id, self._shards))
+        logging.info("Routing repository '{}' to {}".format(repo_id, queue))
+        future = self._publisher.publish([(queue, body)])
+        future.add_done_callback(lambda _: self._ack_threadsafe(ch, delivery_tag))
 
     def _input_callback(self, ch, method, properties, body):
         """Handles input message and calls methods responsible for running
         scanner and sending output messages"""
         ch.stop_consuming()
+        result = self._handle_message(body)
+        if result is not None:
+            try:
+                # Wait until all output messages are confirmed
+                self._finish_message(*result).result()
+            except Exception as e:
+                logging.error("Could not send output messages. Cause: {}".format(e))
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def _input_callback_concurrent(self, ch, method, properties, body):
+        """Handles input message in the worker thread pool. The message is acknowledged
+        after its scan and output messages are complete. The message of a large
+        repository is moved to the large queue instead, and acknowledged when
+        the broker has confirmed it there"""
+        delivery_tag = method.delivery_tag
+        if self._is_large(body):
+            future = self._publisher.publish([(LARGE_QUEUE, body)])
+            future.add_done_callback(lambda _: self._ack_threadsafe(ch, delivery_tag))
+            return
+        self._executor.submit(self._handle_message_concurrent, ch, delivery_tag, body, time.perf_counter())
+
+    def _large_callback(self, ch, method, properties, body):
+        """Handles message of the large queue in the worker thread pool of the large lane"""
+        self._large_executor.submit(self._handle_message_concurrent, ch, method.delivery_tag, body,
+                                    time.perf_counter())
+
+    def _handle_message_concurrent(self, ch, delivery_tag, body, received):
+        """Runs in a worker thread. Scans the repository and sends output messages.
+        When they are confirmed, schedules the acknowledgement on the connection
+        thread, because pika channels are not thread-safe"""
+        QUEUE_WAIT_SECONDS.observe(time.perf_counter() - received)
+        result = self._handle_message(body)
+        future = None
+        if result is not None:
+            try:
+                future = self._finish_message(*result)
+            except Exception as e:
+                logging.error("Could not send output messages. Cause: {}".format(e))
+        if future is not None:
+            future.add_done_callback(lambda _: self._ack_threadsafe(ch, delivery_tag))
+        else:
+            self._ack_threadsafe(ch, delivery_tag)
+
+    def _is_large(self, body):
+        """Tells whether the repository of an input message goes to the large lane,
+        by a cheap estimate of its size. Invalid messages are left to the small lane"""
+        if self._large_executor is None:
+            return False
+        try:
+            repo_id = str(json.loads(body.decode('utf-8'))['repo_id'])
+        except (ValueError, KeyError, TypeError):
+            return False
+        size = estimate_repo_size(os.path.join(REPOSITORIES_DIRECTORY, repo_id), self._large_repo_files)
+        if size >= self._large_repo_files:
+            logging.info(f"Repository '{repo_id}' has about {size} files, moving it to the large queue")
+            return True
+        return False
+
+    def _ack_threadsafe(self, ch, delivery_tag):
+        """Schedules the acknowledgement on the connection that delivered the message. After
+        a reconnect, messages of the old channel are redelivered, so their acks are dropped"""
+        try:
+            ch.connection.add_callback_threadsafe(functools.partial(self._ack, ch, delivery_tag))
+        except Exception as e:
+            logging.error("Could not acknowledge the message, it will be redelivered. Cause: {}".format(e))
+
+    @staticmethod
+    def _ack(ch, delivery_tag):
+        """Acknowledges a message if its channel is still open. Runs on the connection thread"""
+        if not ch.is_open:
+            logging.warning("The channel of the message is closed, it will be redelivered")
+            return
+        ch.basic_ack(delivery_tag=delivery_tag)
+
+    def _handle_message(self, body):
+        """Decodes input message and scans the repository
+        :returns tuple of the message, ScanResult of the repository and MessageTrace
+        of the message, or None if the message could not be handled"""
         body_dec = body.decode('utf-8')
         logging.info("Received a new message: {}".format(body_dec))
         try:
             message = json.loads(body_dec)
-            lang_names = self._validate_scan_repo(message)
+            scan, trace = self._validate_scan_repo(message)
         except json.decoder.JSONDecodeError as err:
             logging.error("Exception: the message doesn't have a correct JSON format. {}".format(err))
         except Exception as e:
@@ -75,54 +269,71 @@ class Messenger:
                           "Aborting any further process for this message.\n Cause: {}".format(e))
             # logging.info("Aborting further process for this message")
         else:
-            # Send output messages to all queues mapped by found languages
-            self._send_message(message, [OUTPUT_QUEUES[lang_name] for lang_name in lang_names])
-            logging.info("Finished extractor task.\n")
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+            MESSAGES.inc(1, 'ok')
+            return message, scan, trace
+        MESSAGES.inc(1, 'error')
+        return None
+
+    def _finish_message(self, message, scan, trace):
+        """Sends output messages to all queues mapped by found languages. With OUTPUT_MANIFESTS,
+        every message carries the found files of its language or their manifest. If they
+        cannot be built (e.g. a manifest cannot be written), the input message is sent instead.
+        The trace of the message is finished when they are confirmed
+        :returns future resolved when the output messages are confirmed"""
+        published = time.perf_counter()
+        try:
+            with trace.stage('publish'):
+                messages = None
+                if scan.files is not None:
+                    try:
+                        messages = language_messages(message, scan, REPOSITORIES_DIRECTORY)
+                    except Exception as e:
+                        logging.error("Could not build output messages with files, sending the input message "
+                                      "instead. Cause: {}".format(e))
+                if messages is not None:
+                    logging.info(f"Sending message with files to {', '.join(queue for queue, _ in messages)}...")
+                    future = self._publisher.publish(messages)
+                else:
+                    future = self._send_message(message, [OUTPUT_QUEUES[lang_name] for lang_name in scan.lang_names])
+        finally:
+            # Confirms arrive on the publisher thread
+            trace.detach()
+        sent = time.perf_counter()
+
+        def confirmed(_):
+            PUBLISH_CONFIRM_SECONDS.observe(time.perf_counter() - published)
+            trace.add_stage('publish_confirm', time.perf_counter() - sent)
+            trace.finish()
+        future.add_done_callback(confirmed)
+        future.add_done_callback(lambda _: logging.info("Finished extractor task.\n"))
+        logging.info("Database connection pool: {}".format(DbManager.pool_stats()))
+        return future
 
     def _validate_scan_repo(self, message):
         """Validates input message and runs RepoScanner on proper repository
-        :returns language names found in the repository, returned by
-        self.repo_scanner.run_scanner()"""
+        :returns tuple of ScanResult of the repository, returned by
+        self.repo_scanner.scan_repository(), and MessageTrace of the message"""
         if 'repo_id' not in message:
             raise Exception("Did not found \"repo_id\" entry in the JSON message")
         repo_id = str(message['repo_id'])
+        trace = self._tracer.start(repo_id)
         try:
-            # Check if repo_id is present in repositories
-            if not DbManager.select_repository_by_id(repo_id):
-                raise Exception(f'Did not found repository \'{repo_id}\' in the repositories table.')
+            # Presence of repo_id in repositories is checked in the transaction saving the scan
             logging.info("Running repo scanner for \'{}\'".format(repo_id))
-            found_languages = self.repo_scanner.run_scanner(repo_id)
+            found_languages = self.repo_scanner.scan_repository(repo_id, collect_files=OUTPUT_MANIFESTS)
         except Exception as e:
             # logging.error("Exception while scanning repository \'{}\'. Aborting further process for this repo.\n"
             #               "Cause: {}".format(repo_id, e))
+            trace.finish(e)
             raise e
         else:
             logging.info("Repository scan complete")
-            return found_languages
+            return found_languages, trace
 
     def _send_message(self, message, queues):
-        """Send output message to queues specified by name"""
-        while True:
-            # List of queues to retry sending
-            queues_retry = []
-            for queue in queues:
-                try:
-                    logging.info(f"Sending message to {queue}...")
-                    self._output_channel.basic_publish(
-                        exchange='',
-                        routing_key=queue,
-                        properties=pika.BasicProperties(delivery_mode=2, ),
-                        body=bytes(json.dumps(message), encoding='utf8')
-                    )
-                    logging.info("Output message received by RabbitMQ")
-                except pika.exceptions.NackError as e:
-                    logging.info(f"Output message NACK from RabbitMQ (queue full)."
-                                 f" Retrying in {RMQ_REJECTED_PUBLISH_DELAY} s")
-                    queues_retry.append(queue)
-            # If the queues to retry list is not empty
-            if queues_retry:
-                queues = queues_retry
-                time.sleep(RMQ_REJECTED_PUBLISH_DELAY)
-            else:
-                break
+        """Send output message to queues specified by name. Messages are
+        published back-to-back, NACKed ones are retried by the publisher
+        :returns future resolved when all messages are confirmed by RabbitMQ"""
+        body = bytes(json.dumps(message), encoding='utf8')
+        logging.info(f"Sending message to {', '.join(queues)}...")
+        return self._publisher.publish([(queue, body) for queue in queues])
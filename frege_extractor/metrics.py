@@ -0,0 +1,264 @@
+import os
+import time
+import logging
+import tempfile
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import METRICS_PORT, METRICS_TEXTFILE, METRICS_TEXTFILE_INTERVAL
+
+# Upper bounds of histogram buckets for durations, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Upper bounds of histogram buckets for scan throughput, in files per second
+THROUGHPUT_BUCKETS = (10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, 500000)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Metric with optional labels, rendered in the Prometheus text exposition format"""
+    type_name = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.label_names):
+            raise ValueError("Metric {} expects labels {}".format(self.name, self.label_names))
+        return tuple(labels)
+
+    def _sample_name(self):
+        """:returns name of the metric in its HELP and TYPE lines, the name of its samples"""
+        return self.name
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self._sample_name(), self.documentation),
+                 '# TYPE {} {}'.format(self._sample_name(), self.type_name)]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.extend(self._render_value(labels, value))
+        return lines
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, *labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _sample_name(self):
+        # In the text format 0.0.4, the samples of a counter are named by its TYPE line
+        return self.name + '_total'
+
+    def _render_value(self, labels, value):
+        return ['{}{} {}'.format(self._sample_name(), _format_labels(self.label_names, labels),
+                                 _format_value(value))]
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Counts of observations per bucket (the last one is +Inf), and sum of observed values
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+
+    def time(self, *labels):
+        """:returns context manager observing the duration of its block"""
+        return _Timer(self, labels)
+
+    def _render_value(self, labels, value):
+        bucket_counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), bucket_counts):
+            cumulative += count
+            lines.append('{}_bucket{} {}'.format(
+                self.name, _format_labels(self.label_names, labels, ('le', _format_value(float(bound)))), cumulative))
+        label_str = _format_labels(self.label_names, labels)
+        lines.append('{}_sum{} {}'.format(self.name, label_str, _format_value(total)))
+        lines.append('{}_count{} {}'.format(self.name, label_str, cumulative))
+        return lines
+
+
+class _Timer:
+
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._histogram.observe(time.perf_counter() - self._start, *self._labels)
+
+
+class TimedIterator:
+    """Iterator of (file path, language ID) or (directory path, file name, language ID)
+    tuples, which measures the time spent producing them (the walk) apart from
+    the time spent by its consumer, and counts the produced files per language"""
+
+    def __init__(self, iterator):
+        self._iterator = iter(iterator)
+        self.seconds = 0.0
+        self.lang_counts = {}
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            item = next(self._iterator)
+        finally:
+            self.seconds += time.perf_counter() - start
+        self.lang_counts[item[-1]] = self.lang_counts.get(item[-1], 0) + 1
+        return item
+
+    @property
+    def files(self):
+        return sum(self.lang_counts.values())
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """:returns all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+MESSAGES = REGISTRY.register(Counter(
+    'extractor_messages', "Input messages handled, by result", ['result']))
+FILES = REGISTRY.register(Counter(
+    'extractor_files', "Source files found, by language", ['language']))
+WALK_SECONDS = REGISTRY.register(Histogram(
+    'extractor_walk_seconds', "Time of listing source files of a repository"))
+FILES_PER_SECOND = REGISTRY.register(Histogram(
+    'extractor_files_per_second', "Source files found per second of a repository walk",
+    buckets=THROUGHPUT_BUCKETS))
+DB_WRITE_SECONDS = REGISTRY.register(Histogram(
+    'extractor_db_write_seconds', "Time of saving a repository scan in the database, without the walk"))
+PUBLISH_CONFIRM_SECONDS = REGISTRY.register(Histogram(
+    'extractor_publish_confirm_seconds', "Time from publishing output messages of a repository to their confirms"))
+QUEUE_WAIT_SECONDS = REGISTRY.register(Histogram(
+    'extractor_queue_wait_seconds', "Time an input message waits in the process before it is handled"))
+SLOW_MESSAGES = REGISTRY.register(Counter(
+    'extractor_slow_messages', "Input messages handled in more than PROFILE_SLOW_SECONDS"))
+
+
+def observe_scan(language_name, timed_files, total_seconds):
+    """Records metrics of a finished repository scan
+    :param language_name: function returning name of a language by its ID
+    :param timed_files: exhausted TimedIterator of the scanned files
+    :param total_seconds: time of the walk and the database write together"""
+    WALK_SECONDS.observe(timed_files.seconds)
+    if timed_files.seconds > 0:
+        FILES_PER_SECOND.observe(timed_files.files / timed_files.seconds)
+    DB_WRITE_SECONDS.observe(max(total_seconds - timed_files.seconds, 0.0))
+    for lang_id, count in timed_files.lang_counts.items():
+        FILES.inc(count, language_name(lang_id) or str(lang_id))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def write_textfile(path):
+    """Atomically writes all metrics to a file, for the textfile collector of node_exporter"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            file.write(REGISTRY.render())
+        os.replace(temp_path, path)
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _write_textfile_loop(path, interval):
+    while True:
+        try:
+            write_textfile(path)
+        except OSError as e:
+            logging.warning("Could not write metrics to {}: {}".format(path, e))
+        time.sleep(interval)
+
+
+def start_exporter(port=METRICS_PORT, textfile=METRICS_TEXTFILE, interval=METRICS_TEXTFILE_INTERVAL):
+    """Serves metrics on http://0.0.0.0:<port>/metrics if port is set, and writes
+    them to the textfile every interval seconds if textfile is set, in daemon threads"""
+    if port:
+        server = ThreadingHTTPServer(('', port), _MetricsHandler)
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+        logging.info("Serving metrics on port {}".format(port))
+    if textfile:
+        threading.Thread(target=_write_textfile_loop, args=(textfile, interval),
+                         name='metrics-textfile', daemon=True).start()
+        logging.info("Writing metrics to {} every {} s".format(textfile, interval))
@@ -0,0 +1,165 @@
+import io
+import os
+import re
+import json
+import time
+import pstats
+import random
+import cProfile
+import logging
+import threading
+from metrics import SLOW_MESSAGES
+from config import PROFILE_SAMPLE_RATE, PROFILE_REPO_IDS, PROFILE_SLOW_SECONDS, PROFILE_DIR
+
+# Number of functions listed in the text summary of a saved profile
+SUMMARY_FUNCTIONS = 40
+
+# Trace of the message handled by the current thread
+_current = threading.local()
+
+
+def record_stage(name, seconds):
+    """Adds wall time of a stage to the trace of the message handled by the current thread, if any"""
+    trace = getattr(_current, 'trace', None)
+    if trace is not None:
+        trace.add_stage(name, seconds)
+
+
+class MessageTrace:
+    """Wall times of the stages of one input message, from the start of its scan
+    to the confirms of its output messages, and its cProfile profile if it is profiled"""
+
+    def __init__(self, tracer, repo_id, profiler):
+        self.repo_id = repo_id
+        # Wall times of the stages in seconds, in the order they were recorded
+        self.stages = {}
+        self.started = time.perf_counter()
+        self._tracer = tracer
+        self._profiler = profiler
+        # Whether the trace is attached to the thread that started it, and its profiler enabled
+        self._attached = True
+
+    @property
+    def profiled(self):
+        return self._profiler is not None
+
+    def add_stage(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def stage(self, name):
+        """:returns context manager adding the wall time of its block to a stage"""
+        return _Stage(self, name)
+
+    def detach(self):
+        """Stops profiling and detaches the trace from the thread that started it. Must be called
+        in that thread, before the work of the message moves to other threads (publisher confirms)"""
+        if not self._attached:
+            return
+        self._attached = False
+        if getattr(_current, 'trace', None) is self:
+            _current.trace = None
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._tracer.profiling_stopped()
+
+    def finish(self, error=None):
+        """Completes the trace: logs stage times of a slow message and saves its profile.
+        Can be called in any thread if the trace is detached"""
+        self.detach()
+        self._tracer.finish(self, time.perf_counter() - self.started, error)
+
+    def dump_stats(self, path):
+        self._profiler.dump_stats(path)
+
+    def summary(self):
+        """:returns text of the profile, functions sorted by cumulative time"""
+        stream = io.StringIO()
+        pstats.Stats(self._profiler, stream=stream).sort_stats('cumulative').print_stats(SUMMARY_FUNCTIONS)
+        return stream.getvalue()
+
+
+class _Stage:
+
+    def __init__(self, trace, name):
+        self._trace = trace
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._trace.add_stage(self._name, time.perf_counter() - self._start)
+
+
+class Tracer:
+    """Starts traces of input messages. A message is profiled with cProfile if its repository
+    is in the allow-list or it is sampled, one message at a time, because the profiler of
+    the interpreter may be used by only one thread. Only the thread handling the message is
+    profiled, not the walk threads or the publisher. Messages slower than slow_seconds are
+    logged with their stage times, and their profiles are saved in the profile directory"""
+
+    def __init__(self, sample_rate=PROFILE_SAMPLE_RATE, repo_ids=PROFILE_REPO_IDS,
+                 slow_seconds=PROFILE_SLOW_SECONDS, profile_dir=PROFILE_DIR):
+        self.sample_rate = sample_rate
+        self.repo_ids = frozenset(repo_ids)
+        self.slow_seconds = slow_seconds
+        self.profile_dir = profile_dir
+        # Held while a message is profiled
+        self._profile_lock = threading.Lock()
+
+    def start(self, repo_id):
+        """Starts the trace of a message, attached to the current thread
+        :returns MessageTrace"""
+        profiler = None
+        if (repo_id in self.repo_ids or (self.sample_rate > 0 and random.random() < self.sample_rate)) \
+                and self._profile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError as e:
+                # Another profiler is active in the interpreter
+                logging.warning("Could not profile '{}': {}".format(repo_id, e))
+                self._profile_lock.release()
+                profiler = None
+        trace = MessageTrace(self, repo_id, profiler)
+        _current.trace = trace
+        return trace
+
+    def profiling_stopped(self):
+        """Lets the next message be profiled"""
+        self._profile_lock.release()
+
+    def finish(self, trace, seconds, error=None):
+        """Logs stage times of a slow message, and saves its profile if it was profiled"""
+        if self.slow_seconds <= 0 or seconds < self.slow_seconds:
+            return
+        SLOW_MESSAGES.inc()
+        stages = ', '.join('{} {:.2f} s'.format(name, stage_seconds) for name, stage_seconds in trace.stages.items())
+        logging.warning("Slow message of '{}': {:.2f} s ({}){}".format(
+            trace.repo_id, seconds, stages or 'no stages', ', failed' if error else ''))
+        if trace.profiled:
+            self.save(trace, seconds, error)
+
+    def save(self, trace, seconds, error=None):
+        """Saves the profile of a message (.prof, readable with pstats or snakeviz),
+        its text summary (.txt) and the stage times (.json)
+        :returns path of the saved files without extension"""
+        now = time.time()
+        name = '{}.{:03d}-{}'.format(time.strftime('%Y%m%d-%H%M%S', time.localtime(now)), int(now * 1000) % 1000,
+                                     re.sub(r'[^\w.-]', '_', trace.repo_id))
+        path = os.path.join(self.profile_dir, name)
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            trace.dump_stats(path + '.prof')
+            with open(path + '.txt', 'w') as file:
+                file.write(trace.summary())
+            with open(path + '.json', 'w') as file:
+                json.dump({'repo_id': trace.repo_id, 'seconds': seconds, 'stages': trace.stages,
+                           'error': str(error) if error else None}, file, indent=2)
+        except OSError as e:
+            logging.warning("Could not save the profile of '{}': {}".format(trace.repo_id, e))
+            return None
+        logging.warning("Saved the profile of '{}' to {}.prof".format(trace.repo_id, path))
+        return path
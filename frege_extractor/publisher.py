@@ -0,0 +1,176 @@
+import logging
+import functools
+import threading
+import pika
+from concurrent.futures import Future
+from pika.adapters.select_connection import IOLoop
+from config import RMQ_REJECTED_PUBLISH_DELAY, RMQ_MAX_PUBLISH_DELAY
+
+
+class _Batch:
+    """Group of deliveries whose future is resolved when all of them are confirmed"""
+
+    def __init__(self, size):
+        self.future = Future()
+        self._remaining = size
+        if size == 0:
+            self.future.set_result(None)
+
+    def confirm(self):
+        self._remaining -= 1
+        if self._remaining == 0:
+            self.future.set_result(None)
+
+
+class _Delivery:
+    """Output message waiting for a broker confirm"""
+
+    def __init__(self, queue, body, batch, exchange=''):
+        # Routing key, the queue name for the default exchange
+        self.queue = queue
+        self.body = body
+        self.exchange = exchange
+        self.batch = batch
+        # Number of times the message was rejected by the broker
+        self.attempts = 0
+
+
+class Publisher:
+    """Publishes output messages on its own RabbitMQ connection, running
+    in a background thread. Messages are sent back-to-back and broker confirms
+    are collected asynchronously by delivery tag. Rejected (NACK) messages are
+    republished with exponential backoff without blocking other messages."""
+
+    def __init__(self, host, port, retry_delay=RMQ_REJECTED_PUBLISH_DELAY, max_retry_delay=RMQ_MAX_PUBLISH_DELAY):
+        self._parameters = pika.ConnectionParameters(host=host, port=port)
+        self._retry_delay = retry_delay
+        self._max_retry_delay = max_retry_delay
+        self._ioloop = IOLoop()
+        self._thread = None
+        self._connection = None
+        self._channel = None
+        self._stopping = False
+        # Delivery tag of the last message published on the current channel
+        self._delivery_tag = 0
+        # Published deliveries waiting for a confirm, by delivery tag
+        self._unconfirmed = {}
+        # Deliveries waiting for the channel to open
+        self._outbox = []
+
+    def start(self):
+        """Starts connecting and the I/O loop thread"""
+        self._ioloop.add_callback_threadsafe(self._connect)
+        self._thread = threading.Thread(target=self._ioloop.start, name='publisher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Closes the connection and stops the I/O loop thread"""
+        self._ioloop.add_callback_threadsafe(self._stop)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def publish(self, messages, exchange=''):
+        """Publishes messages, can be called from any thread
+        :param messages: list of (queue name, body bytes) tuples, or (routing key,
+        body bytes) tuples if an exchange is given
+        :returns concurrent.futures.Future resolved when the broker
+        has confirmed all of the messages"""
+        batch = _Batch(len(messages))
+        deliveries = [_Delivery(queue, body, batch, exchange) for queue, body in messages]
+        if deliveries:
+            self._ioloop.add_callback_threadsafe(functools.partial(self._publish_all, deliveries))
+        return batch.future
+
+    def _connect(self):
+        logging.info("Connecting publisher to RabbitMQ ({}:{})...".format(
+            self._parameters.host, self._parameters.port))
+        self._connection = pika.SelectConnection(
+            self._parameters,
+            on_open_callback=self._on_connection_open,
+            on_open_error_callback=self._on_connection_open_error,
+            on_close_callback=self._on_connection_closed,
+            custom_ioloop=self._ioloop)
+
+    def _reconnect(self):
+        self._channel = None
+        # Messages that were not confirmed are sent again on the new channel
+        self._outbox = list(self._unconfirmed.values()) + self._outbox
+        self._unconfirmed = {}
+        if not self._stopping:
+            self._ioloop.call_later(max(self._retry_delay, 1), self._connect)
+
+    def _on_connection_open(self, connection):
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_open_error(self, connection, error):
+        logging.error("Publisher could not connect to RabbitMQ: {}".format(error))
+        self._reconnect()
+
+    def _on_connection_closed(self, connection, reason):
+        if self._stopping:
+            self._ioloop.stop()
+            return
+        logging.error("Publisher connection closed: {}".format(reason))
+        self._reconnect()
+
+    def _on_channel_open(self, channel):
+        self._channel = channel
+        self._delivery_tag = 0
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.confirm_delivery(ack_nack_callback=self._on_delivery_confirmation,
+                                 callback=self._on_confirm_select)
+
+    def _on_channel_closed(self, channel, reason):
+        logging.error("Publisher channel closed: {}".format(reason))
+        self._channel = None
+        if not self._stopping and self._connection.is_open:
+            self._connection.close()
+
+    def _on_confirm_select(self, frame):
+        logging.info("Publisher connected.")
+        outbox, self._outbox = self._outbox, []
+        self._publish_all(outbox)
+
+    def _publish_all(self, deliveries):
+        for delivery in deliveries:
+            self._publish(delivery)
+
+    def _publish(self, delivery):
+        if self._channel is None or not self._channel.is_open:
+            self._outbox.append(delivery)
+            return
+        self._channel.basic_publish(
+            exchange=delivery.exchange,
+            routing_key=delivery.queue,
+            properties=pika.BasicProperties(delivery_mode=2, ),
+            body=delivery.body)
+        self._delivery_tag += 1
+        self._unconfirmed[self._delivery_tag] = delivery
+
+    def _on_delivery_confirmation(self, frame):
+        method = frame.method
+        if method.multiple:
+            tags = [tag for tag in self._unconfirmed if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        for tag in tags:
+            delivery = self._unconfirmed.pop(tag, None)
+            if delivery is None:
+                continue
+            if acked:
+                logging.info(f"Output message to {delivery.queue} received by RabbitMQ")
+                delivery.batch.confirm()
+            else:
+                delay = min(self._retry_delay * 2 ** delivery.attempts, self._max_retry_delay)
+                delivery.attempts += 1
+                logging.info(f"Output message to {delivery.queue} NACK from RabbitMQ (queue full)."
+                             f" Retrying in {delay} s")
+                self._ioloop.call_later(delay, functools.partial(self._publish, delivery))
+
+    def _stop(self):
+        self._stopping = True
+        if self._connection is not None and self._connection.is_open:
+            self._connection.close()
+        else:
+            self._ioloop.stop()
@@ -1,27 +1,374 @@
 import os
 import re
+import sys
+import fnmatch
 import logging
-from db_manager import DbManager
+import time
+import queue
+import threading
+from array import array
+from collections import namedtuple
+from db_manager import DbManager, RepositoryNotFoundError
 from ext_lang_mapper import ExtLangMapper
+from scan_cache import ScanCache
+from git_index import read_index_paths, read_index_entry_count
+from content_detector import ContentDetector
+from file_stats import FileStats
+from language_cache import shared_language_cache
+from metrics import TimedIterator, observe_scan
+from profiling import record_stage
+from config import SCAN_STREAMING, SCAN_INCREMENTAL, SCAN_CACHE_DIR, SCAN_CACHE_MAX_SIZE, SCAN_USE_GIT_INDEX, \
+    SCAN_CONTENT_DETECTION, SCAN_DETECT_BATCH_SIZE, SCAN_LOG_FILES, SCAN_PRUNED_DIRS, SCAN_WALK_THREADS, SCAN_PARALLEL_MIN_DIRS, \
+    SCAN_FILE_SIZES, SCAN_LINE_COUNTS
+
+
+def make_prune_matcher(patterns):
+    """:returns function telling whether a directory name matches any of
+    the names or glob patterns, in which case it should not be walked"""
+    names = frozenset(p for p in patterns if not any(c in p for c in '*?['))
+    globs = [re.compile(fnmatch.translate(p)) for p in patterns if p not in names]
+
+    def is_pruned(name):
+        return name in names or any(g.match(name) for g in globs)
+    return is_pruned
+
+
+def scan_directory(dirpath, is_pruned):
+    """Lists a directory with os.scandir, using the file type information of
+    directory entries instead of stat calls. Symbolic links are not followed,
+    subdirectories for which is_pruned(name) is true are omitted.
+    :returns tuple of subdirectories' paths and file names, or None if
+    the directory could not be read"""
+    subdirs = []
+    filenames = []
+    try:
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not is_pruned(entry.name):
+                            subdirs.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        filenames.append(entry.name)
+                except OSError:
+                    pass
+    except OSError as error:
+        logging.warning("Could not read directory {}: {}".format(dirpath, error))
+        return None
+    return subdirs, filenames
+
+
+def walk_tree(top, is_pruned, threads=0, parallel_min_dirs=0):
+    """Walks directory tree, skipping directories for which is_pruned(name) is true
+    with their contents. If threads > 1 and top has at least parallel_min_dirs
+    subdirectories, they are walked in a pool of threads.
+    :returns iterator of (dirpath, filenames) tuples"""
+    scanned = scan_directory(top, is_pruned)
+    if scanned is None:
+        return
+    subdirs, filenames = scanned
+    yield top, filenames
+    if threads > 1 and subdirs and len(subdirs) >= parallel_min_dirs:
+        yield from _walk_parallel(subdirs, is_pruned, threads)
+    else:
+        yield from _walk_serial(subdirs, is_pruned)
+
+
+def _walk_serial(dirs, is_pruned):
+    stack = list(dirs)
+    while stack:
+        dirpath = stack.pop()
+        scanned = scan_directory(dirpath, is_pruned)
+        if scanned is None:
+            continue
+        subdirs, filenames = scanned
+        stack.extend(subdirs)
+        yield dirpath, filenames
+
+
+class _WalkError:
+    """Exception raised in a walking thread, passed to the consumer"""
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def _walk_parallel(dirs, is_pruned, threads):
+    """Walks directory trees in a pool of threads sharing one queue of directories.
+    A free thread takes the next directory and queues the subdirectories it finds,
+    so the work spreads evenly no matter how unbalanced the trees are"""
+    pending = queue.Queue()
+    # Bounded, so that the walk does not run far ahead of the consumer
+    results = queue.Queue(maxsize=threads * 16)
+    stop = threading.Event()
+    done = object()
+    # Number of queued directories that are not scanned yet
+    outstanding = [len(dirs)]
+    lock = threading.Lock()
+
+    def put_result(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def worker():
+        while not stop.is_set():
+            dirpath = pending.get()
+            if dirpath is None:
+                return
+            try:
+                scanned = scan_directory(dirpath, is_pruned)
+                subdirs, filenames = scanned if scanned is not None else ([], None)
+                # Subdirectories are counted before they are queued, and the directory is taken off
+                # only after its results, so the count cannot drop to 0 while the walk goes on
+                with lock:
+                    outstanding[0] += len(subdirs)
+                for subdir in subdirs:
+                    pending.put(subdir)
+                if filenames is not None:
+                    put_result((dirpath, filenames))
+                with lock:
+                    outstanding[0] -= 1
+                    finished = outstanding[0] == 0
+                if finished:
+                    put_result(done)
+            except Exception as e:
+                put_result(_WalkError(e))
+                return
+
+    for dirpath in dirs:
+        pending.put(dirpath)
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    try:
+        while True:
+            item = results.get()
+            if item is done:
+                break
+            if isinstance(item, _WalkError):
+                raise item.exception
+            yield item
+    finally:
+        stop.set()
+        # Wake up threads waiting for a directory
+        for _ in workers:
+            pending.put(None)
+
+
+def estimate_repo_size(repo_path, limit):
+    """Cheap estimate of the number of files of a repository, for scheduling: the number
+    of entries of its git index, otherwise the number of entries in its top two
+    directory levels, counted up to limit
+    :returns estimated number of files, 0 if the folder cannot be read"""
+    count = read_index_entry_count(repo_path)
+    if count is not None:
+        return count
+    count = 0
+    subdirs = []
+    try:
+        with os.scandir(repo_path) as entries:
+            for entry in entries:
+                count += 1
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+    except OSError:
+        return 0
+    for subdir in subdirs:
+        if count >= limit:
+            break
+        try:
+            with os.scandir(subdir) as entries:
+                count += sum(1 for _ in entries)
+        except OSError:
+            pass
+    return count
+
+
+class FileList:
+    """Compact list of (file path, language ID) tuples of a repository scan.
+    Directory paths are stored once in a table, file names in one buffer,
+    and directory ids, name offsets and language ids in arrays of integers.
+    Iterating yields the tuples, joined paths are built only then"""
+
+    def __init__(self, files_langs=()):
+        # Directory paths by their ids, and ids by paths
+        self._dirs = []
+        self._dir_ids = {}
+        # File names encoded with os.fsencode, one after another, and the offsets of their ends
+        self._names = bytearray()
+        self._name_ends = array('Q')
+        self._file_dir_ids = array('L')
+        self._lang_ids = array('L')
+        self.extend(files_langs)
+
+    def add(self, dirpath, filename, lang_id):
+        dir_id = self._dir_ids.get(dirpath)
+        if dir_id is None:
+            dir_id = self._dir_ids[dirpath] = len(self._dirs)
+            self._dirs.append(dirpath)
+        self._names += os.fsencode(filename)
+        self._name_ends.append(len(self._names))
+        self._file_dir_ids.append(dir_id)
+        self._lang_ids.append(lang_id)
+
+    def append(self, file_path, lang_id):
+        dirpath, _, filename = file_path.rpartition(os.sep)
+        self.add(dirpath, filename, lang_id)
+
+    def extend(self, files_langs):
+        append = self.append
+        for file_path, lang_id in files_langs:
+            append(file_path, lang_id)
+
+    def add_all(self, dir_files_langs):
+        """Adds (directory path, file name, language ID) tuples, without joining and splitting paths"""
+        add = self.add
+        for dirpath, filename, lang_id in dir_files_langs:
+            add(dirpath, filename, lang_id)
+
+    def __len__(self):
+        return len(self._lang_ids)
+
+    def __iter__(self):
+        dirs = self._dirs
+        names = memoryview(self._names)
+        encoding, errors = sys.getfilesystemencoding(), sys.getfilesystemencodeerrors()
+        start = 0
+        for end, dir_id, lang_id in zip(self._name_ends, self._file_dir_ids, self._lang_ids):
+            filename = str(names[start:end], encoding, errors)
+            start = end
+            dirpath = dirs[dir_id]
+            yield (dirpath + os.sep + filename if dirpath else filename), lang_id
+
+    def _paths(self, indexes):
+        """:returns iterator of paths of the files at given indexes"""
+        dirs = self._dirs
+        names = memoryview(self._names)
+        name_ends = self._name_ends
+        encoding, errors = sys.getfilesystemencoding(), sys.getfilesystemencodeerrors()
+        for i in indexes:
+            filename = str(names[name_ends[i - 1] if i else 0:name_ends[i]], encoding, errors)
+            dirpath = dirs[self._file_dir_ids[i]]
+            yield dirpath + os.sep + filename if dirpath else filename
+
+    def present_lang_ids(self):
+        """:returns set of IDs of the languages of the files"""
+        return set(self._lang_ids)
+
+    def language_paths(self, lang_id):
+        """:returns iterator of paths of the files of given language. Only their paths are decoded"""
+        return self._paths(i for i, file_lang_id in enumerate(self._lang_ids) if file_lang_id == lang_id)
+
+    def language_count(self, lang_id):
+        """:returns number of the files of given language"""
+        return self._lang_ids.count(lang_id)
+
+    def collect(self, files_langs):
+        """Passes (file path, language ID) tuples through while appending them to the list"""
+        append = self.append
+        for file_path, lang_id in files_langs:
+            append(file_path, lang_id)
+            yield file_path, lang_id
+
+
+# Result of a saved repository scan: names of the found languages, dictionaries mapping
+# language names to their IDs and to ids of the repository_language entries of the repository,
+# and FileList of the found files if collected
+ScanResult = namedtuple('ScanResult', ['lang_names', 'lang_ids', 'repo_lang_ids', 'files'])
 
 
 class RepoScanner:
     """Scanner of repository folder located in the file system.
     Finds source files by extension."""
 
-    def __init__(self, repos_directory):
-        # File extension pattern
-        self.__ext_pattern = re.compile(r'\.([0-9a-zA-Z]*)$')
+    def __init__(self, repos_directory, streaming=SCAN_STREAMING, pruned_dirs=SCAN_PRUNED_DIRS,
+                 walk_threads=SCAN_WALK_THREADS, parallel_min_dirs=SCAN_PARALLEL_MIN_DIRS, languages=None,
+                 incremental=SCAN_INCREMENTAL, cache_dir=SCAN_CACHE_DIR, use_git_index=SCAN_USE_GIT_INDEX,
+                 content_detection=SCAN_CONTENT_DETECTION, log_files=SCAN_LOG_FILES,
+                 file_sizes=SCAN_FILE_SIZES, line_counts=SCAN_LINE_COUNTS):
+        """:param languages: result set of (id, name) of languages, taken from
+        the shared language cache (and refreshed with it) if not given"""
+        self.repos_directory = repos_directory
+        # Whether found files are streamed to the database while the repo is walked
+        self.streaming = streaming
+        # Whether only the difference between found and stored files is written to the database
+        self.incremental = incremental
+        self._pruned_dirs = pruned_dirs
+        # Tells whether a directory should be skipped by its name
+        self._is_pruned = make_prune_matcher(pruned_dirs)
+        # Number of threads walking a repository, and number of its top-level
+        # directories from which the walk is parallel
+        self.walk_threads = walk_threads
+        self.parallel_min_dirs = parallel_min_dirs
+        # Whether files of git repositories are listed from the git index instead of walking the folder
+        self.use_git_index = use_git_index
+        self._content_detection = content_detection
+        # Whether every found source file is logged
+        self.log_files = log_files
+        self._cache_dir = cache_dir
+        # Measures sizes (and line counts) of the found files, which are saved with them.
+        # Counting lines implies sizes
+        self._file_stats = None
+        if file_sizes or line_counts:
+            self._file_stats = FileStats(repos_directory, line_counts)
 
+        # Languages are refreshed from the cache before scans, unless given
+        self._language_cache = None
+        self._languages_version = None
+        self._languages_lock = threading.Lock()
+        # Detector of languages of extensionless files and files with ambiguous extensions
+        self._content_detector = None
+        if languages is None:
+            self._language_cache = shared_language_cache()
+            self._languages_version, languages = self._language_cache.get()
+        self._set_languages(languages)
+
+    def _set_languages(self, languages):
+        """Builds the structures derived from the languages: names by ids,
+        extension mapper, content detector and the scan cache"""
         # Dictionary that maps languages' ids to their names
-        self._language_id_name = dict(DbManager.select_languages())
+        self._language_id_name = dict(languages)
+        self._ext_lang_mapper = ExtLangMapper(languages)
+        # The detector and its thread pool are kept across refreshes
+        if self._content_detector is not None:
+            self._content_detector.set_ext_lang_mapper(self._ext_lang_mapper)
+        elif self._content_detection:
+            self._content_detector = ContentDetector(self._ext_lang_mapper)
+        # Cache of scan results of unchanged repositories
+        self._scan_cache = None
+        if self._cache_dir:
+            # Listing files from the git index leaves out untracked files, which the walk finds
+            signature = repr((self._ext_lang_mapper.signature(), sorted(self._pruned_dirs), self._content_detection,
+                              self.use_git_index))
+            self._scan_cache = ScanCache(self._cache_dir, SCAN_CACHE_MAX_SIZE, signature)
 
-        self.repos_directory = repos_directory
-        self._ext_lang_mapper = ExtLangMapper()
+    def refresh_languages(self):
+        """Rebuilds the language structures if the language cache has loaded different languages"""
+        if self._language_cache is None:
+            return
+        version, languages = self._language_cache.get()
+        if version == self._languages_version:
+            return
+        with self._languages_lock:
+            if version != self._languages_version:
+                logging.info("Languages changed, rebuilding the extension mapper")
+                self._set_languages(languages)
+                self._languages_version = version
 
     def run_scanner(self, repo_id):
         """Performs scanning of repository folder by its id
         :returns set of names of languages found in repo"""
+        return self.scan_repository(repo_id).lang_names
+
+    def scan_repository(self, repo_id, collect_files=False):
+        """Performs scanning of repository folder by its id and saves the found files
+        :param collect_files: whether the found files are kept in the result,
+        also when they are streamed to the database
+        :returns ScanResult"""
 
         logging.info("Scanning directory {}".format(os.path.join(self.repos_directory, repo_id)))
         # Raise error if repo_id is not found among folders
@@ -29,37 +376,183 @@ class RepoScanner:
             raise Exception('\'{}\' was not found in the download directory of repositories'.format(repo_id))
 
         # lang_ids_for_repo = self._db_get_languages_for_repo(repo_id)
-        files_langs, present_langs = self.get_repo_files_langs(repo_id)
+        start = time.perf_counter()
+        files_langs = None
+        if self.streaming:
+            # Measures the walk apart from the database write
+            timed_files = TimedIterator(self.scan_repo_files_langs(repo_id))
+            files = timed_files
+            if collect_files:
+                files_langs = FileList()
+                files = files_langs.collect(timed_files)
+            # Files are inserted while the walk progresses, present languages are known afterwards
+            repo_lang_ids, present_langs = self._db_insert_repo_languages_files(repo_id, None, self._measure(files))
+        else:
+            # Paths of the files are joined only when they are written
+            timed_files = TimedIterator(self.scan_repo_dir_files_langs(repo_id))
+            files_langs = FileList()
+            files_langs.add_all(timed_files)
+            present_langs = list(files_langs.present_lang_ids())
+            repo_lang_ids, _ = self._db_insert_repo_languages_files(
+                repo_id, present_langs, self._measure(files_langs))
+        total_seconds = time.perf_counter() - start
+        observe_scan(self.get_language_name, timed_files, total_seconds)
+        # Stages of the traced message: the walk (with language classification), and the database write
+        record_stage('walk', timed_files.seconds)
+        record_stage('db_write', max(total_seconds - timed_files.seconds, 0.0))
 
-        if not files_langs:
+        if not present_langs:
             logging.warning("No known source files found in the repo")
 
-        self._db_insert_repo_languages_files(repo_id, present_langs, files_langs)
-
         # Make list of names of languages from their ids
-        return [self._language_id_name[lang_id] for lang_id in present_langs]
+        return ScanResult(self.get_language_names(present_langs),
+                          dict((name, lang_id) for lang_id, name in self._language_id_name.items()),
+                          dict((self._language_id_name[lang_id], repo_lang_id)
+                               for lang_id, repo_lang_id in repo_lang_ids.items()),
+                          files_langs if collect_files else None)
+
+    def _measure(self, files_langs):
+        """:returns files_langs with sizes and line counts of the files if they are saved"""
+        if self._file_stats is None:
+            return files_langs
+        return self._file_stats.measure_files(files_langs)
+
+    def get_language_name(self, lang_id):
+        """:returns name of the language with given ID, or None if unknown"""
+        return self._language_id_name.get(lang_id)
+
+    def get_language_names(self, lang_ids):
+        """:returns list of names of languages with given IDs"""
+        return [self._language_id_name[lang_id] for lang_id in lang_ids]
 
     def get_repo_files_langs(self, repo_id) -> (list, list):
         """Extracts source files and the present languages from the repo folder
         :returns tuple of found files' paths and present languages' IDs"""
+        files_langs = list(self.iter_repo_files_langs(repo_id))
         # Set of ids of the present languages in repo
-        present_lang_ids = set()
-        files_langs = []
-        os.chdir(self.repos_directory)
-        for dirpath, dirs, files in os.walk(repo_id):
+        present_lang_ids = set(lang_id for _, lang_id in files_langs)
+        return files_langs, list(present_lang_ids)
+
+    def scan_repo_files_langs(self, repo_id):
+        """Source files of the repo, read from the scan cache if the repository
+        did not change since it was cached, otherwise found by walking the repo folder
+        :returns iterator of (file path, language ID) tuples"""
+        self.refresh_languages()
+        if self._scan_cache is None:
+            return self.iter_repo_files_langs(repo_id)
+        fingerprint = self._scan_cache.fingerprint(os.path.join(self.repos_directory, repo_id))
+        cached = self._scan_cache.get(repo_id, fingerprint)
+        if cached is not None:
+            logging.info("Repository did not change since its last scan, using cached scan result")
+            return cached
+        return self._scan_cache.record(repo_id, fingerprint, self.iter_repo_files_langs(repo_id))
+
+    def scan_repo_dir_files_langs(self, repo_id):
+        """Source files of the repo like scan_repo_files_langs, with directory paths
+        and file names apart. Found by the walk, they are not joined and split again
+        :returns iterator of (directory path, file name, language ID) tuples"""
+        if self._scan_cache is None and not self.log_files:
+            self.refresh_languages()
+            return self._walk_repo_dir_files_langs(repo_id)
+        return self._split_paths(self.scan_repo_files_langs(repo_id))
+
+    @staticmethod
+    def _split_paths(files_langs):
+        for file_path, lang_id in files_langs:
+            dirpath, _, filename = file_path.rpartition(os.sep)
+            yield dirpath, filename, lang_id
+
+    def iter_repo_files_langs(self, repo_id):
+        """Source files found in the repo folder, yielded while the folder is walked.
+        Does not change the working directory, so repositories can be scanned concurrently
+        :returns iterator of (file path relative to the repositories directory,
+        language ID) tuples"""
+        files_langs = self._walk_repo_files_langs(repo_id)
+        if self.log_files:
+            return self._log_files_langs(files_langs)
+        return files_langs
+
+    @staticmethod
+    def _log_files_langs(files_langs):
+        for file_path, lang_id in files_langs:
+            logging.info("Found a source file {}".format(file_path))
+            yield file_path, lang_id
+
+    def _walk_repo_files_langs(self, repo_id):
+        """Generator of source files found in the repo folder, without logging
+        :returns iterator of (file path, language ID) tuples"""
+        join = os.path.join
+        for rel_dirpath, filename, lang_id in self._walk_repo_dir_files_langs(repo_id):
+            yield join(rel_dirpath, filename), lang_id
+
+    def _walk_repo_dir_files_langs(self, repo_id):
+        """Generator of source files found in the repo folder, without logging
+        :returns iterator of (directory path relative to the repositories directory,
+        file name, language ID) tuples"""
+        classify = self._ext_lang_mapper.classify
+        detector = self._content_detector
+        # Files waiting for content detection, as (absolute path, file name, language or None)
+        detect_files = []
+        root = os.path.join(self.repos_directory, repo_id)
+        tree = None
+        if self.use_git_index:
+            index_paths = read_index_paths(root)
+            if index_paths is not None:
+                logging.info("Listing files of the repository from its git index")
+                tree = self._index_tree(root, index_paths)
+        if tree is None:
+            tree = walk_tree(root, self._is_pruned, self.walk_threads, self.parallel_min_dirs)
+        for dirpath, files in tree:
+            # Path of the directory relative to the repositories directory
+            rel_dirpath = repo_id + dirpath[len(root):]
             # For every file found in the directory
             for filename in files:
-                # Extract extension from the name
-                extension = self.get_file_extension(filename)
-                # Get language id by file extension
-                lang_id = self._ext_lang_mapper.get_language_id(extension)
-                if lang_id:
-                    file_path = os.path.join(dirpath, filename)
-                    logging.info("Found a source file {}".format(file_path))
-                    files_langs.append((file_path, lang_id))
-                    present_lang_ids.add(lang_id)
-        os.chdir('..')
-        return files_langs, list(present_lang_ids)
+                # Get language by file name or extension
+                lang = classify(filename)
+                if detector is not None and detector.needs_detection(filename, lang):
+                    detect_files.append((os.path.join(dirpath, filename), filename, lang))
+                    if len(detect_files) >= SCAN_DETECT_BATCH_SIZE:
+                        yield from self._detect_files_langs(repo_id, root, detect_files)
+                        detect_files = []
+                elif lang is not None:
+                    yield rel_dirpath, filename, lang[0]
+        if detect_files:
+            yield from self._detect_files_langs(repo_id, root, detect_files)
+
+    def _detect_files_langs(self, repo_id, root, detect_files):
+        """Detects languages of a batch of files by their content
+        :returns iterator of (directory path, file name, language ID) tuples of the source files"""
+        langs = self._content_detector.detect_batch(detect_files)
+        for (path, filename, _), lang in zip(detect_files, langs):
+            if lang is not None:
+                yield repo_id + os.path.dirname(path)[len(root):], filename, lang[0]
+
+    def _index_tree(self, root, index_paths):
+        """Groups paths read from the git index by directory, skipping files
+        in pruned directories
+        :returns iterator of (dirpath, filenames) tuples, like walk_tree"""
+        # Paths in the index are sorted, so files of one directory mostly come one after another
+        last_dirname = None
+        dir_pruned = False
+        filenames = []
+        for path in index_paths:
+            dirname, _, filename = path.rpartition('/')
+            if dirname != last_dirname:
+                if filenames:
+                    yield self._index_dirpath(root, last_dirname), filenames
+                    filenames = []
+                last_dirname = dirname
+                dir_pruned = bool(dirname) and any(self._is_pruned(name) for name in dirname.split('/'))
+            if not dir_pruned:
+                filenames.append(filename)
+        if filenames:
+            yield self._index_dirpath(root, last_dirname), filenames
+
+    @staticmethod
+    def _index_dirpath(root, dirname):
+        """:returns path of a directory of the git index, the root itself for files at the top level
+        (joining an empty name would add a trailing separator)"""
+        return os.path.join(root, *dirname.split('/')) if dirname else root
 
     def _db_get_languages_for_repo(self, repo_id):
         """:returns list of language IDs given for repository ID in
@@ -72,29 +565,23 @@ class RepoScanner:
 
     def _db_insert_repo_languages_files(self, repo_id, present_langs, files_langs):
         """Inserts repository_language entries in the database if there are none.
-        Updates present languages according to found languages ids (present_langs).
-        Inserts repository_language_file entries (files_langs)."""
-        # repo_lang_ids - dictionary that maps language id to repository_language entry id for this repo
-        # Select existing entries
+        Updates present languages according to found languages ids (present_langs),
+        or to the languages of files_langs if present_langs is None.
+        Inserts repository_language_file entries (files_langs), which may be a generator,
+        with sizes and line counts of the files if they are measured.
+        In incremental mode, only the difference against stored entries is written.
+        Everything is written in a single transaction.
+        :returns tuple of dictionary mapping language IDs to ids of repository_language
+        entries, and IDs of the present languages"""
         logging.info("Updating repository languages and inserting files in the database")
-        repo_lang_ids = dict(DbManager.select_repository_languages(repo_id))
-        if not repo_lang_ids:
-            # Insert new entries and return their ids
-            repo_lang_ids = dict(DbManager.insert_repository_languages(repo_id))
-        # Update present repository languages
-        DbManager.update_present_repository_languages(repo_id, present_langs)
         try:
-            # Make list of files and corresponding repository_language ids
-            repo_lang_files = [(repo_lang_ids[lang], file) for (file, lang) in files_langs]
-            # Insert all files to database
-            DbManager.insert_repository_language_files(repo_lang_files)
+            repo_lang_ids, present_langs = DbManager.save_repository_scan(
+                repo_id, present_langs, files_langs, self.incremental, file_stats=self._file_stats is not None)
+            return repo_lang_ids, list(present_langs)
+        except RepositoryNotFoundError:
+            raise Exception(f'Did not found repository \'{repo_id}\' in the repositories table.')
         except KeyError as e:
             raise Exception(
                 f"A repository_language entry for language ID={e} and repo \'{repo_id}\'"
                 f" is missing, but other entries for this repo were found. repository_language entries for given"
                 f" repo should exist for either all languages or none.")
-
-    def get_file_extension(self, filename):
-        """:returns extension from a file name string. If no extension, returns None"""
-        ext_search = self.__ext_pattern.search(filename)
-        return ext_search.group(1) if ext_search else None
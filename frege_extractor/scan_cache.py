@@ -0,0 +1,174 @@
+import os
+import gzip
+import hashlib
+import logging
+import tempfile
+import threading
+
+# Suffix of cache files, one per repository
+CACHE_FILE_SUFFIX = '.scan.gz'
+
+
+def _read_text(path):
+    try:
+        with open(path, 'r') as file:
+            return file.read().strip()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def git_head_commit(repo_path):
+    """:returns hash of the commit checked out in a git repository,
+    or None if the folder is not a git repository"""
+    git_dir = os.path.join(repo_path, '.git')
+    head = _read_text(os.path.join(git_dir, 'HEAD'))
+    if not head:
+        return None
+    if not head.startswith('ref: '):
+        # Detached HEAD
+        return head
+    ref = head[len('ref: '):]
+    commit = _read_text(os.path.join(git_dir, ref))
+    if commit:
+        return commit
+    packed_refs = _read_text(os.path.join(git_dir, 'packed-refs'))
+    for line in (packed_refs or '').splitlines():
+        if line.endswith(' ' + ref):
+            return line.split(' ', 1)[0]
+    return None
+
+
+def stat_digest(repo_path):
+    """:returns digest of inode numbers and modification times of the
+    repository folder and its top-level entries"""
+    digest = hashlib.sha1()
+    stat = os.stat(repo_path)
+    digest.update(f'{stat.st_ino}:{stat.st_mtime_ns}'.encode())
+    with os.scandir(repo_path) as entries:
+        for entry in sorted(entries, key=lambda e: e.name):
+            stat = entry.stat(follow_symlinks=False)
+            digest.update(f'\0{entry.name}:{stat.st_ino}:{stat.st_mtime_ns}'.encode('utf-8', 'surrogateescape'))
+    return digest.hexdigest()
+
+
+class ScanCache:
+    """On-disk cache of repository scan results. Every repository has one gzip file
+    with a fingerprint of the scanned tree, followed by (language id, path) records.
+    Least recently used files are removed when the cache exceeds max_size bytes."""
+
+    def __init__(self, directory, max_size, signature=''):
+        """:param signature: description of the scanner configuration, results
+        of a differently configured scanner are not reused"""
+        self.directory = directory
+        self.max_size = max_size
+        self._signature = hashlib.sha1(signature.encode()).hexdigest()[:16]
+        os.makedirs(directory, exist_ok=True)
+        # Running total of the sizes of the cache files, guarded by the lock.
+        # The directory is scanned again only when the total exceeds max_size
+        self._lock = threading.Lock()
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def fingerprint(self, repo_path):
+        """:returns cheap fingerprint of the repository tree: the checked out commit
+        for git repositories, otherwise a digest of top-level inodes and mtimes"""
+        commit = git_head_commit(repo_path)
+        if commit:
+            return f'{self._signature}:git:{commit}'
+        return f'{self._signature}:stat:{stat_digest(repo_path)}'
+
+    def _path(self, repo_id):
+        return os.path.join(self.directory, repo_id + CACHE_FILE_SUFFIX)
+
+    def get(self, repo_id, fingerprint):
+        """:returns iterator of cached (file path, language id) tuples of the
+        repository, or None if there is no result for this fingerprint"""
+        path = self._path(repo_id)
+        try:
+            file = gzip.open(path, 'rb')
+            if file.readline().rstrip(b'\n').decode() != fingerprint:
+                file.close()
+                return None
+        except (OSError, EOFError, UnicodeDecodeError):
+            return None
+        # Mark the entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return self._read_records(file)
+
+    @staticmethod
+    def _read_records(file):
+        with file:
+            rest = b''
+            while True:
+                chunk = file.read(1 << 16)
+                if not chunk:
+                    break
+                records = (rest + chunk).split(b'\0')
+                rest = records.pop()
+                for record in records:
+                    lang_id, file_path = record.split(b'\t', 1)
+                    yield os.fsdecode(file_path), int(lang_id)
+
+    def record(self, repo_id, fingerprint, files_langs):
+        """Passes (file path, language id) tuples through while writing them to the cache.
+        The cache entry is stored only if the iterator is exhausted"""
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        complete = False
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=1) as file:
+                file.write(fingerprint.encode() + b'\n')
+                for file_path, lang_id in files_langs:
+                    file.write(b'%d\t%s\0' % (lang_id, os.fsencode(file_path)))
+                    yield file_path, lang_id
+            size = os.path.getsize(temp_path)
+            path = self._path(repo_id)
+            try:
+                # Size of the replaced entry of the repository
+                size -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(temp_path, path)
+            complete = True
+        finally:
+            if not complete:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+        with self._lock:
+            self._size += size
+            evict = self._size > self.max_size
+        if evict:
+            self._evict()
+
+    def _entries(self):
+        """:returns list of (modification time, size, path) tuples of the cache files"""
+        entries = []
+        with os.scandir(self.directory) as dir_entries:
+            for entry in dir_entries:
+                if entry.name.endswith(CACHE_FILE_SUFFIX):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        """Removes least recently used entries until the cache fits in max_size,
+        and resynchronizes the running total with the directory"""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                logging.info("Evicted scan cache entry {}".format(path))
+            except OSError:
+                pass
+            total -= size
+        with self._lock:
+            self._size = total
@@ -0,0 +1,98 @@
+import unittest
+from unittest import mock
+from extractor.frege_extractor import async_db_manager
+from extractor.frege_extractor.async_db_manager import AsyncDbManager, UPSERT_REPOSITORY_LANGUAGES_QUERY, \
+    SYNC_REPOSITORY_LANGUAGE_FILES_QUERY
+from extractor.frege_extractor.db_manager import CREATE_SCANNED_FILE_QUERY, RepositoryNotFoundError
+
+
+class FakeContext:
+
+    def __init__(self, value=None):
+        self._value = value
+
+    async def __aenter__(self):
+        return self._value
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeConnection:
+    """asyncpg connection recording statements and the records copied to tables"""
+
+    def __init__(self, repo_exists=True):
+        self.statements = []
+        self.copied = {}
+        self._repo_exists = repo_exists
+
+    def transaction(self):
+        return FakeContext()
+
+    async def fetchval(self, query, *args):
+        self.statements.append(query)
+        return 1 if self._repo_exists else None
+
+    async def execute(self, query, *args):
+        self.statements.append(query)
+
+    async def fetch(self, query, *args):
+        self.statements.append(query)
+        return [{'language_id': 8, 'id': 108}, {'language_id': 6, 'id': 106}]
+
+    async def fetchrow(self, query, *args):
+        self.statements.append(query)
+        return 1, 2
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.statements.append('COPY ' + table)
+        self.copied[table] = [record async for record in records]
+
+
+async def _files_langs():
+    for file_lang in [('repo/a.py', 8), ('repo/b.js', 6), ('repo/c.py', 8)]:
+        yield file_lang
+
+
+class AsyncDbManagerTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.connection = FakeConnection()
+        self.db = AsyncDbManager()
+        self.db._pool = mock.Mock()
+        self.db._pool.acquire.side_effect = lambda: FakeContext(self.connection)
+
+    async def test_save_repository_scan(self):
+        with mock.patch.object(async_db_manager, 'DB_REPOSITORY_LOCK', False):
+            present = await self.db.save_repository_scan('repo', _files_langs())
+        self.assertSetEqual(present, {6, 8})
+        # Files are streamed with COPY, mapped to their repository_language entries
+        self.assertListEqual(self.connection.copied['repository_language_file'],
+                             [(108, 'repo/a.py'), (106, 'repo/b.js'), (108, 'repo/c.py')])
+        self.assertEqual(self.connection.statements[1], UPSERT_REPOSITORY_LANGUAGES_QUERY)
+        self.assertEqual(self.connection.statements[2], 'COPY repository_language_file')
+        self.assertIn("UPDATE repository_language SET present = 'True'", self.connection.statements[3])
+
+    async def test_save_repository_scan_incremental(self):
+        with mock.patch.object(async_db_manager, 'DB_REPOSITORY_LOCK', True):
+            present = await self.db.save_repository_scan('repo', _files_langs(), incremental=True)
+        self.assertSetEqual(present, {6, 8})
+        self.assertEqual(len(self.connection.copied['scanned_file']), 3)
+        self.assertListEqual(self.connection.statements[1:6], [
+            "SELECT pg_advisory_xact_lock($1, hashtext($2))",
+            UPSERT_REPOSITORY_LANGUAGES_QUERY,
+            CREATE_SCANNED_FILE_QUERY,
+            'COPY scanned_file',
+            "ANALYZE scanned_file"])
+        self.assertEqual(self.connection.statements[6], SYNC_REPOSITORY_LANGUAGE_FILES_QUERY)
+        self.assertNotIn('%(repo_id)s', SYNC_REPOSITORY_LANGUAGE_FILES_QUERY)
+
+    async def test_missing_repository(self):
+        self.connection = FakeConnection(repo_exists=False)
+        with self.assertRaises(RepositoryNotFoundError):
+            await self.db.save_repository_scan('repo', _files_langs())
+        self.assertDictEqual(self.connection.copied, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import unittest
+from unittest import mock
+from extractor.frege_extractor import async_messenger
+from extractor.frege_extractor.async_messenger import AsyncMessenger
+from extractor.frege_extractor.db_manager import RepositoryNotFoundError
+from extractor.frege_extractor.repo_scanner import RepoScanner
+
+LANGUAGES = [(1, 'C'), (2, 'C++'), (3, 'C#'), (4, 'CSS'), (5, 'Java'), (6, 'JS'), (7, 'PHP'), (8, 'Python'),
+             (9, 'Ruby')]
+
+
+class FakeQueueIterator:
+    """Asynchronous iterator of input messages, like aio_pika's queue iterator"""
+
+    def __init__(self, messages):
+        self._messages = list(messages)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._messages:
+            # Lets the handled messages finish before the consumer stops
+            await asyncio.sleep(0.05)
+            raise StopAsyncIteration
+        return self._messages.pop(0)
+
+
+def _message(body):
+    return mock.Mock(body=body, ack=mock.AsyncMock())
+
+
+class AsyncMessengerTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.messenger = AsyncMessenger(max_in_flight=2)
+        self.messenger._db = mock.AsyncMock()
+        self.messenger.repo_scanner = RepoScanner('repo_test_dir', languages=LANGUAGES, cache_dir='',
+                                                  log_files=False)
+        self.messenger._channel = mock.Mock()
+        self.messenger._channel.default_exchange.publish = mock.AsyncMock()
+        patcher = mock.patch.object(async_messenger, 'REPOSITORIES_DIRECTORY', 'repo_test_dir')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        self.messenger._executor.shutdown()
+
+    async def test_in_flight_messages_are_bounded(self):
+        queue = mock.Mock()
+        queue.iterator.return_value = FakeQueueIterator(_message(b'{}') for _ in range(6))
+        channel = mock.AsyncMock()
+        channel.declare_queue.return_value = queue
+        connection = mock.AsyncMock()
+        connection.channel.return_value = channel
+        handling = []
+        handled = []
+
+        async def input_callback(message, received):
+            handling.append(message)
+            handled.append(len(handling))
+            await asyncio.sleep(0.01)
+            handling.remove(message)
+
+        self.messenger._input_callback = input_callback
+        with mock.patch.object(async_messenger.aio_pika, 'connect_robust', return_value=connection), \
+                mock.patch.object(async_messenger, 'RepoScanner'):
+            await self.messenger.app('localhost', 5672)
+        channel.set_qos.assert_awaited_once_with(prefetch_count=2)
+        self.assertEqual(len(handled), 6)
+        self.assertEqual(max(handled), 2)
+        connection.close.assert_awaited_once_with()
+        self.messenger._db.close.assert_awaited_once_with()
+
+    async def test_scan_saves_and_publishes(self):
+        saved = []
+
+        async def save_repository_scan(repo_id, files_langs, incremental):
+            async for file_lang in files_langs:
+                saved.append(file_lang)
+            return {lang_id for _, lang_id in saved}
+
+        self.messenger._db.save_repository_scan.side_effect = save_repository_scan
+        message = _message(b'{"repo_id": "fibonacci-lcs"}')
+        await self.messenger._input_callback(message, 0)
+        self.assertEqual(len(saved), 11)
+        queues = [call[1]['routing_key'] for call in self.messenger._channel.default_exchange.publish.call_args_list]
+        self.assertSetEqual(set(queues), {async_messenger.OUTPUT_QUEUES[lang] for lang in
+                                          ('C++', 'C#', 'Java', 'JS', 'Python', 'Ruby')})
+        message.ack.assert_awaited_once_with()
+
+    async def test_message_is_acknowledged_on_failure(self):
+        self.messenger._db.save_repository_scan.side_effect = RepositoryNotFoundError('fibonacci-lcs')
+        for body in (b'not json', b'{"repo_id": "missing-repo"}', b'{"repo_id": "fibonacci-lcs"}'):
+            with self.subTest(body=body):
+                message = _message(body)
+                await self.messenger._input_callback(message, 0)
+                message.ack.assert_awaited_once_with()
+        self.messenger._channel.default_exchange.publish.assert_not_called()
+
+    async def test_rejected_publish_is_retried(self):
+        publish = self.messenger._channel.default_exchange.publish
+        publish.side_effect = [async_messenger.aio_pika.exceptions.DeliveryError(None, None), None]
+        with mock.patch.object(async_messenger.asyncio, 'sleep', new=mock.AsyncMock()) as sleep:
+            await self.messenger._send_message({'repo_id': 'repo'}, ['analyze-python'])
+        sleep.assert_awaited_once_with(async_messenger.RMQ_REJECTED_PUBLISH_DELAY)
+        self.assertEqual(publish.await_count, 2)
+        self.assertEqual(json.loads(publish.call_args[0][0].body), {'repo_id': 'repo'})
+
+    async def test_walk_advances_in_batches(self):
+        with mock.patch.object(async_messenger, 'SCAN_BATCH_SIZE', 2), \
+                mock.patch.object(async_messenger, '_take', wraps=async_messenger._take) as take:
+            files_langs = [file_lang async for file_lang in self.messenger._iter_batches(iter(range(5)))]
+        self.assertListEqual(files_langs, list(range(5)))
+        self.assertEqual(take.call_count, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
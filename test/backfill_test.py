@@ -0,0 +1,94 @@
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from extractor.frege_extractor import backfill
+from extractor.frege_extractor.backfill import Backfill, read_checkpoint, append_checkpoint, list_repositories
+from extractor.frege_extractor.repo_scanner import FileList
+
+LANGUAGES = [(1, 'C'), (2, 'C++'), (3, 'C#'), (4, 'CSS'), (5, 'Java'), (6, 'JS'), (7, 'PHP'), (8, 'Python'),
+             (9, 'Ruby')]
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.directory, 'backfill.checkpoint')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_missing_checkpoint(self):
+        self.assertDictEqual(read_checkpoint(self.checkpoint), {})
+
+    def test_append_and_read(self):
+        append_checkpoint(self.checkpoint, {'a': ['Python', 'JS'], 'b': []})
+        append_checkpoint(self.checkpoint, {'c': ['Ruby']})
+        self.assertDictEqual(read_checkpoint(self.checkpoint), {'a': ['Python', 'JS'], 'b': [], 'c': ['Ruby']})
+
+
+class BackfillTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.repos_dir = os.path.join(self.directory, 'repos')
+        for repo_id in ('fibonacci-lcs', 'scripts-repo', 'vendored-repo'):
+            shutil.copytree(os.path.join('repo_test_dir', repo_id), os.path.join(self.repos_dir, repo_id))
+        self.checkpoint = os.path.join(self.directory, 'backfill.checkpoint')
+        self.backfill = Backfill(self.repos_dir, self.checkpoint, 2, 2, False)
+        self.backfill._language_id_name = dict(LANGUAGES)
+        self.saved_batches = []
+        # Worker initialization lowers the level of the root logger
+        self.log_level = logging.getLogger().level
+
+    def tearDown(self) -> None:
+        logging.getLogger().setLevel(self.log_level)
+        shutil.rmtree(self.directory)
+
+    def _save_repository_scans(self, scans, incremental=False):
+        self.saved_batches.append([repo_id for repo_id, _ in scans])
+        return dict((repo_id, files.present_lang_ids()) for repo_id, files in scans)
+
+    def test_resume_after_crash(self):
+        # A run that crashed after saving the first batch
+        append_checkpoint(self.checkpoint, {'fibonacci-lcs': ['Python']})
+        with mock.patch.object(backfill, 'ProcessPoolExecutor', ThreadPoolExecutor), \
+                mock.patch.object(backfill.DbManager, 'select_languages', return_value=LANGUAGES), \
+                mock.patch.object(backfill.DbManager, 'close_pool'), \
+                mock.patch.object(backfill.DbManager, 'save_repository_scans',
+                                  side_effect=self._save_repository_scans):
+            self.backfill.run()
+        self.assertListEqual(sorted(sum(self.saved_batches, [])), ['scripts-repo', 'vendored-repo'])
+        done = read_checkpoint(self.checkpoint)
+        self.assertListEqual(list(done), list_repositories(self.repos_dir))
+        self.assertListEqual(done['scripts-repo'], ['C'])
+
+    def test_batch_failure_saves_repositories_one_by_one(self):
+        batch = [('a', FileList([('a/main.py', 8)])), ('b', FileList([('b/main.rb', 9)])),
+                 ('c', FileList([('c/main.js', 6)]))]
+
+        def save_repository_scan(repo_id, present_lang_ids, files, incremental):
+            if repo_id == 'b':
+                raise KeyError(9)
+            return {}, present_lang_ids
+
+        with mock.patch.object(backfill.DbManager, 'save_repository_scans', side_effect=KeyError(9)), \
+                mock.patch.object(backfill.DbManager, 'save_repository_scan', side_effect=save_repository_scan):
+            self.assertEqual(self.backfill._save(batch), (2, 1))
+        # The failed repository is scanned again by the next run
+        self.assertDictEqual(read_checkpoint(self.checkpoint), {'a': ['Python'], 'c': ['JS']})
+
+    def test_missing_repository_is_not_checkpointed(self):
+        batch = [('a', FileList([('a/main.py', 8)])), ('missing', FileList([('missing/main.py', 8)]))]
+        with mock.patch.object(backfill.DbManager, 'save_repository_scans',
+                               return_value={'a': {8}}):
+            self.assertEqual(self.backfill._save(batch), (1, 1))
+        self.assertDictEqual(read_checkpoint(self.checkpoint), {'a': ['Python']})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,334 @@
+import time
+import threading
+import contextlib
+import unittest
+from unittest import mock
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+from extractor.frege_extractor import db_manager
+from extractor.frege_extractor.repo_scanner import FileList
+from extractor.frege_extractor.db_manager import DbManager, ConnectionPool, _CopyReader, REPOSITORY_EXISTS_QUERY, \
+    LOCK_REPOSITORY_QUERY, UPSERT_REPOSITORY_LANGUAGES_QUERY, CREATE_SCANNED_FILE_QUERY, \
+    SYNC_REPOSITORY_LANGUAGE_FILES_QUERY
+
+
+class FakeCursor:
+    """Cursor recording statements, whose copy_expert reads the file like psycopg2:
+    an exception raised by read() is replaced with QueryCanceled"""
+
+    def __init__(self, copy_error=None):
+        self.statements = []
+        self.copied = None
+        self._copy_error = copy_error
+
+    def execute(self, query, params=None):
+        self.statements.append(query)
+
+    def copy_expert(self, query, file, size=8192):
+        self.statements.append(query)
+        if self._copy_error is not None:
+            raise self._copy_error
+        chunks = []
+        try:
+            while True:
+                chunk = file.read(size)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        except Exception as e:
+            raise psycopg2.errors.QueryCanceled("error in .read() call: {} {}".format(type(e).__name__, e))
+        self.copied = ''.join(chunks)
+
+
+class CopyReaderTest(unittest.TestCase):
+
+    def test_escaping(self):
+        reader = _CopyReader(iter([(1, 'a\\b\tc'), (2, 'line\nbreak\r'), (3, None)]))
+        self.assertEqual(reader.read(), '1\ta\\\\b\\tc\n2\tline\\nbreak\\r\n3\t\\N\n')
+        self.assertTrue(reader.consumed)
+
+    def test_partial_reads(self):
+        rows = [(i, 'file_{}.py'.format(i)) for i in range(100)]
+        expected = ''.join('{}\tfile_{}.py\n'.format(i, i) for i in range(100))
+        reader = _CopyReader(iter(rows))
+        chunks = []
+        while True:
+            chunk = reader.read(7)
+            if not chunk:
+                break
+            self.assertLessEqual(len(chunk), 7)
+            chunks.append(chunk)
+        self.assertEqual(''.join(chunks), expected)
+
+    def test_empty(self):
+        reader = _CopyReader(iter([]))
+        self.assertEqual(reader.read(10), '')
+        self.assertFalse(reader.consumed)
+
+
+class BulkInsertTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        if DbManager.logger is None:
+            DbManager.init_logger()
+
+    def setUp(self) -> None:
+        DbManager._copy_permitted = True
+
+    def tearDown(self) -> None:
+        DbManager._copy_permitted = db_manager.DB_USE_COPY
+
+    def test_copy(self):
+        cursor = FakeCursor()
+        DbManager.bulk_insert(cursor, 'repository_language_file', ('repository_language_id', 'file_path'),
+                              [(1, 'a.py'), (2, 'b.js')])
+        self.assertEqual(cursor.copied, '1\ta.py\n2\tb.js\n')
+        self.assertListEqual(cursor.statements, [
+            "SAVEPOINT bulk_insert",
+            "COPY repository_language_file (repository_language_id, file_path) FROM STDIN",
+            "RELEASE SAVEPOINT bulk_insert"])
+
+    def test_iterator_error_is_raised(self):
+        def rows():
+            yield 1, 'a.py'
+            raise KeyError(5)
+
+        with self.assertRaises(KeyError):
+            DbManager.bulk_insert(FakeCursor(), 'repository_language_file',
+                                  ('repository_language_id', 'file_path'), rows())
+
+    def test_fallback_when_copy_is_refused(self):
+        cursor = FakeCursor(copy_error=psycopg2.errors.InsufficientPrivilege("permission denied"))
+        with mock.patch.object(psycopg2.extras, 'execute_values') as execute_values:
+            DbManager.bulk_insert(cursor, 'repository_language_file', ('repository_language_id', 'file_path'),
+                                  [(1, 'a.py'), (2, 'b.js')])
+        self.assertIn("ROLLBACK TO SAVEPOINT bulk_insert", cursor.statements)
+        self.assertFalse(DbManager._copy_permitted)
+        (_, query, rows), _ = execute_values.call_args
+        self.assertEqual(query, "INSERT INTO repository_language_file (repository_language_id, file_path) VALUES %s")
+        # No rows were lost by the refused COPY
+        self.assertListEqual(list(rows), [(1, 'a.py'), (2, 'b.js')])
+
+
+class ScanCursor(FakeCursor):
+    """FakeCursor answering the queries of saving repository scans"""
+
+    def __init__(self, copy_error=None, existing=()):
+        super().__init__(copy_error)
+        self._existing = existing
+
+    def fetchone(self):
+        if self.statements[-1] == SYNC_REPOSITORY_LANGUAGE_FILES_QUERY:
+            # Numbers of removed and added files
+            return 1, 2
+        return (1,)
+
+    def fetchall(self):
+        if self.statements[-1] == UPSERT_REPOSITORY_LANGUAGES_QUERY:
+            return [(8, 108), (6, 106)]
+        return [(repo_id,) for repo_id in self._existing]
+
+
+class RepositoryLockTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        DbManager._copy_permitted = True
+
+    def tearDown(self) -> None:
+        DbManager._copy_permitted = db_manager.DB_USE_COPY
+
+    def _save(self, lock):
+        cursor = ScanCursor()
+        with mock.patch.object(db_manager, 'DB_REPOSITORY_LOCK', lock):
+            DbManager._save_repository_scan(cursor, 'repo', [8], iter([('repo/a.py', 8)]), False, True)
+        return cursor.statements
+
+    def test_lock_before_save(self):
+        self.assertListEqual(self._save(True)[:4], [
+            REPOSITORY_EXISTS_QUERY, LOCK_REPOSITORY_QUERY, UPSERT_REPOSITORY_LANGUAGES_QUERY,
+            "SAVEPOINT bulk_insert"])
+        self.assertNotIn(LOCK_REPOSITORY_QUERY, self._save(False))
+
+
+class SaveRepositoryScansTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        DbManager._copy_permitted = True
+
+    def tearDown(self) -> None:
+        DbManager._copy_permitted = db_manager.DB_USE_COPY
+
+    def test_one_copy_for_all_repositories(self):
+        cursor = ScanCursor(existing=['b', 'a'])
+        scans = [('b', FileList([('b/main.js', 6)])), ('missing', FileList([('missing/a.py', 8)])),
+                 ('a', FileList([('a/main.py', 8)]))]
+        with mock.patch.object(DbManager, 'transaction', return_value=contextlib.nullcontext(cursor)), \
+                mock.patch.object(db_manager, 'DB_REPOSITORY_LOCK', True):
+            present = DbManager.save_repository_scans(scans)
+        # Missing repositories are skipped
+        self.assertDictEqual(present, {'a': {8}, 'b': {6}})
+        # Locks are taken in the order of repo ids
+        self.assertListEqual(cursor.statements[1:5], [LOCK_REPOSITORY_QUERY, UPSERT_REPOSITORY_LANGUAGES_QUERY] * 2)
+        self.assertEqual(cursor.statements.count("COPY repository_language_file (repository_language_id, file_path) "
+                                                 "FROM STDIN"), 1)
+        self.assertEqual(cursor.copied, '108\ta/main.py\n106\tb/main.js\n')
+
+
+class IncrementalSaveTest(unittest.TestCase):
+
+    FILES_LANGS = [('repo/a.py', 8), ('repo/b.js', 6)]
+
+    def setUp(self) -> None:
+        DbManager._copy_permitted = True
+
+    def tearDown(self) -> None:
+        DbManager._copy_permitted = db_manager.DB_USE_COPY
+
+    def _save(self, cursor):
+        with mock.patch.object(db_manager, 'DB_REPOSITORY_LOCK', True):
+            return DbManager._save_repository_scan(cursor, 'repo', None, iter(self.FILES_LANGS), True, True)
+
+    def test_statements(self):
+        cursor = ScanCursor()
+        repo_lang_ids, present = self._save(cursor)
+        self.assertDictEqual(repo_lang_ids, {8: 108, 6: 106})
+        self.assertSetEqual(present, {6, 8})
+        # Scanned files are copied to the temporary table and diffed against the stored ones
+        self.assertEqual(cursor.copied, '108\trepo/a.py\n106\trepo/b.js\n')
+        self.assertListEqual(cursor.statements[:-1], [
+            REPOSITORY_EXISTS_QUERY,
+            LOCK_REPOSITORY_QUERY,
+            UPSERT_REPOSITORY_LANGUAGES_QUERY,
+            CREATE_SCANNED_FILE_QUERY,
+            "SAVEPOINT bulk_insert",
+            "COPY scanned_file (repository_language_id, file_path) FROM STDIN",
+            "RELEASE SAVEPOINT bulk_insert",
+            "ANALYZE scanned_file",
+            SYNC_REPOSITORY_LANGUAGE_FILES_QUERY,
+            "DROP TABLE scanned_file"])
+        # 'present' is reset for languages that are no longer found
+        self.assertIn("SET present = (language_id = ANY(", cursor.statements[-1])
+
+    def test_fallback_when_copy_is_refused(self):
+        cursor = ScanCursor(copy_error=psycopg2.errors.InsufficientPrivilege("permission denied"))
+        with mock.patch.object(psycopg2.extras, 'execute_values') as execute_values:
+            self._save(cursor)
+        (_, query, rows), _ = execute_values.call_args
+        self.assertEqual(query, "INSERT INTO scanned_file (repository_language_id, file_path) VALUES %s")
+        self.assertListEqual(list(rows), [(108, 'repo/a.py'), (106, 'repo/b.js')])
+        # The difference is still written after the fallback
+        self.assertListEqual(cursor.statements[6:10], [
+            "ROLLBACK TO SAVEPOINT bulk_insert",
+            "ANALYZE scanned_file",
+            SYNC_REPOSITORY_LANGUAGE_FILES_QUERY,
+            "DROP TABLE scanned_file"])
+
+
+class FakeConnection:
+
+    def __init__(self, number):
+        self.number = number
+        self.closed = 0
+        self.healthy = True
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            def execute(self, query, params=None):
+                if not connection.healthy:
+                    raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        return Cursor()
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.connections = []
+
+    def _factory(self):
+        connection = FakeConnection(len(self.connections))
+        self.connections.append(connection)
+        return connection
+
+    def _pool(self, size=2, max_idle=300, health_check=30):
+        return ConnectionPool(self._factory, size, max_idle, health_check)
+
+    def test_blocks_at_size(self):
+        pool = self._pool(size=1)
+        connection = pool.get()
+        taken = []
+        thread = threading.Thread(target=lambda: taken.append(pool.get()))
+        thread.start()
+        thread.join(0.1)
+        self.assertTrue(thread.is_alive())
+        pool.put(connection)
+        thread.join(1)
+        self.assertListEqual(taken, [connection])
+        self.assertEqual(len(self.connections), 1)
+
+    def test_reuses_most_recently_used(self):
+        pool = self._pool()
+        first, second = pool.get(), pool.get()
+        pool.put(first)
+        pool.put(second)
+        self.assertIs(pool.get(), second)
+        self.assertEqual(pool.stats()['reused'], 1)
+
+    def test_expires_idle_connections(self):
+        pool = self._pool(max_idle=0.01)
+        connection = pool.get()
+        pool.put(connection)
+        time.sleep(0.02)
+        self.assertIsNot(pool.get(), connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()['expired'], 1)
+
+    def test_reconnects_after_failed_health_check(self):
+        pool = self._pool(health_check=0)
+        connection = pool.get()
+        pool.put(connection)
+        connection.healthy = False
+        new_connection = pool.get()
+        self.assertIsNot(new_connection, connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()['reconnected'], 1)
+        # A healthy connection passes the check
+        pool.put(new_connection)
+        self.assertIs(pool.get(), new_connection)
+
+    def test_discards_broken_connections(self):
+        pool = self._pool(size=1)
+        connection = pool.get()
+        connection.closed = 2
+        pool.put(connection)
+        self.assertEqual(pool.stats()['discarded'], 1)
+        self.assertEqual(pool.stats()['idle'], 0)
+        # The slot of the discarded connection is free
+        self.assertIsNot(pool.get(), connection)
+
+    def test_rolls_back_open_transactions(self):
+        pool = self._pool()
+        connection = pool.get()
+        connection.status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        pool.put(connection)
+        self.assertEqual(connection.rollbacks, 1)
+        self.assertIs(pool.get(), connection)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+from extractor.frege_extractor.ext_lang_mapper import ExtLangMapper
+
+LANGUAGES = [(1, 'C'), (2, 'C++'), (3, 'C#'), (4, 'CSS'), (5, 'Java'), (6, 'JS'), (7, 'PHP'), (8, 'Python'),
+             (9, 'Ruby')]
+
+# File name, expected (language id, language name) or None
+CLASSIFY_TABLE = [
+    # Exact file names
+    ('SConstruct', (8, 'Python')),
+    ('Rakefile', (9, 'Ruby')),
+    ('Makefile', None),
+    # Extensions
+    ('main.c', (1, 'C')),
+    ('main.C', (2, 'C++')),
+    ('app.min.js', (6, 'JS')),
+    ('archive.tar.gz', None),
+    ('main.PY', None),
+    # Dotfiles
+    ('.gitignore', None),
+    ('.eslintrc.js', (6, 'JS')),
+    # Names without an extension
+    ('README', None),
+    ('trailing.', None),
+    ('', None),
+]
+
+
+class ExtLangMapperTest(unittest.TestCase):
+
+    def test_classify(self):
+        mapper = ExtLangMapper(LANGUAGES)
+        for filename, lang in CLASSIFY_TABLE:
+            with self.subTest(filename=filename):
+                self.assertEqual(mapper.classify(filename), lang)
+
+    def test_classify_multi_dot_suffix(self):
+        mapper = ExtLangMapper(LANGUAGES)
+        mapper._suffix_lang['ts'] = (6, 'JS')
+        mapper._suffix_lang['d.ts'] = (3, 'C#')
+        mapper._max_suffix_parts = 2
+        table = CLASSIFY_TABLE + [
+            # The longest known suffix wins
+            ('index.d.ts', (3, 'C#')),
+            ('d.ts', (6, 'JS')),
+            ('.d.ts', (3, 'C#')),
+            ('index.ts', (6, 'JS')),
+            ('index.d.js', (6, 'JS')),
+        ]
+        for filename, lang in table:
+            with self.subTest(filename=filename):
+                self.assertEqual(mapper.classify(filename), lang)
+
+    def test_missing_language(self):
+        with self.assertRaises(SystemExit):
+            ExtLangMapper(LANGUAGES[1:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import unittest
+from extractor.frege_extractor.file_stats import FileStats, MMAP_MIN_SIZE
+
+
+class FileStatsTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.repos_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.repos_dir, 'repo'))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.repos_dir)
+
+    def _write(self, name, content):
+        with open(os.path.join(self.repos_dir, 'repo', name), 'wb') as file:
+            file.write(content)
+        return os.path.join('repo', name)
+
+    def test_measure_files(self):
+        files_langs = [
+            (self._write('empty.py', b''), 8),
+            (self._write('one.py', b'pass'), 8),
+            (self._write('two.js', b'a;\nb;\n'), 6),
+            (self._write('crlf.rb', b'a\r\nb\r\nc'), 9),
+            (os.path.join('repo', 'missing.py'), 8),
+        ]
+        file_stats = FileStats(self.repos_dir, line_counts=True, batch_size=2)
+        self.assertListEqual(list(file_stats.measure_files(files_langs)), [
+            (os.path.join('repo', 'empty.py'), 8, 0, 0),
+            (os.path.join('repo', 'one.py'), 8, 4, 1),
+            (os.path.join('repo', 'two.js'), 6, 6, 2),
+            (os.path.join('repo', 'crlf.rb'), 9, 7, 3),
+            (os.path.join('repo', 'missing.py'), 8, None, None),
+        ])
+
+    def test_measure_large_file(self):
+        content = b'x = 1\n' * (MMAP_MIN_SIZE // 3) + b'last'
+        path = self._write('large.py', content)
+        self.assertTupleEqual(FileStats(self.repos_dir, line_counts=True).measure(path),
+                              (len(content), MMAP_MIN_SIZE // 3 + 1))
+
+    def test_measure_sizes_only(self):
+        path = self._write('one.py', b'a\nb\n')
+        self.assertTupleEqual(FileStats(self.repos_dir).measure(path), (4, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+from extractor.frege_extractor.git_index import read_index_paths, read_index_entry_count, parse_index, GitIndexError
+from extractor.frege_extractor.repo_scanner import RepoScanner, estimate_repo_size, DbManager
+
+
+@unittest.skipUnless(shutil.which('git'), "git is not installed")
+class GitIndexTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.repos_dir = tempfile.mkdtemp()
+        self.repo_path = os.path.join(self.repos_dir, 'fibonacci-lcs')
+        shutil.copytree(os.path.join('repo_test_dir', 'fibonacci-lcs'), self.repo_path)
+        os.makedirs(os.path.join(self.repo_path, 'vendor'))
+        with open(os.path.join(self.repo_path, 'vendor', 'lib.py'), 'w') as file:
+            file.write('pass\n')
+        self._git('init', '-q')
+        self._git('add', '-A')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.repos_dir)
+
+    def _git(self, *args):
+        subprocess.run(['git', '-C', self.repo_path] + list(args), check=True, capture_output=True)
+
+    def _walk_paths(self):
+        paths = set()
+        for dirpath, dirs, files in os.walk(self.repo_path):
+            dirs[:] = [d for d in dirs if d != '.git']
+            for filename in files:
+                rel_path = os.path.relpath(os.path.join(dirpath, filename), self.repo_path)
+                paths.add(rel_path.replace(os.sep, '/'))
+        return paths
+
+    def test_read_index_entry_count(self):
+        self.assertEqual(read_index_entry_count(self.repo_path), len(self._walk_paths()))
+        self.assertEqual(estimate_repo_size(self.repo_path, 1), len(self._walk_paths()))
+
+    def test_read_index_versions(self):
+        for version in ('2', '3', '4'):
+            self._git('update-index', '--index-version', version)
+            self.assertSetEqual(set(read_index_paths(self.repo_path)), self._walk_paths())
+
+    def test_read_index_skip_worktree(self):
+        self._git('update-index', '--skip-worktree', 'README.md')
+        self.assertSetEqual(set(read_index_paths(self.repo_path)), self._walk_paths() - {'README.md'})
+
+    def test_read_index_invalid(self):
+        with open(os.path.join(self.repo_path, '.git', 'index'), 'rb') as file:
+            data = bytearray(file.read())
+        data[20] ^= 0xff
+        with self.assertRaises(GitIndexError):
+            parse_index(bytes(data))
+        self.assertIsNone(read_index_paths(os.path.join(self.repo_path, 'lcs')))
+
+    def test_scanner_index_and_walk(self):
+        index_scanner = RepoScanner(self.repos_dir, use_git_index=True)
+        walk_scanner = RepoScanner(self.repos_dir, use_git_index=False)
+        index_files, index_langs = index_scanner.get_repo_files_langs('fibonacci-lcs')
+        walk_files, walk_langs = walk_scanner.get_repo_files_langs('fibonacci-lcs')
+        self.assertEqual(len(index_files), 11)
+        self.assertSetEqual(set(index_files), set(walk_files))
+        self.assertSetEqual(set(index_langs), set(walk_langs))
+
+    def test_scanner_index_top_level_file(self):
+        with open(os.path.join(self.repo_path, 'top.py'), 'w') as file:
+            file.write('pass\n')
+        self._git('add', 'top.py')
+        for streaming in (False, True):
+            with self.subTest(streaming=streaming):
+                scanner = RepoScanner(self.repos_dir, streaming=streaming, use_git_index=True, cache_dir='',
+                                      log_files=False)
+                saved = []
+
+                def save(repo_id, present_langs, files_langs, *args, **kwargs):
+                    saved.extend(files_langs)
+                    return {}, {lang_id for _, lang_id in saved}
+
+                with mock.patch.object(DbManager, 'save_repository_scan', side_effect=save):
+                    scanner.scan_repository('fibonacci-lcs')
+                paths = [file_path for file_path, _ in saved]
+                self.assertIn(os.path.join('fibonacci-lcs', 'top.py'), paths)
+                self.assertIn(os.path.join('fibonacci-lcs', 'lcs', 'lcs_py.py'), paths)
+                self.assertFalse([path for path in paths if os.sep + os.sep in path])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+from unittest import mock
+from extractor.frege_extractor.language_cache import LanguageCache
+
+
+class LanguageCacheTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.languages = [(1, 'C'), (2, 'C++')]
+        self.loads = 0
+
+        def loader():
+            self.loads += 1
+            return list(self.languages)
+
+        self.loader = loader
+
+    def test_loaded_once(self):
+        cache = LanguageCache(ttl=0, loader=self.loader)
+        self.assertEqual(cache.get(), (1, [(1, 'C'), (2, 'C++')]))
+        cache.get()
+        cache.languages()
+        self.assertEqual(self.loads, 1)
+
+    def test_reloaded_after_ttl(self):
+        cache = LanguageCache(ttl=60, loader=self.loader)
+        with mock.patch('time.monotonic', return_value=1000.0):
+            cache.get()
+        with mock.patch('time.monotonic', return_value=1030.0):
+            cache.get()
+        self.assertEqual(self.loads, 1)
+        self.languages.append((3, 'C#'))
+        with mock.patch('time.monotonic', return_value=1061.0):
+            version, languages = cache.get()
+        self.assertEqual(self.loads, 2)
+        self.assertEqual(version, 2)
+        self.assertIn((3, 'C#'), languages)
+
+    def test_invalidate(self):
+        cache = LanguageCache(ttl=0, loader=self.loader)
+        cache.get()
+        cache.invalidate()
+        # Same languages are reloaded, the version does not change
+        self.assertEqual(cache.get()[0], 1)
+        self.assertEqual(self.loads, 2)
+
+    def test_failed_reload_keeps_languages(self):
+        cache = LanguageCache(ttl=0, loader=self.loader)
+        cache.get()
+        cache.invalidate()
+        self.languages = None
+        self.assertEqual(cache.get(), (1, [(1, 'C'), (2, 'C++')]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from extractor.frege_extractor.manifest import manifest_name, write_manifest, remove_manifests, language_messages
+from extractor.frege_extractor.repo_scanner import FileList, ScanResult
+
+
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.repos_dir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.repos_dir)
+
+    def _read_manifest(self, name):
+        with open(os.path.join(self.repos_dir, name), 'rb') as file:
+            return file.read()
+
+    def test_write_manifest(self):
+        paths = [os.path.join('repo', 'a.py'), os.path.join('repo', 'źródło.py')]
+        name = write_manifest(self.repos_dir, 'repo', 'analyze-python', paths)
+        self.assertEqual(name, manifest_name('repo', 'analyze-python'))
+        self.assertEqual(self._read_manifest(name), b''.join(path.encode('utf-8') + b'\0' for path in paths))
+        # No temporary files are left
+        self.assertListEqual(os.listdir(self.repos_dir), [name])
+
+    def test_write_manifest_error_removes_temporary_file(self):
+        def paths():
+            yield 'repo/a.py'
+            raise OSError("walk failed")
+
+        with self.assertRaises(OSError):
+            write_manifest(self.repos_dir, 'repo', 'analyze-python', paths())
+        self.assertListEqual(os.listdir(self.repos_dir), [])
+
+    def test_remove_manifests(self):
+        write_manifest(self.repos_dir, 'repo', 'analyze-python', ['repo/a.py'])
+        write_manifest(self.repos_dir, 'repo', 'analyze-js', ['repo/a.js'])
+        remove_manifests(self.repos_dir, 'repo', ['analyze-python', 'analyze-ruby'])
+        self.assertListEqual(os.listdir(self.repos_dir), [manifest_name('repo', 'analyze-js')])
+
+    def test_language_messages(self):
+        files = FileList([('repo/a.py', 8), ('repo/b.js', 6), ('repo/c.py', 8)])
+        scan = ScanResult(['Python', 'JS'], {'Python': 8, 'JS': 6}, {'Python': 108, 'JS': 106}, files)
+        # A manifest left by an earlier scan, when JS had more files
+        write_manifest(self.repos_dir, 'repo', 'analyze-js', ['repo/old.js'])
+        messages = language_messages({'repo_id': 'repo'}, scan, self.repos_dir, inline_max_files=1)
+        self.assertListEqual([queue for queue, _ in messages], ['analyze-python', 'analyze-js'])
+        python, js = [json.loads(body) for _, body in messages]
+        self.assertDictEqual(python, {'repo_id': 'repo', 'repository_language_id': 108, 'file_count': 2,
+                                      'manifest': manifest_name('repo', 'analyze-python')})
+        self.assertEqual(self._read_manifest(python['manifest']), b'repo/a.py\0repo/c.py\0')
+        self.assertDictEqual(js, {'repo_id': 'repo', 'repository_language_id': 106, 'file_count': 1,
+                                  'files': ['repo/b.js']})
+        self.assertListEqual(os.listdir(self.repos_dir), [manifest_name('repo', 'analyze-python')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import json
+import unittest
+from collections import Counter
+from concurrent.futures import Future
+from unittest import mock
+from extractor.frege_extractor import messenger
+from extractor.frege_extractor.messenger import Messenger, LARGE_QUEUE, shard_of, shard_queue
+from extractor.frege_extractor.profiling import Tracer
+from extractor.frege_extractor.repo_scanner import FileList, ScanResult
+
+
+class FakePublisher:
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, messages, exchange=''):
+        self.published.extend(messages)
+        future = Future()
+        future.set_result(None)
+        return future
+
+
+class ShardTest(unittest.TestCase):
+
+    def test_shard_of_is_stable(self):
+        # Fixed values: every node and router must agree on the shards of repositories
+        self.assertListEqual([shard_of(repo_id, 8) for repo_id in ('fibonacci-lcs', 'torvalds/linux', 'a', '')],
+                             [6, 4, 4, 1])
+        self.assertEqual(shard_of('fibonacci-lcs', 1), 0)
+
+    def test_shard_of_distribution(self):
+        repo_ids = ['repo-{}'.format(i) for i in range(10000)]
+        counts = Counter(shard_of(repo_id, 8) for repo_id in repo_ids)
+        self.assertListEqual(sorted(counts), list(range(8)))
+        for count in counts.values():
+            self.assertAlmostEqual(count, 1250, delta=150)
+        # A new shard takes about 1/9 of the repositories, the others stay in place
+        moved = [repo_id for repo_id in repo_ids if shard_of(repo_id, 9) != shard_of(repo_id, 8)]
+        self.assertAlmostEqual(len(moved), 10000 / 9, delta=150)
+        self.assertSetEqual({shard_of(repo_id, 9) for repo_id in moved}, {8})
+
+    def test_router_publishes_to_shard(self):
+        router = Messenger(shards=4, router=True)
+        router._publisher = FakePublisher()
+        channel = mock.Mock(is_open=True)
+        channel.connection.add_callback_threadsafe.side_effect = lambda callback: callback()
+        body = b'{"repo_id": "fibonacci-lcs"}'
+        router._input_callback_router(channel, mock.Mock(delivery_tag=1), None, body)
+        self.assertListEqual(router._publisher.published, [(shard_queue(shard_of('fibonacci-lcs', 4)), body)])
+        channel.basic_ack.assert_called_once_with(delivery_tag=1)
+        # Invalid messages are dropped
+        router._input_callback_router(channel, mock.Mock(delivery_tag=2), None, b'{}')
+        self.assertEqual(len(router._publisher.published), 1)
+        channel.basic_ack.assert_called_with(delivery_tag=2)
+
+    def test_shard_queues(self):
+        router = Messenger(shards=3, router=True)
+        router._input_channel = mock.Mock()
+        router._declare_shards()
+        self.assertListEqual([call[1]['queue'] for call in router._input_channel.queue_declare.call_args_list],
+                             [shard_queue(0), shard_queue(1), shard_queue(2)])
+        # A node consumes the queues of its shards
+        self.assertListEqual(Messenger(shards=3, shard_ids=[2], router=False)._input_queues, [shard_queue(2)])
+
+
+class LanesTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.messenger = Messenger(workers=2, shards=1, router=True, large_repo_files=10, large_workers=1)
+        self.messenger._publisher = FakePublisher()
+        self.messenger._executor = mock.Mock()
+        self.messenger._large_executor = mock.Mock()
+
+    def test_lane_routing(self):
+        channel = mock.Mock(is_open=True)
+        channel.connection.add_callback_threadsafe.side_effect = lambda callback: callback()
+        with mock.patch.object(messenger, 'REPOSITORIES_DIRECTORY', 'repo_test_dir'):
+            # fibonacci-lcs has about 20 files, it is moved to the large queue and acknowledged
+            body = b'{"repo_id": "fibonacci-lcs"}'
+            self.messenger._input_callback_concurrent(channel, mock.Mock(delivery_tag=1), None, body)
+            self.assertListEqual(self.messenger._publisher.published, [(LARGE_QUEUE, body)])
+            channel.basic_ack.assert_called_once_with(delivery_tag=1)
+            for tag, body in enumerate((b'{"repo_id": "missing-repo"}', b'not json'), 2):
+                self.messenger._input_callback_concurrent(channel, mock.Mock(delivery_tag=tag), None, body)
+        self.assertEqual(self.messenger._executor.submit.call_count, 2)
+        self.messenger._large_executor.submit.assert_not_called()
+        self.assertEqual(len(self.messenger._publisher.published), 1)
+        # Messages of the large queue are scanned in the large lane
+        self.messenger._large_callback(channel, mock.Mock(delivery_tag=1), None, body)
+        self.assertEqual(self.messenger._large_executor.submit.call_count, 1)
+
+    def test_prefetch(self):
+        self.messenger._router = False
+        connection = mock.Mock()
+        input_channel, large_channel = mock.Mock(), mock.Mock()
+        connection.channel.side_effect = [input_channel, large_channel]
+        self.messenger._create_channels(connection)
+        # Each lane has a prefetch count of its workers, on its own channel
+        input_channel.basic_qos.assert_called_once_with(prefetch_count=2)
+        large_channel.basic_qos.assert_called_once_with(prefetch_count=1)
+        large_channel.queue_declare.assert_called_once_with(queue=LARGE_QUEUE, durable=True)
+        self.assertIs(self.messenger._large_channel, large_channel)
+
+
+class MessengerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        # A router does not create a RepoScanner, so no database is needed
+        self.messenger = Messenger(shards=1, router=True)
+        self.messenger._publisher = FakePublisher()
+        self.messenger._tracer = Tracer(0, (), 0, '')
+
+    def test_finish_message_falls_back_to_input_message(self):
+        files = FileList([('repo/a.py', 8)])
+        scan = ScanResult(['Python'], {'Python': 8}, {'Python': 108}, files)
+        trace = self.messenger._tracer.start('repo')
+        with mock.patch.object(messenger, 'language_messages', side_effect=OSError("No space left on device")):
+            future = self.messenger._finish_message({'repo_id': 'repo'}, scan, trace)
+        future.result()
+        self.assertListEqual(self.messenger._publisher.published,
+                             [('analyze-python', bytes(json.dumps({'repo_id': 'repo'}), encoding='utf8'))])
+
+    def test_ack_on_delivering_connection(self):
+        channel = mock.Mock(is_open=True)
+        channel.connection.add_callback_threadsafe.side_effect = lambda callback: callback()
+        self.messenger._connection = mock.Mock()
+        self.messenger._ack_threadsafe(channel, 7)
+        channel.basic_ack.assert_called_once_with(delivery_tag=7)
+        self.messenger._connection.add_callback_threadsafe.assert_not_called()
+
+    def test_ack_of_closed_channel_is_dropped(self):
+        channel = mock.Mock(is_open=False)
+        channel.connection.add_callback_threadsafe.side_effect = lambda callback: callback()
+        self.messenger._ack_threadsafe(channel, 7)
+        channel.basic_ack.assert_not_called()
+        # The old connection is closed too
+        channel.connection.add_callback_threadsafe.side_effect = Exception("Connection is closed")
+        self.messenger._ack_threadsafe(channel, 8)
+        channel.basic_ack.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+from extractor.frege_extractor.metrics import Counter, Histogram, TimedIterator
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_counter_render(self):
+        counter = Counter('test_files', "Files", ['language'])
+        counter.inc(2, 'Python')
+        counter.inc(1, 'C++')
+        counter.inc(1, 'Python')
+        self.assertListEqual(counter.render(), [
+            '# HELP test_files_total Files',
+            '# TYPE test_files_total counter',
+            'test_files_total{language="C++"} 1',
+            'test_files_total{language="Python"} 3',
+        ])
+
+    def test_histogram_render(self):
+        histogram = Histogram('test_seconds', "Time", buckets=(1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(value)
+        self.assertListEqual(histogram.render(), [
+            '# HELP test_seconds Time',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{le="1.0"} 2',
+            'test_seconds_bucket{le="5.0"} 3',
+            'test_seconds_bucket{le="+Inf"} 4',
+            'test_seconds_sum 14.5',
+            'test_seconds_count 4',
+        ])
+
+    def test_timed_iterator(self):
+        timed_files = TimedIterator([('a.py', 8), ('b.py', 8), ('c.rb', 9)])
+        self.assertEqual(len(list(timed_files)), 3)
+        self.assertDictEqual(timed_files.lang_counts, {8: 2, 9: 1})
+        self.assertEqual(timed_files.files, 3)
+        self.assertGreaterEqual(timed_files.seconds, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+from extractor.frege_extractor.profiling import Tracer, record_stage
+
+
+class TracerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.profile_dir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.profile_dir)
+
+    def test_stages_of_current_thread(self):
+        tracer = Tracer(0, (), 60, self.profile_dir)
+        trace = tracer.start('repo')
+        record_stage('walk', 1.5)
+        record_stage('walk', 0.5)
+        with trace.stage('publish'):
+            pass
+        trace.detach()
+        # Stages of other messages are not recorded in a detached trace
+        record_stage('db_write', 1.0)
+        self.assertListEqual(list(trace.stages), ['walk', 'publish'])
+        self.assertEqual(trace.stages['walk'], 2.0)
+        self.assertFalse(trace.profiled)
+        trace.finish()
+        self.assertListEqual(os.listdir(self.profile_dir), [])
+
+    def test_slow_allow_listed_message_is_saved(self):
+        tracer = Tracer(0, {'slow-repo'}, 1e-9, self.profile_dir)
+        trace = tracer.start('slow-repo')
+        self.assertTrue(trace.profiled)
+        sorted(range(1000), key=lambda x: -x)
+        # Finished in another thread, like on publisher confirms
+        trace.detach()
+        self.assertIsNone(sys.getprofile())
+        thread = threading.Thread(target=trace.finish)
+        thread.start()
+        thread.join()
+        extensions = sorted(os.path.splitext(name)[1] for name in os.listdir(self.profile_dir))
+        self.assertListEqual(extensions, ['.json', '.prof', '.txt'])
+        # Profiling is available to the next message
+        trace = tracer.start('slow-repo')
+        self.assertTrue(trace.profiled)
+        trace.detach()
+
+    def test_fast_message_is_not_saved(self):
+        tracer = Tracer(1, (), 3600, self.profile_dir)
+        trace = tracer.start('repo')
+        self.assertTrue(trace.profiled)
+        trace.finish()
+        self.assertListEqual(os.listdir(self.profile_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
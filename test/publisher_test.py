@@ -0,0 +1,100 @@
+import unittest
+from unittest import mock
+import pika
+from extractor.frege_extractor.publisher import Publisher
+
+
+class FakeIOLoop:
+    """I/O loop running thread-safe callbacks at once and recording delayed ones"""
+
+    def __init__(self):
+        self.delayed = []
+
+    def add_callback_threadsafe(self, callback):
+        callback()
+
+    def call_later(self, delay, callback):
+        self.delayed.append((delay, callback))
+
+    def run_delayed(self):
+        delayed, self.delayed = self.delayed, []
+        for _, callback in delayed:
+            callback()
+
+
+def _frame(method_class, delivery_tag, multiple=False):
+    return mock.Mock(method=method_class(delivery_tag=delivery_tag, multiple=multiple))
+
+
+class PublisherTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.publisher = Publisher('localhost', 5672, retry_delay=1, max_retry_delay=4)
+        self.ioloop = self.publisher._ioloop = FakeIOLoop()
+        self.channel = self._open_channel()
+
+    def _open_channel(self):
+        channel = mock.Mock(is_open=True)
+        self.publisher._on_channel_open(channel)
+        channel.confirm_delivery.assert_called_once_with(
+            ack_nack_callback=self.publisher._on_delivery_confirmation, callback=self.publisher._on_confirm_select)
+        self.publisher._on_confirm_select(None)
+        return channel
+
+    @staticmethod
+    def _published(channel):
+        return [(call[1]['routing_key'], call[1]['body']) for call in channel.basic_publish.call_args_list]
+
+    def test_empty_batch(self):
+        self.assertTrue(self.publisher.publish([]).done())
+
+    def test_batches_are_confirmed(self):
+        first = self.publisher.publish([('analyze-python', b'1'), ('analyze-js', b'1')])
+        second = self.publisher.publish([('analyze-python', b'2')])
+        self.assertListEqual(self._published(self.channel),
+                             [('analyze-python', b'1'), ('analyze-js', b'1'), ('analyze-python', b'2')])
+        self.publisher._on_delivery_confirmation(_frame(pika.spec.Basic.Ack, 1))
+        self.assertFalse(first.done())
+        # One confirm of multiple deliveries
+        self.publisher._on_delivery_confirmation(_frame(pika.spec.Basic.Ack, 3, multiple=True))
+        self.assertTrue(first.done())
+        self.assertTrue(second.done())
+        self.assertDictEqual(self.publisher._unconfirmed, {})
+
+    def test_rejected_message_is_retried_with_backoff(self):
+        future = self.publisher.publish([('analyze-python', b'1'), ('analyze-js', b'1')])
+        delays = []
+        for tag in (1, 3, 4, 5):
+            self.publisher._on_delivery_confirmation(_frame(pika.spec.Basic.Nack, tag))
+            delays.extend(delay for delay, _ in self.ioloop.delayed)
+            self.ioloop.run_delayed()
+        # Exponential backoff up to the maximal delay
+        self.assertListEqual(delays, [1, 2, 4, 4])
+        self.assertListEqual([key for key, _ in self._published(self.channel)], ['analyze-python', 'analyze-js'] +
+                             ['analyze-python'] * 4)
+        self.publisher._on_delivery_confirmation(_frame(pika.spec.Basic.Ack, 2))
+        self.assertFalse(future.done())
+        self.publisher._on_delivery_confirmation(_frame(pika.spec.Basic.Ack, 6))
+        self.assertTrue(future.done())
+
+    def test_reconnect_resends_unconfirmed_then_outbox(self):
+        future = self.publisher.publish([('analyze-python', b'1'), ('analyze-js', b'1')])
+        self.publisher._on_delivery_confirmation(_frame(pika.spec.Basic.Ack, 1))
+        self.channel.is_open = False
+        later = self.publisher.publish([('analyze-ruby', b'2')])
+        with mock.patch.object(self.publisher, '_connect') as connect:
+            self.publisher._reconnect()
+            self.assertListEqual([delay for delay, _ in self.ioloop.delayed], [1])
+            self.ioloop.run_delayed()
+            connect.assert_called_once_with()
+        channel = self._open_channel()
+        # Unconfirmed messages are sent before the ones waiting in the outbox, delivery tags start again
+        self.assertListEqual(self._published(channel), [('analyze-js', b'1'), ('analyze-ruby', b'2')])
+        self.assertListEqual(list(self.publisher._unconfirmed), [1, 2])
+        self.publisher._on_delivery_confirmation(_frame(pika.spec.Basic.Ack, 2, multiple=True))
+        self.assertTrue(future.done())
+        self.assertTrue(later.done())
+
+
+if __name__ == '__main__':
+    unittest.main()
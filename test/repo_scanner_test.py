@@ -1,5 +1,11 @@
+import os
+import time
+import shutil
+import tempfile
 import unittest
-from extractor.frege_extractor.repo_scanner import RepoScanner
+from concurrent.futures import ThreadPoolExecutor
+from extractor.frege_extractor.repo_scanner import RepoScanner, FileList, estimate_repo_size, \
+    make_prune_matcher, _walk_parallel, _walk_serial
 
 
 class RepoScannerTest(unittest.TestCase):
@@ -28,11 +34,140 @@ class RepoScannerTest(unittest.TestCase):
         # Assert found languages
         self.assertSetEqual(set(result_langs), target_langs)
 
+    def test_get_files_langs_pruned(self):
+        result_files, result_langs = self.repo_scanner.get_repo_files_langs('vendored-repo')
+        target_files = {
+            (os.path.join('vendored-repo', 'app.js'), 6),
+            (os.path.join('vendored-repo', 'src', 'main.py'), 8),
+        }
+        # Files in node_modules and vendor directories are skipped
+        self.assertSetEqual(set(result_files), target_files)
+        self.assertSetEqual(set(result_langs), {6, 8})
+
+    def test_get_files_langs_parallel_threads(self):
+        cwd = os.getcwd()
+        repo_ids = ['fibonacci-lcs', 'vendored-repo'] * 4
+        target_files = {repo_id: set(self.repo_scanner.get_repo_files_langs(repo_id)[0])
+                        for repo_id in set(repo_ids)}
+        self.assertEqual(len(target_files['fibonacci-lcs']), 11)
+        with ThreadPoolExecutor(max_workers=len(repo_ids)) as executor:
+            results = executor.map(lambda repo_id: self.repo_scanner.get_repo_files_langs(repo_id)[0], repo_ids)
+            for repo_id, result_files in zip(repo_ids, results):
+                # Every scan emits paths of its own repo, relative to the repositories directory
+                self.assertSetEqual(set(result_files), target_files[repo_id])
+                for file_path, _ in result_files:
+                    self.assertTrue(file_path.startswith(repo_id + os.sep))
+                    self.assertTrue(os.path.isfile(os.path.join('repo_test_dir', file_path)))
+        self.assertEqual(os.getcwd(), cwd)
+
+    def test_get_files_langs_content_detection(self):
+        repo_scanner = RepoScanner('repo_test_dir', content_detection=True)
+        result_files, result_langs = repo_scanner.get_repo_files_langs('scripts-repo')
+        target_files = {
+            (os.path.join('scripts-repo', 'bin', 'build'), 8),
+            (os.path.join('scripts-repo', 'include', 'point.h'), 1),
+            (os.path.join('scripts-repo', 'include', 'shape.h'), 2),
+        }
+        # Shell scripts and text files without extension are skipped
+        self.assertSetEqual(set(result_files), target_files)
+        self.assertSetEqual(set(result_langs), {1, 2, 8})
+
+    def test_content_detector_kept_on_language_refresh(self):
+        repo_scanner = RepoScanner('repo_test_dir', content_detection=True)
+        detector = repo_scanner._content_detector
+        repo_scanner._set_languages([(id + 100, name) for id, name in repo_scanner._language_id_name.items()])
+        self.assertIs(repo_scanner._content_detector, detector)
+        # The detector maps languages with the new ids
+        _, result_langs = repo_scanner.get_repo_files_langs('scripts-repo')
+        self.assertSetEqual(set(result_langs), {101, 102, 108})
+
+    def test_estimate_repo_size(self):
+        repo_path = os.path.join('repo_test_dir', 'fibonacci-lcs')
+        # Entries of the top two levels, directories included
+        self.assertEqual(estimate_repo_size(repo_path, 1000), 20)
+        # Subdirectories are not listed once the limit is reached
+        self.assertEqual(estimate_repo_size(repo_path, 5), 5)
+        self.assertEqual(estimate_repo_size(os.path.join('repo_test_dir', 'missing-repo'), 1000), 0)
+
     def test_get_files_langs_empty(self):
         result_files, result_langs = self.repo_scanner.get_repo_files_langs('empty-repo')
         self.assertListEqual(result_files, [])
         self.assertListEqual(result_langs, [])
 
 
+class ParallelWalkTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        # Deep and unbalanced tree: a chain of directories with files and small subtrees
+        self.root = tempfile.mkdtemp()
+        dirpath = self.root
+        for depth in range(30):
+            for branch in range(3):
+                subtree = os.path.join(dirpath, 'b{}'.format(branch), 'leaf')
+                os.makedirs(subtree)
+                for i in range(3):
+                    open(os.path.join(subtree, 'f{}.py'.format(i)), 'w').close()
+            open(os.path.join(dirpath, 'f.py'), 'w').close()
+            dirpath = os.path.join(dirpath, 'd{}'.format(depth))
+            os.makedirs(dirpath)
+        self.is_pruned = make_prune_matcher([])
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    @staticmethod
+    def _files(walk, delay=0.0):
+        files = set()
+        for dirpath, filenames in walk:
+            # Slow consumer, so the walking threads wait on the full result queue
+            time.sleep(delay)
+            files.update(os.path.join(dirpath, filename) for filename in filenames)
+        return files
+
+    def test_parallel_walk_equals_serial_walk(self):
+        target_files = self._files(_walk_serial([self.root], self.is_pruned))
+        self.assertEqual(len(target_files), 30 * 10)
+        for _ in range(5):
+            self.assertSetEqual(self._files(_walk_parallel([self.root], self.is_pruned, 8)), target_files)
+        self.assertSetEqual(self._files(_walk_parallel([self.root], self.is_pruned, 2), 0.001), target_files)
+
+
+class FileListTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        files_langs = [
+            (os.path.join('repo', 'src', 'main.py'), 8),
+            (os.path.join('repo', 'src', 'util.py'), 8),
+            (os.path.join('repo', 'web', 'app.js'), 6),
+            (os.path.join('repo', 'src', 'źródło.rb'), 9),
+            ('setup.py', 8),
+        ]
+        file_list = FileList(files_langs)
+        self.assertEqual(len(file_list), 5)
+        self.assertListEqual(list(file_list), files_langs)
+        self.assertSetEqual(file_list.present_lang_ids(), {6, 8, 9})
+
+    def test_language_paths(self):
+        file_list = FileList([('a.py', 8), ('b.js', 6), ('c.py', 8)])
+        self.assertListEqual(list(file_list.language_paths(8)), ['a.py', 'c.py'])
+        self.assertEqual(file_list.language_count(8), 2)
+        self.assertEqual(file_list.language_count(2), 0)
+
+    def test_add_all(self):
+        file_list = FileList()
+        file_list.add_all([(os.path.join('repo', 'src'), 'main.py', 8), ('', 'setup.py', 8),
+                           (os.path.join('repo', 'src'), 'app.js', 6)])
+        self.assertListEqual(list(file_list), [(os.path.join('repo', 'src', 'main.py'), 8), ('setup.py', 8),
+                                               (os.path.join('repo', 'src', 'app.js'), 6)])
+        self.assertListEqual(list(file_list.language_paths(8)), [os.path.join('repo', 'src', 'main.py'), 'setup.py'])
+
+    def test_scan_dir_files_langs(self):
+        repo_scanner = RepoScanner('repo_test_dir', cache_dir='', log_files=False, content_detection=True)
+        for repo_id in ('fibonacci-lcs', 'scripts-repo'):
+            split_files = [(os.path.join(dirpath, filename), lang_id)
+                           for dirpath, filename, lang_id in repo_scanner.scan_repo_dir_files_langs(repo_id)]
+            self.assertListEqual(split_files, list(repo_scanner.scan_repo_files_langs(repo_id)))
+
+
 if __name__ == '__main__':
     unittest.main()
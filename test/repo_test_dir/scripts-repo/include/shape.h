@@ -0,0 +1,9 @@
+#ifndef SHAPE_H
+#define SHAPE_H
+namespace geometry {
+class Shape {
+public:
+    virtual double area() const = 0;
+};
+}
+#endif
@@ -0,0 +1,119 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from extractor.frege_extractor.scan_cache import ScanCache, git_head_commit, CACHE_FILE_SUFFIX
+
+COMMIT = '0123456789abcdef0123456789abcdef01234567'
+FILES_LANGS = [
+    (os.path.join('repo', 'src', 'main.py'), 8),
+    (os.path.join('repo', 'web', 'app.js'), 6),
+    (os.path.join('repo', 'źródło.rb'), 9),
+]
+
+
+class ScanCacheTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, 'cache')
+        self.cache = ScanCache(self.cache_dir, 1 << 20, 'signature')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def _cache_files(self):
+        return sorted(os.listdir(self.cache_dir))
+
+    def test_round_trip(self):
+        self.assertListEqual(list(self.cache.record('repo', 'fingerprint', iter(FILES_LANGS))), FILES_LANGS)
+        self.assertListEqual(list(self.cache.get('repo', 'fingerprint')), FILES_LANGS)
+        self.assertListEqual(self._cache_files(), ['repo' + CACHE_FILE_SUFFIX])
+
+    def test_interrupted_record_is_not_stored(self):
+        recording = self.cache.record('repo', 'fingerprint', iter(FILES_LANGS))
+        next(recording)
+        recording.close()
+        self.assertIsNone(self.cache.get('repo', 'fingerprint'))
+        # No temporary file is left
+        self.assertListEqual(self._cache_files(), [])
+
+    def test_fingerprint_mismatch(self):
+        list(self.cache.record('repo', 'fingerprint', iter(FILES_LANGS)))
+        self.assertIsNone(self.cache.get('repo', 'other fingerprint'))
+        self.assertIsNone(self.cache.get('other-repo', 'fingerprint'))
+
+    def test_fingerprint_signature(self):
+        repo_path = os.path.join(self.directory, 'repo')
+        os.makedirs(repo_path)
+        other_cache = ScanCache(self.cache_dir, 1 << 20, 'other signature')
+        self.assertNotEqual(self.cache.fingerprint(repo_path), other_cache.fingerprint(repo_path))
+
+    def test_lru_eviction(self):
+        list(self.cache.record('a', 'fingerprint', iter(FILES_LANGS)))
+        size = os.path.getsize(os.path.join(self.cache_dir, 'a' + CACHE_FILE_SUFFIX))
+        self.cache.max_size = size * 2 + size // 2
+        list(self.cache.record('b', 'fingerprint', iter(FILES_LANGS)))
+        now = time.time()
+        os.utime(os.path.join(self.cache_dir, 'a' + CACHE_FILE_SUFFIX), (now - 100, now - 100))
+        os.utime(os.path.join(self.cache_dir, 'b' + CACHE_FILE_SUFFIX), (now - 50, now - 50))
+        # Reading 'a' makes 'b' the least recently used entry
+        list(self.cache.get('a', 'fingerprint'))
+        list(self.cache.record('c', 'fingerprint', iter(FILES_LANGS)))
+        self.assertListEqual(self._cache_files(), ['a' + CACHE_FILE_SUFFIX, 'c' + CACHE_FILE_SUFFIX])
+
+    def test_size_is_tracked_without_scanning(self):
+        list(self.cache.record('a', 'fingerprint', iter(FILES_LANGS)))
+        list(self.cache.record('b', 'fingerprint', iter(FILES_LANGS[:1])))
+        with mock.patch('os.scandir', side_effect=AssertionError("the cache directory was scanned")):
+            # Replacing an entry counts only the difference of sizes
+            list(self.cache.record('a', 'fingerprint', iter(FILES_LANGS[1:])))
+        sizes = [os.path.getsize(os.path.join(self.cache_dir, name)) for name in self._cache_files()]
+        self.assertEqual(self.cache._size, sum(sizes))
+        # The total of existing entries is read once, when the cache is opened
+        self.assertEqual(ScanCache(self.cache_dir, 1 << 20)._size, sum(sizes))
+
+
+class GitHeadCommitTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.repo_path = tempfile.mkdtemp()
+        self.git_dir = os.path.join(self.repo_path, '.git')
+        os.makedirs(os.path.join(self.git_dir, 'refs', 'heads'))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.repo_path)
+
+    def _write(self, name, content):
+        with open(os.path.join(self.git_dir, name), 'w') as file:
+            file.write(content)
+
+    def test_not_git_repository(self):
+        shutil.rmtree(self.git_dir)
+        self.assertIsNone(git_head_commit(self.repo_path))
+
+    def test_detached_head(self):
+        self._write('HEAD', COMMIT + '\n')
+        self.assertEqual(git_head_commit(self.repo_path), COMMIT)
+
+    def test_branch_ref(self):
+        self._write('HEAD', 'ref: refs/heads/main\n')
+        self._write(os.path.join('refs', 'heads', 'main'), COMMIT + '\n')
+        self.assertEqual(git_head_commit(self.repo_path), COMMIT)
+
+    def test_packed_ref(self):
+        self._write('HEAD', 'ref: refs/heads/main\n')
+        self._write('packed-refs', '# pack-refs with: peeled fully-peeled sorted\n'
+                                   'ffffffffffffffffffffffffffffffffffffffff refs/heads/other\n'
+                                   '{} refs/heads/main\n'.format(COMMIT))
+        self.assertEqual(git_head_commit(self.repo_path), COMMIT)
+
+    def test_missing_ref(self):
+        self._write('HEAD', 'ref: refs/heads/main\n')
+        self.assertIsNone(git_head_commit(self.repo_path))
+
+
+if __name__ == '__main__':
+    unittest.main()